@@ -0,0 +1,78 @@
+"""
+Recorded fixtures of the offline benchmarks: model responses and generated smart contracts from
+`results-feb-24/*.sol` and `Chain-of-Thought-Results`, legal agreements from `test_contracts_txt`.
+"""
+import os
+import re
+import glob
+import shutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'results-feb-24')
+COT_DIR = os.path.join(ROOT, 'Chain-of-Thought-Results')
+AGREEMENTS_DIR = os.path.join(ROOT, 'test_contracts_txt')
+
+CODE_BLOCK_PATTERN = re.compile(r"```solidity\s*\n(.*?)```", re.DOTALL)
+
+
+def load_contracts():
+    """
+    :return: list of (name, Solidity source) of the recorded smart contracts
+    """
+    contracts = []
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, '*.sol'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            contracts.append((os.path.splitext(os.path.basename(path))[0], f.read()))
+    for path in sorted(glob.glob(os.path.join(COT_DIR, '*.txt'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            match = CODE_BLOCK_PATTERN.search(f.read())
+        if match:
+            contracts.append((os.path.splitext(os.path.basename(path))[0], match.group(1)))
+    return contracts
+
+
+def load_responses():
+    """
+    :return: list of recorded raw model responses (Solidity code block in a markdown answer)
+    """
+    responses = [f"Here is the smart contract implementing the agreement:\n\n```solidity\n{source}\n```\n"
+                 for name, source in load_contracts() if not name.endswith('-generated')]
+    # Chain-of-Thought responses are recorded as is
+    for path in sorted(glob.glob(os.path.join(COT_DIR, '*.txt'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            responses.append(f.read().replace('--- Generated Smart Contract ---', '').strip() + '\n')
+    return responses
+
+
+def make_agreements(root: str, n: int):
+    """
+    Copy n legal agreements (the recorded ones, cycled) to a folder
+    :return: folder path
+    """
+    sources = sorted(glob.glob(os.path.join(AGREEMENTS_DIR, '*.txt')))
+    os.makedirs(root, exist_ok=True)
+    for i in range(n):
+        source = sources[i % len(sources)]
+        shutil.copy(source, os.path.join(root, f"{i:04d}_{os.path.basename(source)}"))
+    return root
+
+
+def make_output_tree(root: str, n_models: int, n_iter: int, n_prompts: int, n_agreements: int, temperatures=(0.5,)):
+    """
+    Lay out recorded smart contracts as a pipeline output (`<model>/<iteration>/<prompt>/<agreement>/sc/*.sol`)
+    :return: number of smart contracts
+    """
+    contracts = load_contracts()
+    count = 0
+    for m in range(n_models):
+        for i in range(1, n_iter + 1):
+            for p in range(n_prompts):
+                for a in range(n_agreements):
+                    sc_dir = os.path.join(root, f"bench-model-{m}", str(i), f"PR{p + 1}", f"agreement-{a:04d}", 'sc')
+                    os.makedirs(sc_dir, exist_ok=True)
+                    for temperature in temperatures:
+                        _, source = contracts[count % len(contracts)]
+                        with open(os.path.join(sc_dir, f"agreement-{a:04d}_t{temperature}.sol"), 'w', encoding='utf-8') as f:
+                            f.write(source)
+                        count += 1
+    return count
@@ -0,0 +1,88 @@
+"""
+Import-time regression benchmark.
+
+Every entry point is imported in a fresh interpreter, with the provider API keys removed from the
+environment, and must neither load the heavy modules it does not need nor exceed its time budget.
+
+    python -m benchmarks.import_time [--repeat 5] [--budget-factor 1.0]
+
+Exits with status 1 on regression.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Provider SDKs, loaded with the first client of their provider (see pipeline/core/clients.py)
+SDK_MODULES = ['openai', 'anthropic', 'mistralai', 'google.generativeai', 'tiktoken']
+# Analysis libraries, loaded by the post-processing stages using them
+ANALYSIS_MODULES = ['pandas', 'pyarrow', 'nltk', 'solcx', 'docker']
+
+# Entry point -> (time budget in seconds, modules it must not load)
+ENTRY_POINTS = {
+    'pipeline.pipeline': (1.0, SDK_MODULES + ANALYSIS_MODULES),
+    'pipeline.batch': (1.0, SDK_MODULES + ANALYSIS_MODULES),
+    'pipeline.postprocessing': (1.0, SDK_MODULES + ANALYSIS_MODULES),
+    'pipeline.analysis.workers': (0.3, SDK_MODULES + ANALYSIS_MODULES),
+    'pipeline.core.cache': (0.5, SDK_MODULES + ANALYSIS_MODULES),
+    'pipeline.core.usage': (0.5, SDK_MODULES + ANALYSIS_MODULES),
+}
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'loaded': [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, forbidden: list):
+    """
+    Import a module in a fresh interpreter
+    :return: dict with 'elapsed' (seconds) and 'loaded' (forbidden modules found in sys.modules)
+    """
+    env = {key: value for key, value in os.environ.items() if not key.endswith('_API_KEY')}
+    proc = subprocess.run([sys.executable, '-c', PROBE.format(module=module, forbidden=forbidden)],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing '{module}' failed:\n{proc.stderr}")
+    # Modules may log or print while imported, the result is the last line
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time regression benchmark")
+    parser.add_argument('--repeat', type=int, default=5, help="fresh interpreters per entry point")
+    parser.add_argument('--budget-factor', type=float, default=1.0, help="scale the time budgets (slow machines)")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':<30} {'median':>9} {'budget':>9}  loaded")
+    for module, (budget, forbidden) in ENTRY_POINTS.items():
+        try:
+            runs = [measure(module, forbidden) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            failures.append(str(e))
+            print(f"{module:<30} {'error':>9}")
+            continue
+        median = statistics.median(run['elapsed'] for run in runs)
+        loaded = sorted({m for run in runs for m in run['loaded']})
+        budget *= args.budget_factor
+        print(f"{module:<30} {median:>8.3f}s {budget:>8.3f}s  {', '.join(loaded) or '-'}")
+        if median > budget:
+            failures.append(f"'{module}' imports in {median:.3f}s (budget {budget:.3f}s)")
+        if loaded:
+            failures.append(f"'{module}' loads {', '.join(loaded)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Local stand-in for the OpenAI, Anthropic and Mistral APIs, serving recorded responses (see `fixtures`)
+with configurable latency, errors and rate limits.
+
+    OpenAI:     POST /v1/chat/completions  (OPENAI_BASE_URL=http://127.0.0.1:<port>/v1, `n` and streaming supported)
+    Mistral:    POST /v1/chat/completions  (MISTRAL_BASE_URL=http://127.0.0.1:<port>)
+    Anthropic:  POST /v1/messages          (ANTHROPIC_BASE_URL=http://127.0.0.1:<port>, prompt caching emulated)
+
+    python -m benchmarks.mock_server [--port 8100] [--latency 0.5] [--jitter 0.2] [--error-rate 0.02] [--rpm 600]
+
+The first line printed is the listening port.
+"""
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .fixtures import load_responses
+
+
+def count_tokens(text: str):
+    # Rough estimate (4 characters per token), the server does not need a tokenizer
+    return max(1, len(text) // 4)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """HTTP server answering with recorded responses, picked deterministically from the seed"""
+
+    daemon_threads = True
+
+    def __init__(self, address, responses: list = None, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rpm: int = None, chunk_size: int = 64, chunk_delay: float = 0.0, seed: int = 0):
+        """
+        :param address: (host, port), port 0 picks a free one
+        :param responses: raw responses, the recorded fixtures by default
+        :param latency: mean time before the response (seconds)
+        :param jitter: latency spread, uniform in [latency - jitter, latency + jitter]
+        :param error_rate: share of requests failing with a 500
+        :param rpm: requests per minute accepted before answering 429 (with `retry-after`), unlimited if None
+        :param chunk_size: characters per streamed chunk
+        :param chunk_delay: delay between streamed chunks (seconds)
+        :param seed: random seed (responses, latencies and errors)
+        """
+        super().__init__(address, MockLLMHandler)
+        self.responses = responses or load_responses()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__window = collections.deque()
+        self.__cached_prefixes = set()
+        self.stats = collections.Counter()
+
+    def draw(self):
+        """
+        :return: (response, latency, fail) of a request
+        """
+        with self.__lock:
+            response = self.__random.choice(self.responses)
+            latency = max(0.0, self.latency + self.__random.uniform(-self.jitter, self.jitter))
+            fail = self.__random.random() < self.error_rate
+        return response, latency, fail
+
+    def throttle(self):
+        """
+        :return: seconds to wait before the next request if the rate limit is reached, else 0
+        """
+        if self.rpm is None:
+            return 0
+        with self.__lock:
+            now = time.monotonic()
+            while self.__window and now - self.__window[0] >= 60:
+                self.__window.popleft()
+            if len(self.__window) >= self.rpm:
+                return 60 - (now - self.__window[0])
+            self.__window.append(now)
+            return 0
+
+    def cache_prefix(self, prefix: str):
+        """
+        Emulate a provider prompt cache
+        :return: True on a cache hit
+        """
+        with self.__lock:
+            hit = prefix in self.__cached_prefixes
+            self.__cached_prefixes.add(prefix)
+            return hit
+
+    def count(self, key: str):
+        with self.__lock:
+            self.stats[key] += 1
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # One line per request would dominate the benchmark output
+        pass
+
+    def send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_events(self):
+        # Server-sent events, the connection is closed at the end of the stream
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+    def send_event(self, data: dict, event: str = None):
+        line = (f"event: {event}\n" if event else '') + f"data: {json.dumps(data)}\n\n"
+        self.wfile.write(line.encode('utf-8'))
+        self.wfile.flush()
+
+    def chunks(self, text: str):
+        size = self.server.chunk_size
+        for i in range(0, len(text), size):
+            if i and self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+            yield text[i:i + size]
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        anthropic = self.path.rstrip('/').endswith('/messages')
+        if not anthropic and not self.path.rstrip('/').endswith('/chat/completions'):
+            self.server.count('not_found')
+            return self.send_json(404, {'error': {'message': f"Unknown endpoint '{self.path}'", 'type': 'not_found'}})
+
+        wait = self.server.throttle()
+        if wait:
+            self.server.count('rate_limited')
+            error = {'type': 'error', 'error': {'type': 'rate_limit_error', 'message': 'Rate limit reached'}} if anthropic \
+                else {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}}
+            return self.send_json(429, error, {'retry-after': f"{wait:.1f}"})
+
+        response, latency, fail = self.server.draw()
+        time.sleep(latency)
+        if fail:
+            self.server.count('errors')
+            error = {'type': 'error', 'error': {'type': 'api_error', 'message': 'Internal server error'}} if anthropic \
+                else {'error': {'message': 'Internal server error', 'type': 'server_error'}}
+            return self.send_json(500, error)
+
+        self.server.count('requests')
+        if anthropic:
+            self.anthropic_messages(body, response)
+        else:
+            self.chat_completions(body, response)
+
+    def chat_completions(self, body: dict, response: str):
+        prompt = ''.join(message['content'] if isinstance(message['content'], str) else json.dumps(message['content'])
+                         for message in body.get('messages', []))
+        n = body.get('n') or 1
+        completion_id, created, model = f"chatcmpl-{uuid.uuid4().hex}", int(time.time()), body.get('model')
+        usage = {'prompt_tokens': count_tokens(prompt), 'completion_tokens': n * count_tokens(response)}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        if not body.get('stream'):
+            # The n samples cycle through the recorded responses
+            responses = [response] + [self.server.draw()[0] for _ in range(n - 1)]
+            return self.send_json(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                'choices': [{'index': i, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}
+                            for i, text in enumerate(responses)],
+                'usage': usage,
+            })
+        self.start_events()
+        chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model}
+        try:
+            for i, piece in enumerate(self.chunks(response)):
+                delta = {'role': 'assistant', 'content': piece} if i == 0 else {'content': piece}
+                self.send_event({**chunk, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})
+            self.send_event({**chunk, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped the generation early
+            self.server.count('stopped_streams')
+
+    def anthropic_messages(self, body: dict, response: str):
+        input_tokens, cache_read, cache_creation = 0, 0, 0
+        for message in body.get('messages', []):
+            blocks = [{'type': 'text', 'text': message['content']}] if isinstance(message['content'], str) else message['content']
+            for block in blocks:
+                tokens = count_tokens(block.get('text', ''))
+                if 'cache_control' in block:
+                    if self.server.cache_prefix(block.get('text', '')):
+                        cache_read += tokens
+                    else:
+                        cache_creation += tokens
+                else:
+                    input_tokens += tokens
+        usage = {'input_tokens': input_tokens, 'output_tokens': count_tokens(response),
+                 'cache_read_input_tokens': cache_read, 'cache_creation_input_tokens': cache_creation}
+        message = {'id': f"msg_{uuid.uuid4().hex}", 'type': 'message', 'role': 'assistant', 'model': body.get('model'),
+                   'stop_reason': None, 'stop_sequence': None}
+        if not body.get('stream'):
+            return self.send_json(200, {**message, 'content': [{'type': 'text', 'text': response}], 'stop_reason': 'end_turn', 'usage': usage})
+        self.start_events()
+        try:
+            self.send_event({'type': 'message_start', 'message': {**message, 'content': [], 'usage': {**usage, 'output_tokens': 1}}}, 'message_start')
+            self.send_event({'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}, 'content_block_start')
+            for piece in self.chunks(response):
+                self.send_event({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': piece}}, 'content_block_delta')
+            self.send_event({'type': 'content_block_stop', 'index': 0}, 'content_block_stop')
+            self.send_event({'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                             'usage': {'output_tokens': usage['output_tokens']}}, 'message_delta')
+            self.send_event({'type': 'message_stop'}, 'message_stop')
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.count('stopped_streams')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI/Anthropic/Mistral server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help="0 picks a free port")
+    parser.add_argument('--latency', type=float, default=0.0, help="mean response latency (seconds)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="latency spread (seconds)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests failing with a 500")
+    parser.add_argument('--rpm', type=int, default=None, help="requests per minute before answering 429")
+    parser.add_argument('--chunk-size', type=int, default=64, help="characters per streamed chunk")
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help="delay between streamed chunks (seconds)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockLLMServer((args.host, args.port), latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                           rpm=args.rpm, chunk_size=args.chunk_size, chunk_delay=args.chunk_delay, seed=args.seed)
+    print(server.server_address[1], flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(dict(server.stats)), file=sys.stderr, flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+"""
+Offline benchmark suite: throughput, tail latency and peak memory of the generation (`Pipeline.sweep`
+against the mock provider server) and of the post-processing (`SmartCMetrics.pipe` with the local backend
+and the replay tool standing in for Slither), at several grid sizes. No provider is paid, no container is run.
+
+    python -m benchmarks.run [generation|postprocessing|all] [--sizes small,medium] [--output before.json]
+    python -m benchmarks.run generation --latency 0.5 --jitter 0.3 --error-rate 0.02 --rpm 600 --stream
+    python -m benchmarks.run all --compare before.json
+
+Every case runs in a fresh interpreter (clean peak memory), on fresh output folders with the response cache disabled.
+The first run needs the tiktoken encodings (downloaded once, then cached).
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import platform
+import tempfile
+import subprocess
+from .fixtures import ROOT, make_agreements, make_output_tree
+
+REPLAY_TOOL = os.path.join(ROOT, 'benchmarks', 'replay_tool.py')
+
+# (provider, model name served by the mock server)
+BENCH_MODELS = [('openai', 'bench-gpt'), ('anthropic', 'bench-claude'), ('mistral', 'bench-mistral')]
+
+GENERATION_SIZES = {
+    'small': {'models': 1, 'prompts': 2, 'agreements': 5, 'n_iter': 1},      # 10 contracts
+    'medium': {'models': 3, 'prompts': 4, 'agreements': 5, 'n_iter': 2},     # 120 contracts
+    'large': {'models': 3, 'prompts': 6, 'agreements': 10, 'n_iter': 4},     # 720 contracts
+}
+POSTPROCESSING_SIZES = {
+    'small': {'models': 1, 'n_iter': 1, 'prompts': 2, 'agreements': 10},     # 20 contracts
+    'medium': {'models': 2, 'n_iter': 2, 'prompts': 5, 'agreements': 10},    # 200 contracts
+    'large': {'models': 3, 'n_iter': 4, 'prompts': 6, 'agreements': 14},     # 1008 contracts
+}
+SUITES = {'generation': GENERATION_SIZES, 'postprocessing': POSTPROCESSING_SIZES}
+
+# Compared by `--compare`, with the direction of an improvement
+KEY_METRICS = {'throughput': 1, 'p50': -1, 'p95': -1, 'p99': -1, 'peak_rss_mb': -1}
+
+
+def percentiles(values: list):
+    from pipeline.core.tracing import percentile
+    return {'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95), 'p99': percentile(values, 0.99)}
+
+
+def peak_rss_mb(who: str = 'self'):
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # Kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def start_mock_server(args):
+    cmd = [sys.executable, '-m', 'benchmarks.mock_server', '--latency', str(args['latency']), '--jitter', str(args['jitter']),
+           '--error-rate', str(args['error_rate']), '--chunk-delay', str(args['chunk_delay']), '--seed', str(args['seed'])]
+    if args['rpm']:
+        cmd += ['--rpm', str(args['rpm'])]
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return proc, int(proc.stdout.readline())
+
+
+def stop_mock_server(proc):
+    """
+    :return: request counters of the server
+    """
+    if os.name == 'posix':
+        proc.send_signal(signal.SIGINT)
+    else:
+        proc.terminate()
+    try:
+        _, stderr = proc.communicate(timeout=10)
+        return json.loads(stderr.strip().splitlines()[-1])
+    except Exception:
+        proc.kill()
+        return {}
+
+
+def bench_generation(size: str, args: dict, workdir: str):
+    cfg = GENERATION_SIZES[size]
+    server, port = start_mock_server(args)
+    models = BENCH_MODELS[:cfg['models']]
+    os.environ.update({
+        'OPENAI_API_KEY': 'bench', 'ANTHROPIC_API_KEY': 'bench', 'MISTRAL_API_KEY': 'bench',
+        'OPENAI_BASE_URL': f"http://127.0.0.1:{port}/v1",
+        'ANTHROPIC_BASE_URL': f"http://127.0.0.1:{port}",
+        'MISTRAL_BASE_URL': f"http://127.0.0.1:{port}",
+        **{f"{provider.upper()}_MODELS": json.dumps([model]) for provider, model in BENCH_MODELS},
+        # Whole agreements in the prompt, as with the real models
+        'CONTEXT_WINDOWS': json.dumps({'bench-': 128_000}),
+    })
+    from pipeline.pipeline import Pipeline
+    from pipeline.prompts import PREFIX_PROMPTS
+    from pipeline.core import tracing
+    logging_quiet()
+
+    prompts = dict(list(PREFIX_PROMPTS.items())[:cfg['prompts']])
+    agreements = make_agreements(os.path.join(workdir, 'agreements'), cfg['agreements'])
+    try:
+        start = time.perf_counter()
+        results = Pipeline.sweep(agreements, models=[model for _, model in models], prompts=prompts, n_iter=cfg['n_iter'],
+                                 temperatures=[0.5], output_root=os.path.join(workdir, 'output'), stream=args['stream'],
+                                 n_samples=args['n_samples'])
+        elapsed = time.perf_counter() - start
+    finally:
+        server_stats = stop_mock_server(server)
+
+    spans = list(tracing.SpanLog.default().read())
+    generations = [s['duration'] for s in spans if s['name'].endswith(('get_smart_contract_from_ai', 'get_smart_contract_samples_from_ai'))]
+    calls = [s['duration'] for s in spans if '__acall_' in s['name'] or 'consume_stream' in s['name']]
+    call_latency = percentiles(calls)
+    return {
+        'contracts': len(results),
+        'generated': sum(result is not None for result in results.values()),
+        'elapsed': elapsed,
+        'throughput': len(results) / elapsed,
+        **percentiles(generations),
+        'call_p50': call_latency['p50'],
+        'call_p95': call_latency['p95'],
+        'retries': sum(s.get('retries', 0) for s in spans),
+        'server': server_stats,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_postprocessing(size: str, args: dict, workdir: str):
+    cfg = POSTPROCESSING_SIZES[size]
+    os.environ['BENCH_TOOL_LATENCY'] = str(args['tool_latency'])
+    from pipeline.postprocessing import SmartCMetrics
+    from pipeline.core import tracing
+    logging_quiet()
+
+    # Slither replaced by the replay tool, run as local processes
+    python = sys.executable
+    SmartCMetrics.VUL_TOOLS['slither'] = {
+        **SmartCMetrics.VUL_TOOLS['slither'],
+        'host_path': workdir,
+        'version_cmd': f"{python} {REPLAY_TOOL} --version",
+        'deps': False,
+        'solc_select': False,
+        'timeout': 120,
+        'mem_limit': None,
+        'cpus': None,
+        'cmd': lambda sol_file, pragma, remaps, root: [f"{python} {REPLAY_TOOL} {sol_file} --json -"],
+        'cmd_err': lambda sol_file, pragma, remaps, root: [],
+    }
+    if not args['compile']:
+        # The in-process compilation needs the solc binaries (downloaded by py-solc-x)
+        SmartCMetrics.run_compilation = classmethod(lambda cls, *args, **kwargs: {})
+
+    output = os.path.join(workdir, 'output')
+    n_contracts = make_output_tree(output, cfg['models'], cfg['n_iter'], cfg['prompts'], cfg['agreements'])
+    phases = {}
+    # Cold: every contract is analyzed, warm: every result comes from the results store
+    for phase in ['cold', 'warm']:
+        start = time.perf_counter()
+        data, _ = SmartCMetrics.pipe(output, n_workers=args['workers'], backend='local')
+        phases[phase] = {'elapsed': time.perf_counter() - start, 'rows': len(data)}
+
+    spans = list(tracing.SpanLog.default().read())
+    jobs = [s['duration'] for s in spans if s['name'].endswith('run_detection_job')]
+    metrics = percentiles([s['duration'] for s in spans if s['name'].endswith('get_sc_metrics')])
+    return {
+        'contracts': n_contracts,
+        'elapsed': phases['cold']['elapsed'],
+        'throughput': n_contracts / phases['cold']['elapsed'],
+        'warm_elapsed': phases['warm']['elapsed'],
+        'warm_throughput': n_contracts / phases['warm']['elapsed'],
+        **percentiles(jobs),
+        'metrics_p50': metrics['p50'],
+        'metrics_p95': metrics['p95'],
+        'rows': phases['cold']['rows'],
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_child_rss_mb': peak_rss_mb('children'),
+    }
+
+
+def logging_quiet():
+    # The pipeline logs every request at DEBUG level
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def run_worker(spec: dict):
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        os.environ.update({
+            'RESPONSE_CACHE_ENABLED': 'false',
+            'USAGE_LOG_PATH': os.path.join(workdir, 'usage.jsonl'),
+            'TRACE_ENABLED': 'true',
+            'TRACE_PATH': os.path.join(workdir, 'spans.jsonl'),
+        })
+        bench = bench_generation if spec['suite'] == 'generation' else bench_postprocessing
+        result = bench(spec['size'], spec['args'], workdir)
+    print(json.dumps(result))
+
+
+def run_case(suite: str, size: str, args: dict):
+    spec = json.dumps({'suite': suite, 'size': size, 'args': args})
+    proc = subprocess.run([sys.executable, '-m', 'benchmarks.run', '--worker', spec], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit code {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def fmt(value, unit: str = ''):
+    if value is None:
+        return '-'
+    return f"{value:.3f}{unit}" if isinstance(value, float) else f"{value}{unit}"
+
+
+def print_results(results: list, baseline: dict = None):
+    print(f"{'case':<24} {'contracts':>9} {'elapsed':>9} {'thr/s':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'rss MB':>8}")
+    for item in results:
+        case, result = f"{item['suite']}/{item['size']}", item['result']
+        if 'error' in result:
+            print(f"{case:<24} error: {result['error']}")
+            continue
+        print(f"{case:<24} {fmt(result['contracts']):>9} {fmt(result['elapsed'], 's'):>9} {fmt(result['throughput']):>9} "
+              f"{fmt(result['p50'], 's'):>8} {fmt(result['p95'], 's'):>8} {fmt(result['p99'], 's'):>8} {fmt(result['peak_rss_mb']):>8}")
+        before = (baseline or {}).get(case)
+        if before and 'error' not in before:
+            deltas = []
+            for key, direction in KEY_METRICS.items():
+                if before.get(key) and result.get(key) is not None:
+                    change = (result[key] - before[key]) / before[key] * 100
+                    deltas.append(f"{key} {change:+.1f}%{' (better)' if change * direction > 0 else ''}")
+            print(f"{'':<24} vs baseline: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    parser.add_argument('suite', nargs='?', default='all', choices=['all', *SUITES])
+    parser.add_argument('--sizes', default='small,medium', help=f"comma separated, among {', '.join(GENERATION_SIZES)}")
+    parser.add_argument('--output', help="save the results (JSON) to compare later runs against")
+    parser.add_argument('--compare', help="results of a previous run (JSON)")
+    # Generation
+    parser.add_argument('--latency', type=float, default=0.2, help="mock server mean latency (seconds)")
+    parser.add_argument('--jitter', type=float, default=0.1, help="mock server latency spread (seconds)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of mock requests failing with a 500")
+    parser.add_argument('--rpm', type=int, default=None, help="mock server requests per minute before 429")
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help="delay between streamed chunks (seconds)")
+    parser.add_argument('--stream', action='store_true', help="stream the responses")
+    parser.add_argument('--n-samples', type=int, default=1, help="iterations per request (OpenAI `n`)")
+    parser.add_argument('--seed', type=int, default=0)
+    # Post-processing
+    parser.add_argument('--workers', type=int, default=None, help="analysis workers, number of CPUs by default")
+    parser.add_argument('--tool-latency', type=float, default=0.0, help="replay tool time per contract (seconds)")
+    parser.add_argument('--compile', action='store_true', help="include the in-process compilation (needs the solc binaries)")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return run_worker(json.loads(args.worker))
+
+    options = {key: val for key, val in vars(args).items() if key not in ('suite', 'sizes', 'output', 'compare', 'worker')}
+    suites = list(SUITES) if args.suite == 'all' else [args.suite]
+    results = []
+    for suite in suites:
+        for size in args.sizes.split(','):
+            results.append({'suite': suite, 'size': size, 'result': run_case(suite, size, options)})
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = {f"{item['suite']}/{item['size']}": item['result'] for item in json.load(f)['results']}
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': get_commit(), 'time': time.time(), 'python': platform.python_version(), 'platform': platform.platform(),
+                       'options': options, 'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
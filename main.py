@@ -2,27 +2,42 @@ from pipeline.pipeline import Pipeline
 from pipeline.prompts import PROMPTS
 from pipeline.postprocessing import SmartCMetrics
 from pipeline.core.config import settings
+from pipeline.core import tracing
+from pipeline.core.paths import shared_path
 import os
 import logging
 
-## Automatic smart contract generation
-# Make sure the user want to run the pipeline with all prompts
-confirm = input(f"Run all prompt? (y/n): ")
-if confirm.lower() != 'y':
-    logging.info("Exiting.")
-    exit()
+# Entry point guard: SmartCMetrics.pipe spawns worker processes, which re-import this module on Windows/macOS
+if __name__ == '__main__':
+    ## Automatic smart contract generation
+    # Make sure the user want to run the pipeline with all prompts
+    confirm = input(f"Run all prompt? (y/n): ")
+    if confirm.lower() != 'y':
+        logging.info("Exiting.")
+        exit()
 
-# Temperature test
-# Pipeline.pipe("./test_contracts", model="gpt-4-0125-preview", output_path=os.path.join('output', "gpt-4-0125-preview", 'Preliminar', pr_name), lambda_prompt=prompt)
+    # Temperature test
+    # Pipeline.pipe("./test_contracts", model="gpt-4-0125-preview", output_path=os.path.join('output', "gpt-4-0125-preview", 'Preliminar', pr_name), lambda_prompt=prompt, sample=i)
 
 
-# Fixed temperature 0.5, evaluate 4 shots
-n_iter = 4
+    # Fixed temperature 0.5, evaluate 4 shots
+    n_iter = 4
 
-for i in range(1, n_iter+1):
-    for pr_name, prompt in PROMPTS.items():
-        logging.info(f"----------------------------------------------\nRunning {pr_name} prompt.")
-        Pipeline.pipe("./test_contracts_txt", model=settings.OPENAI_MODEL, output_path=os.path.join('output', settings.OPENAI_MODEL, str(i), pr_name), temperatures=[0.5], lambda_prompt=prompt)
+    # The whole (iteration, prompt, agreement, temperature) grid runs concurrently,
+    # bounded by <PROVIDER>_MAX_CONCURRENCY. Output layout: output/<model>/<n_iter>/<prompt key>/<legal agreement name>
+    # Opt-in: `pipeline.prompts.PREFIX_PROMPTS` (keys PR12-prefix..PR17-prefix) put the legal agreement
+    # as a prefix shared by every prompt (provider prompt caching), e.g. prompts=PREFIX_PROMPTS, output_root='output-prefix'
+    Pipeline.sweep("./test_contracts_txt", models=[settings.OPENAI_MODEL], prompts=PROMPTS, n_iter=n_iter, temperatures=[0.5], output_root='output',
+                   n_samples=n_iter)  # the iterations of a prompt come from a single request (`n`) on OpenAI
+    # Cells are recorded in output/sweep_ledger.sqlite: after a restart the done ones are skipped,
+    # failed ones are retried with `Pipeline.resume('output', PROMPTS, n_samples=n_iter)` (or `python -m pipeline.ledger resume output`)
+    # Multi-node alternative: generation and analysis spread over the workers mounting SHARED_ROOT (see pipeline/distributed.py)
+    # python -m pipeline.distributed submit output ./test_contracts_txt --models <model>,<model> --n-iter 4, then `worker output` on every node
+    # Offline alternative through the provider batch APIs (OpenAI and Anthropic models only)
+    # Pipeline.batch("./test_contracts_txt", models=[settings.OPENAI_MODEL], prompts=PROMPTS, n_iter=n_iter, temperatures=[0.5], output_root='output')
 
-### Post-processing
-SmartCMetrics.pipe(os.path.join(os.path.expanduser('~'), 'slither_shared', 'output'))    
+    ### Post-processing
+    # Results saved as Parquet datasets (sc_metrics.parquet, sc_findings.parquet), plus the Excel workbooks derived from them
+    SmartCMetrics.pipe(shared_path('output'), excel=True)
+    # p50/p95 latency of every stage and cost per compilable contract of every model (spans in SHARED_ROOT/.cache/spans.jsonl)
+    tracing.log_summary()
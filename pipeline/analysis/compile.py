@@ -0,0 +1,94 @@
+import os
+import json
+import logging
+import concurrent.futures
+from .compilers import SolcManager
+
+
+def get_compile_report_path(path2sol: str):
+    """
+    Get the compilation report path of a smart contract (`<...>/sc/<name>.sol` -> `<...>/compile/<name>.sol.json`)
+    """
+    return os.path.join(os.path.dirname(os.path.dirname(path2sol)), 'compile', os.path.basename(path2sol) + '.json')
+
+
+def compile_contract(path2sol: str, version: str, remappings: list = [], allow_paths: list = []):
+    """
+    Compile a smart contract in process with the solc standard-JSON interface
+    :param path2sol: path to the smart contract
+    :param version: solc version
+    :param remappings: solc remappings (i.e., to the shared dependency store)
+    :param allow_paths: folders solc may read imports from
+    :return: dict with 'compilable', 'errors', 'abi' (per contract) and 'ast'
+    """
+    import solcx
+    with open(path2sol, 'r') as f:
+        source = f.read()
+    file_name = os.path.basename(path2sol)
+    input_json = {
+        'language': 'Solidity',
+        'sources': {file_name: {'content': source}},
+        'settings': {
+            'remappings': remappings,
+            'outputSelection': {'*': {'*': ['abi'], '': ['ast']}},
+        },
+    }
+    SolcManager.install_local(version)
+    try:
+        output = solcx.compile_standard(input_json, solc_version=version, allow_paths=allow_paths or None)
+    except solcx.exceptions.SolcError as e:
+        # Raised when the output has errors: still a valid standard-JSON output
+        try:
+            output = json.loads(e.stdout_data)
+        except Exception:
+            output = {'errors': [{'severity': 'error', 'formattedMessage': str(e)}]}
+    errors = [error.get('formattedMessage', error.get('message')) for error in output.get('errors', []) if error.get('severity') == 'error']
+    return {
+        'compilable': not errors,
+        'solc_version': version,
+        'errors': errors,
+        'abi': {name: contract.get('abi', []) for name, contract in output.get('contracts', {}).get(file_name, {}).items()},
+        'ast': output.get('sources', {}).get(file_name, {}).get('ast'),
+    }
+
+
+def compile_contracts(sol_paths: list, get_pragma, deps=None, n_workers: int = None):
+    """
+    Compile the given smart contracts in parallel and save a report in the 'compile' folders
+    :param sol_paths: paths to smart contracts
+    :param get_pragma: function source -> solc version
+    :param deps: `DependencyStore` resolving imports (contracts with imports are skipped if it is not installed)
+    :param n_workers: number of parallel compilations, number of CPUs by default
+    :return: dict path -> compilation result (None when the fast path cannot decide)
+    """
+    groups = SolcManager.group_by_version(sol_paths, get_pragma)
+    # Install every version once, before compiling
+    for version in groups:
+        if version is not None:
+            SolcManager.install_local(version)
+    remappings = deps.remappings() if deps is not None and deps.is_installed() else []
+    allow_paths = [deps.root] if remappings else []
+
+    def job(path, version):
+        with open(path, 'r') as f:
+            has_imports = 'import ' in f.read()
+        if version is None or (has_imports and not remappings):
+            return None
+        result = compile_contract(path, version, remappings, allow_paths)
+        report_path = get_compile_report_path(path)
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+        with open(report_path, 'w') as ff:
+            json.dump(result, ff)
+        return result
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers or os.cpu_count()) as executor:
+        # solc runs as a subprocess, threads are enough to use every core
+        futures = {executor.submit(job, path, version): path for version, paths in groups.items() for path in paths}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                logging.error(f"Compilation failed for '{futures[future]}':\n{e}")
+                results[futures[future]] = None
+    return results
@@ -0,0 +1,74 @@
+import logging
+import threading
+
+
+class SolcManager:
+    """Installs every distinct solc version once, up front, and pins the compiler per job.
+
+    Analysis jobs select their compiler with the `SOLC_VERSION` environment variable
+    (honoured by solc-select) instead of `solc-select use`, which switches a global in the
+    worker and prevents contracts with different pragmas from being analyzed in parallel.
+    """
+
+    _lock = threading.Lock()
+    _installed_local = None
+    _installed_workers = {}
+
+    @staticmethod
+    def env(version: str):
+        """
+        Environment pinning the solc version of a job
+        """
+        return {'SOLC_VERSION': version}
+
+    @staticmethod
+    def group_by_version(sol_paths: list, get_pragma):
+        """
+        Group the smart contracts by compiler version
+        :param sol_paths: paths to smart contracts
+        :param get_pragma: function source -> solc version
+        :return: dict version -> list of paths (contracts without a valid pragma under None)
+        """
+        groups = {}
+        for path in sol_paths:
+            with open(path, 'r') as f:
+                try:
+                    version = get_pragma(f.read())
+                except Exception:
+                    version = None
+            groups.setdefault(version, []).append(path)
+        return groups
+
+    @classmethod
+    def install_local(cls, version: str):
+        """
+        Install the given version with py-solc-x, once per process
+        """
+        import solcx
+        with cls._lock:
+            if cls._installed_local is None:
+                cls._installed_local = {str(v) for v in solcx.get_installed_solc_versions()}
+            if version in cls._installed_local:
+                return
+            solcx.install_solc(version)
+            cls._installed_local.add(version)
+
+    @classmethod
+    def install_on_worker(cls, worker, versions: list):
+        """
+        Install the given versions with solc-select on the worker, once per worker
+        :param worker: analysis worker (see `analysis.workers`)
+        :param versions: solc versions
+        """
+        with cls._lock:
+            installed = cls._installed_workers.setdefault(worker.name, set())
+            missing = sorted(set(versions) - installed - {None})
+        if not missing:
+            return
+        logging.info(f"[{worker.name}] Installing solc {', '.join(missing)}")
+        exit_code, output = worker.run(f"solc-select install {' '.join(missing)}")
+        if exit_code:
+            logging.error(f"[{worker.name}] solc-select install failed:\n{output.decode('utf-8', errors='replace')}")
+            return
+        with cls._lock:
+            installed.update(missing)
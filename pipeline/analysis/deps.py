@@ -0,0 +1,89 @@
+import os
+import sys
+import shutil
+import logging
+import threading
+import subprocess
+
+
+class DependencyStore:
+    """One-time, versioned store of the npm packages imported by the generated contracts.
+
+    Every package version is installed once under `<root>/<package>@<version>` and the
+    analysis tools resolve imports from there through solc remappings, instead of running
+    `npm install` in every contract folder. On air-gapped nodes, copy the `root` folder
+    from a connected machine (see `python -m pipeline.analysis.deps install <root>`):
+    packages already present are never installed again.
+    """
+
+    PACKAGES = {
+        '@openzeppelin/contracts': '4.9.5',
+    }
+
+    _lock = threading.Lock()
+
+    def __init__(self, root: str, packages: dict = None):
+        self.root = root
+        self.packages = packages or self.PACKAGES
+
+    @classmethod
+    def for_tool(cls, vul_tool: dict):
+        """
+        Get the store living in the shared folder of the given tool
+        """
+        return cls(os.path.join(vul_tool['host_path'], '.deps'))
+
+    def package_prefix(self, package: str, version: str):
+        return os.path.join(self.root, f"{package.replace('/', '__')}@{version}")
+
+    def package_dir(self, package: str, version: str):
+        return os.path.join(self.package_prefix(package, version), 'node_modules', *package.split('/'))
+
+    def is_installed(self):
+        return all(os.path.exists(os.path.join(self.package_dir(p, v), 'package.json')) for p, v in self.packages.items())
+
+    def ensure(self, worker=None):
+        """
+        Install the missing packages, once
+        :param worker: analysis worker running `npm` (see `analysis.workers`), local `npm` if None
+        """
+        if self.is_installed():
+            return
+        with self._lock:
+            for package, version in self.packages.items():
+                if os.path.exists(os.path.join(self.package_dir(package, version), 'package.json')):
+                    continue
+                prefix = self.package_prefix(package, version)
+                # Install in a temporary folder and move it in place, so that a crash (or another process)
+                # never leaves a half-installed package behind
+                tmp_prefix = f"{prefix}.tmp-{os.getpid()}"
+                os.makedirs(tmp_prefix, exist_ok=True)
+                logging.info(f"Installing {package}@{version} in '{prefix}'")
+                if worker is None:
+                    subprocess.run(['npm', 'install', '--prefix', tmp_prefix, f"{package}@{version}"], check=True)
+                else:
+                    exit_code, output = worker.run(f"npm install --prefix {worker.to_worker_path(tmp_prefix)} {package}@{version}")
+                    if exit_code:
+                        raise RuntimeError(f"npm install {package}@{version} failed:\n{output.decode('utf-8', errors='replace')}")
+                try:
+                    os.rename(tmp_prefix, prefix)
+                except OSError:
+                    # Installed concurrently by another process
+                    shutil.rmtree(tmp_prefix, ignore_errors=True)
+
+    def remappings(self, worker=None):
+        """
+        Get the solc remappings resolving the packages imports
+        :param worker: analysis worker, used to translate the paths
+        :return: list of remappings (i.e., '@openzeppelin/contracts/=<store>/node_modules/@openzeppelin/contracts/')
+        """
+        to_worker_path = worker.to_worker_path if worker is not None else (lambda path: path)
+        return [f"{package}/={to_worker_path(self.package_dir(package, version))}/" for package, version in self.packages.items()]
+
+
+if __name__ == '__main__':
+    # python -m pipeline.analysis.deps install <root>
+    if len(sys.argv) != 3 or sys.argv[1] != 'install':
+        raise SystemExit("Usage: python -m pipeline.analysis.deps install <root>")
+    logging.basicConfig(level=logging.INFO)
+    DependencyStore(sys.argv[2]).ensure()
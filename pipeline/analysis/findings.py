@@ -0,0 +1,127 @@
+import re
+
+# Normalized findings schema, shared by every analysis tool:
+#   {'compilable': bool, 'status': str, 'vulns': [{'tool', 'check', 'impact', 'confidence', 'description', 'first_markdown_element'}]}
+# Impacts are 'High', 'Medium', 'Low' or 'Informational' (as in Slither).
+# 'compilable' is None when the analysis did not complete (timeout or killed).
+FINDING_KEYS = ["description", "check", "impact", "confidence", "first_markdown_element"]
+
+STATUS_ANALYZED = 'analyzed'
+STATUS_NOT_COMPILABLE = 'not_compilable'
+STATUS_TIMEOUT = 'timeout'
+STATUS_KILLED = 'killed'
+
+PATTERN_NOT_COMPILABLE = r'InvalidCompilation: (.*)'
+
+
+def get_status(report: dict):
+    if 'status' in report:
+        return report['status']
+    # Reports normalized before the status existed
+    return STATUS_ANALYZED if report['compilable'] else STATUS_NOT_COMPILABLE
+
+
+def not_compilable(tool: str, message: str):
+    return {
+        'compilable': False,
+        'status': STATUS_NOT_COMPILABLE,
+        'vulns': [{
+            "tool": tool,
+            "impact": "High",
+            "confidence": "High",
+            "description": re.findall(PATTERN_NOT_COMPILABLE, message or '', re.DOTALL)
+        }]
+    }
+
+
+def parse_slither(report: dict):
+    # `slither --json -`: {"success", "error", "results": {"detectors": [...]}}, no "detectors" on a clean contract
+    if not report.get("success"):
+        # If vulnerability detectioin tool fails, return the error.
+        # Commonly, this happens when the pragma is not supported or the smart contract does not compile
+        return not_compilable('slither', report.get("message") or report.get("error"))
+    return {
+        'compilable': True,
+        'status': STATUS_ANALYZED,
+        'vulns': [{'tool': 'slither', **{key: x[key] for key in FINDING_KEYS}} for x in report.get("results", {}).get("detectors", [])]
+    }
+
+
+def parse_mythril(report: dict):
+    # `myth analyze -o json`: {"success", "error", "issues": [{"title", "swc-id", "severity", "description", "function", "lineno", ...}]}
+    if not report.get("success"):
+        return not_compilable('mythril', report.get("message") or report.get("error"))
+    return {
+        'compilable': True,
+        'status': STATUS_ANALYZED,
+        'vulns': [{
+            'tool': 'mythril',
+            'check': f"SWC-{issue.get('swc-id')} {issue.get('title')}",
+            'impact': issue.get('severity'),
+            # Findings come with a concrete transaction sequence
+            'confidence': 'High',
+            'description': issue.get('description'),
+            'first_markdown_element': f"{issue.get('filename')}#L{issue.get('lineno')}",
+        } for issue in report.get("issues", [])]
+    }
+
+
+def parse_solhint(report: dict):
+    # `solhint -f json`: [{"ruleId", "severity" ('Error' or 'Warning'), "message", "line", "column", "filePath"}, ..., {"conclusion"}]
+    if not report.get("success", True):
+        return not_compilable('solhint', report.get("message"))
+    impacts = {'Error': 'Low', 'Warning': 'Informational'}
+    return {
+        'compilable': True,
+        'status': STATUS_ANALYZED,
+        'vulns': [{
+            'tool': 'solhint',
+            'check': item['ruleId'],
+            'impact': impacts.get(item.get('severity'), 'Informational'),
+            'confidence': 'High',
+            'description': item.get('message'),
+            'first_markdown_element': f"{item.get('filePath')}#L{item.get('line')}",
+        } for item in report.get("results", []) if 'ruleId' in item]
+    }
+
+
+PARSERS = {
+    'slither': parse_slither,
+    'mythril': parse_mythril,
+    'solhint': parse_solhint,
+}
+
+
+def normalize(vul_tool: str, report):
+    """
+    Normalize the JSON output of an analysis tool
+    :param vul_tool: analysis tool
+    :param report: tool output (solhint reports, a JSON list, are wrapped in {'results': [...]})
+    :return: normalized findings
+    """
+    if vul_tool not in PARSERS:
+        raise ValueError(f"Vulnerability tool '{vul_tool}' not supported")
+    if isinstance(report, list):
+        report = {'results': report}
+    if report.get('status') in (STATUS_TIMEOUT, STATUS_KILLED):
+        # Not a compilation failure: compilability is unknown
+        return {'compilable': None, 'status': report['status'], 'vulns': []}
+    return PARSERS[vul_tool](report)
+
+
+def merge(reports: dict, primary: str):
+    """
+    Merge the normalized findings of several tools run on the same contract
+    :param reports: dict tool -> normalized findings (None if the tool has no report)
+    :param primary: tool deciding compilability (its compilation errors are the only findings of a non compilable contract)
+    :return: normalized findings, with the status of every tool under 'tool_status'
+    """
+    tool_status = {tool: get_status(report) if report is not None else None for tool, report in reports.items()}
+    merged = reports[primary]
+    if not merged['compilable']:
+        return {**merged, 'tool_status': tool_status}
+    vulns = list(merged['vulns'])
+    for tool, report in reports.items():
+        if tool != primary and report is not None and report['compilable']:
+            vulns.extend(report['vulns'])
+    return {'compilable': True, 'status': get_status(merged), 'vulns': vulns, 'tool_status': tool_status}
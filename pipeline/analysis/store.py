@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from ..core.paths import sqlite_journal_mode, to_shared
+
+
+def sha256_file(path: str):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ResultsStore:
+    """Incremental store of the post-processing results (SQLite file under the output root).
+
+    Results are keyed by the sha256 of the contract source plus the analysis tool and its
+    version, so unchanged contracts are never analyzed twice and regenerated ones are
+    always analyzed again. The store also records which source each vulnerability report
+    in the 'vul' folders was computed on, to detect stale reports. Report paths are stored relative
+    to the shared folder (see `to_shared`), so nodes mounting it at different places share the records.
+    """
+
+    FILE_NAME = 'sc_metrics.sqlite'
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__lock = threading.Lock()
+        # Writers lock the whole file with the rollback journal (see `sqlite_journal_mode`)
+        self.__conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=60)
+        self.__conn.execute(f"PRAGMA journal_mode={sqlite_journal_mode(path)}")
+        self.__conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                sha256 TEXT,
+                tool TEXT,
+                tool_version TEXT,
+                vul_summary TEXT,
+                metrics TEXT,
+                updated REAL,
+                PRIMARY KEY (sha256, tool, tool_version)
+            )""")
+        self.__conn.execute("""
+            CREATE TABLE IF NOT EXISTS reports (
+                report_path TEXT PRIMARY KEY,
+                sha256 TEXT,
+                tool TEXT,
+                tool_version TEXT
+            )""")
+
+    @classmethod
+    def for_output(cls, pipe_output_path: str):
+        return cls(os.path.join(pipe_output_path, cls.FILE_NAME))
+
+    @staticmethod
+    def encode_summary(vul_summary: dict):
+        # Summary keys are (check, confidence, impact) tuples, not valid JSON keys
+        return json.dumps([[*key, count] for key, count in vul_summary.items()])
+
+    @staticmethod
+    def decode_summary(vul_summary: str):
+        return {tuple(item[:-1]): item[-1] for item in json.loads(vul_summary)}
+
+    def get(self, sha256: str, tool: str, tool_version: str):
+        """
+        :return: stored metrics, None if the contract was never analyzed with this tool version
+        """
+        with self.__lock:
+            row = self.__conn.execute("SELECT vul_summary, metrics FROM results WHERE sha256 = ? AND tool = ? AND tool_version = ?",
+                                      (sha256, tool, tool_version)).fetchone()
+        if row is None:
+            return None
+        metrics = json.loads(row[1])
+        metrics['vul_summary'] = self.decode_summary(row[0])
+        return metrics
+
+    def put(self, sha256: str, tool: str, tool_version: str, metrics: dict):
+        metrics = dict(metrics)
+        vul_summary = self.encode_summary(metrics.pop('vul_summary', {}))
+        with self.__lock:
+            self.__conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                                (sha256, tool, tool_version, vul_summary, json.dumps(metrics, default=str), time.time()))
+
+    def record_report(self, report_path: str, sha256: str, tool: str, tool_version: str):
+        with self.__lock:
+            self.__conn.execute("INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?)", (to_shared(report_path), sha256, tool, tool_version))
+
+    def is_report_current(self, report_path: str, sol_path: str, sha256: str, tool: str, tool_version: str):
+        """
+        Whether the vulnerability report was computed on the current contract source.
+        Reports written before the store existed are trusted if newer than the source.
+        """
+        with self.__lock:
+            # Reports recorded before the paths were relative to the shared folder are looked up by their absolute path
+            row = self.__conn.execute("SELECT sha256, tool, tool_version FROM reports WHERE report_path IN (?, ?) ORDER BY report_path = ? DESC",
+                                      (to_shared(report_path), report_path, to_shared(report_path))).fetchone()
+        if row is None:
+            return os.path.getmtime(report_path) >= os.path.getmtime(sol_path)
+        # Reports recorded with the metrics version in their tool version are still current
+        return (row[0], row[1], row[2].split('/metrics-')[0]) == (sha256, tool, tool_version)
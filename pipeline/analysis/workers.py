@@ -0,0 +1,323 @@
+import os
+import queue
+import shlex
+import signal
+import socket
+import logging
+import threading
+import subprocess
+import concurrent.futures
+
+# Exit code of a command killed by its timeout (as with coreutils `timeout`)
+TIMEOUT_EXIT_CODE = 124
+# Exit code of a command killed with SIGKILL (i.e., out of memory)
+KILLED_EXIT_CODE = 137
+
+# Grace period between SIGTERM and SIGKILL on timeout (seconds)
+KILL_AFTER = 10
+
+SIZE_UNITS = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+# Labels of the analysis containers: host and pid of the process owning them
+HOST_LABEL = 'pipeline.analysis.host'
+PID_LABEL = 'pipeline.analysis.pid'
+
+
+def parse_size(size):
+    """
+    Parse a docker-like size (i.e., '512m', '4g') into bytes
+    """
+    if size is None or isinstance(size, int):
+        return size
+    size = size.strip().lower()
+    if size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def worker_name(vul_tool: dict, i: int = None):
+    """
+    Name of an analysis worker (and of its container), namespaced by process: the worker processes
+    of a host (i.e., distributed sweep workers) never share a container
+    :param i: index of the worker in its pool
+    """
+    name = f"{vul_tool.get('docker_name', 'worker')}-{os.getpid()}"
+    return name if i is None else f"{name}-{i}"
+
+
+def _is_alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _limit_resources(args: list, mem_limit: int, cpu_seconds: int):
+    # The shell sets the caps and execs the command (POSIX only). `preexec_fn` is not safe in the pool threads
+    # SIGXCPU at the CPU cap (a timeout), SIGKILL after the grace period
+    limits = ([f"ulimit -v {mem_limit // 1024}"] if mem_limit else []) + \
+             ([f"ulimit -S -t {cpu_seconds}", f"ulimit -H -t {cpu_seconds + KILL_AFTER}"] if cpu_seconds else [])
+    if not limits:
+        return args
+    return ['/bin/sh', '-c', f'{" && ".join(limits)} && exec "$@"', 'sh', *args]
+
+
+def _kill_group(process: subprocess.Popen, sig: int = signal.SIGTERM):
+    # The command runs in its own session: the processes it spawned (i.e., solc) are signaled too
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, sig)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+class DockerWorker:
+    """Long-lived analysis container. Commands are run with `docker exec`, paths are
+    translated from the host shared folder to the folder mounted in the container.
+    A container runs one job at a time, its memory and CPU caps ('mem_limit', 'cpus'
+    of the tool config) are the caps of the job."""
+
+    def __init__(self, name: str, vul_tool: dict):
+        import docker
+        self.name = name
+        self.vul_tool = vul_tool
+        # Verify if docker is running
+        try:
+            self.docker_client = docker.from_env()
+            self.docker_client.containers.list()
+        except Exception as e:
+            logging.error(f"Docker is not running. Error: {e}")
+            raise e
+
+        limits = {}
+        if vul_tool.get('mem_limit'):
+            # No swap on top of the memory cap
+            limits.update(mem_limit=vul_tool['mem_limit'], memswap_limit=vul_tool['mem_limit'])
+        if vul_tool.get('cpus'):
+            limits.update(cpu_period=100_000, cpu_quota=int(vul_tool['cpus'] * 100_000))
+
+        # Get docker container instance, else create it
+        try:
+            self.container = self.docker_client.containers.get(name)
+            if limits:
+                # Containers created before the caps were configured
+                try:
+                    self.container.update(**limits)
+                except Exception as e:
+                    logging.warning(f"Cannot update the resource limits of container {name}: {e}")
+        except Exception:
+            self.container = self.docker_client.containers.run(
+                image=vul_tool['docker_image'],
+                detach=True,
+                tty=True,
+                entrypoint=vul_tool.get('docker_entrypoint'),
+                name=name,
+                labels={HOST_LABEL: socket.gethostname(), PID_LABEL: str(os.getpid())},
+                volumes={vul_tool['host_path']: {'bind': vul_tool['container_path'], 'mode': 'rw'}},
+                **limits
+            )
+
+        if self.container.status != 'running':
+            logging.debug(f"Container {name} is not running. Starting it...")
+            self.container.start()
+            logging.info(f"Container {name} started.")
+
+    @classmethod
+    def remove_stale(cls):
+        """
+        Remove the analysis containers of the processes of this host that exited without removing them (i.e., killed)
+        """
+        import docker
+        if os.name != 'posix':
+            # No signal 0 to probe a process
+            return
+        for container in docker.from_env().containers.list(all=True, filters={'label': f"{HOST_LABEL}={socket.gethostname()}"}):
+            pid = container.labels.get(PID_LABEL)
+            if pid and pid.isdigit() and not _is_alive(int(pid)):
+                logging.info(f"Removing container {container.name} of exited process {pid}")
+                try:
+                    container.remove(force=True)
+                except Exception as e:
+                    logging.warning(f"Cannot remove container {container.name}: {e}")
+
+    def to_worker_path(self, host_path: str):
+        relative_path = os.path.relpath(host_path, self.vul_tool['host_path']).replace('\\', '/')
+        return '/'.join([self.vul_tool['container_path'], relative_path])
+
+    def run(self, cmd: str, environment: dict = None, timeout: float = None):
+        """
+        Run a command in the container
+        :param environment: extra environment variables of the command
+        :param timeout: wall-clock limit (seconds), the command is terminated after it
+        :return: (exit code, output bytes), exit code `TIMEOUT_EXIT_CODE` on timeout, `KILLED_EXIT_CODE` if killed
+        """
+        if timeout:
+            cmd = f"timeout -k {KILL_AFTER} {int(timeout)} {cmd}"
+        return self.container.exec_run(cmd=cmd, stdin=True, environment=environment)
+
+    def cancel(self):
+        """
+        Kill the running command (the container is restarted)
+        """
+        self.container.restart(timeout=0)
+
+    def close(self):
+        """
+        Remove the container
+        """
+        try:
+            self.container.remove(force=True)
+        except Exception as e:
+            logging.warning(f"Cannot remove container {self.name}: {e}")
+
+
+class LocalWorker:
+    """Runs the analysis commands as local processes (slither, solc-select and npm installed on the host).
+    On POSIX hosts, the memory cap ('mem_limit') limits the address space of the process and
+    the CPU cap ('cpus') its CPU time (`cpus` x timeout)."""
+
+    def __init__(self, name: str, vul_tool: dict):
+        self.name = name
+        self.vul_tool = vul_tool
+        self.__process = None
+
+    def to_worker_path(self, host_path: str):
+        return host_path
+
+    def run(self, cmd: str, environment: dict = None, timeout: float = None):
+        """
+        Run a command on the host
+        :param environment: extra environment variables of the command
+        :param timeout: wall-clock limit (seconds), the command and the processes it spawned are killed after it
+        :return: (exit code, output bytes), exit code `TIMEOUT_EXIT_CODE` on timeout, `KILLED_EXIT_CODE` if killed
+        """
+        env = {**os.environ, **environment} if environment else None
+        args = shlex.split(cmd)
+        if os.name == 'posix':
+            cpu_seconds = int(self.vul_tool['cpus'] * timeout) if self.vul_tool.get('cpus') and timeout else None
+            args = _limit_resources(args, parse_size(self.vul_tool.get('mem_limit')), cpu_seconds)
+        process = self.__process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, start_new_session=True)
+        try:
+            output, _ = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # SIGTERM, then SIGKILL after the grace period (as `timeout -k` in the containers)
+            output = b''
+            for sig in [signal.SIGTERM, getattr(signal, 'SIGKILL', signal.SIGTERM)]:
+                _kill_group(process, sig)
+                try:
+                    output, _ = process.communicate(timeout=KILL_AFTER)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+            return TIMEOUT_EXIT_CODE, output
+        finally:
+            returncode, self.__process = process.returncode, None
+        if returncode == -24:
+            # SIGXCPU: CPU time cap reached
+            return TIMEOUT_EXIT_CODE, output
+        if returncode == -9:
+            return KILLED_EXIT_CODE, output
+        return returncode, output
+
+    def cancel(self):
+        """
+        Kill the running command
+        """
+        process = self.__process
+        if process is not None:
+            _kill_group(process, getattr(signal, 'SIGKILL', signal.SIGTERM))
+
+    def close(self):
+        self.cancel()
+
+
+class AnalysisWorkerPool:
+    """Pool of N long-lived analysis workers. Jobs are queued and each one is handed a
+    free worker, so up to N contracts are analyzed concurrently.
+
+    Usage:
+        with AnalysisWorkerPool(n_workers=8) as pool:
+            futures = [pool.submit(job, path) for path in paths]  # job(worker, path)
+    """
+
+    BACKENDS = {
+        'docker': DockerWorker,
+        'local': LocalWorker,
+    }
+
+    def __init__(self, vul_tool: dict, n_workers: int = None, backend: str = 'docker'):
+        assert backend in self.BACKENDS, f"Backend '{backend}' not supported, use one of {list(self.BACKENDS)}"
+        self.n_workers = n_workers or os.cpu_count()
+        self.__all_workers = []
+        self.__workers = queue.Queue()
+        self.__busy = set()
+        self.__busy_lock = threading.Lock()
+        if backend == 'docker':
+            DockerWorker.remove_stale()
+        for i in range(self.n_workers):
+            # Docker workers get one container each, removed on shutdown
+            worker = self.BACKENDS[backend](worker_name(vul_tool, i), vul_tool)
+            self.__all_workers.append(worker)
+            self.__workers.put(worker)
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.n_workers, thread_name_prefix='analysis')
+
+    def __run(self, job, *args, **kwargs):
+        worker = self.__workers.get()
+        with self.__busy_lock:
+            self.__busy.add(worker)
+        try:
+            return job(worker, *args, **kwargs)
+        finally:
+            with self.__busy_lock:
+                self.__busy.discard(worker)
+            self.__workers.put(worker)
+
+    def submit(self, job, *args, **kwargs):
+        """
+        Queue a job
+        :param job: callable `job(worker, *args, **kwargs)`
+        :return: future
+        """
+        return self.__executor.submit(self.__run, job, *args, **kwargs)
+
+    def broadcast(self, job, *args, **kwargs):
+        """
+        Run a job once on every worker (i.e., provisioning), before any other job is submitted
+        :param job: callable `job(worker, *args, **kwargs)`
+        :return: list of results
+        """
+        futures = [self.__executor.submit(job, worker, *args, **kwargs) for worker in self.__all_workers]
+        return [future.result() for future in futures]
+
+    def shutdown(self, cancel_pending: bool = False):
+        self.__executor.shutdown(wait=True, cancel_futures=cancel_pending)
+        for worker in self.__all_workers:
+            worker.close()
+
+    def cancel(self):
+        """
+        Cancel the queued jobs and kill the running ones
+        """
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+        with self.__busy_lock:
+            busy = list(self.__busy)
+        for worker in busy:
+            logging.warning(f"[{worker.name}] Cancelling the running job")
+            try:
+                worker.cancel()
+            except Exception as e:
+                logging.error(f"[{worker.name}] Cannot cancel the running job: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # i.e., KeyboardInterrupt: running jobs are killed instead of awaited
+        if exc_type is not None:
+            self.cancel()
+        self.shutdown(cancel_pending=exc_type is not None)
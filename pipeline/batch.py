@@ -0,0 +1,267 @@
+import os
+import io
+import json
+import time
+import logging
+import httpx
+from .core.config import settings
+from .core.paths import ensure_dir, shared_path
+from .pipeline import Pipeline
+from .sweep import iter_cells
+
+
+class BatchSweep:
+    """Run a generation sweep through the provider batch APIs (OpenAI and Anthropic).
+
+    The whole grid is serialized into JSONL batch jobs, submitted at once, polled until
+    completion, and the results are written to the same `raw/` and `sc/` files that
+    `Pipeline.get_smart_contract_from_ai` would write. Cells whose smart contract already
+    exists are skipped. Submitted batch ids are saved in `<work_dir>/batch_state.json`,
+    so an interrupted run resumes polling instead of submitting again.
+
+    Endpoints follow `OPENAI_BASE_URL` / `ANTHROPIC_BASE_URL`, so a local stand-in
+    server can be used for testing.
+    """
+
+    PROVIDERS = ['openai', 'anthropic']
+    ANTHROPIC_VERSION = "2023-06-01"
+    ANTHROPIC_BETA = f"message-batches-2024-09-24,{Pipeline.ANTHROPIC_PROMPT_CACHING_BETA}"
+
+    def __init__(self, legal_agreement_path: str, models: list, prompts: dict, n_iter: int = 1, temperatures = [0.5], output_root: str = 'output', overwrite: bool = False, work_dir: str = None):
+        self.cells = list(iter_cells(legal_agreement_path, models, prompts, n_iter, temperatures, output_root))
+        self.prompts = prompts
+        self.overwrite = overwrite
+        self.work_dir = ensure_dir(work_dir or shared_path(output_root, '.batch'))
+        self.state_path = os.path.join(self.work_dir, 'batch_state.json')
+        self.__instances = {}
+
+    def get_instance(self, model: str, output_path: str):
+        if (model, output_path) not in self.__instances:
+            self.__instances[(model, output_path)] = Pipeline(model, output_path)
+        return self.__instances[(model, output_path)]
+
+    def load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        return {'batches': []}
+
+    def save_state(self, state: dict):
+        with open(self.state_path, 'w') as f:
+            json.dump(state, f, indent=4)
+
+    def build_requests(self):
+        """
+        Render the prompt of every pending cell
+        :return: dict model -> list of (custom_id, cell info, prompt)
+        """
+        requests = {}
+        for idx, cell in enumerate(self.cells):
+            inst = self.get_instance(cell.model, cell.output_path)
+            if inst.provider not in self.PROVIDERS:
+                raise ValueError(f"Batch mode not supported for model '{cell.model}' ({inst.provider})")
+            _, _, sc_path = inst.get_output_paths(cell.legal_agreement_file_path, cell.temperature)
+            if os.path.exists(sc_path) and not self.overwrite:
+                continue
+            with open(cell.legal_agreement_file_path, 'r') as f:
+                legal_agreement = f.readlines()
+            try:
+                # Long agreements are condensed right away (see `Pipeline.get_prompt`), only the generation is batched
+                prompt_str = inst.get_prompt(self.prompts[cell.prompt_name], legal_agreement)
+            except Exception as e:
+                logging.error(f"Skipping '{cell.legal_agreement_file_path}' ({cell.model}):\n{e}")
+                continue
+            # custom_id must be <= 64 chars, the cell is kept in the batch state
+            custom_id = f"cell-{idx}"
+            info = {'model': cell.model, 'output_path': cell.output_path, 'legal_agreement_file_path': cell.legal_agreement_file_path, 'temperature': cell.temperature,
+                    'sample': cell.iteration}
+            key, new_code = inst.get_cached_response(prompt_str, cell.temperature, cell.iteration)
+            info['cache_key'] = key
+            if new_code is not None:
+                # Already paid for, no need to send it again
+                self.collect({'cells': {custom_id: info}}, {custom_id: new_code})
+                continue
+            requests.setdefault(cell.model, []).append((custom_id, info, prompt_str))
+        return requests
+
+    # ---------- OpenAI
+
+    def __submit_openai(self, model: str, requests: list, part: int):
+        client = self.get_instance(model, requests[0][1]['output_path']).client
+        input_path = os.path.join(self.work_dir, f'{model}_{part}_requests.jsonl')
+        with open(input_path, 'w', encoding='utf-8') as f:
+            for custom_id, info, prompt_str in requests:
+                f.write(json.dumps({
+                    'custom_id': custom_id,
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': {
+                        'model': model,
+                        'temperature': info['temperature'],
+                        'messages': [{'role': 'user', 'content': prompt_str}]
+                    }
+                }) + '\n')
+        with open(input_path, 'rb') as f:
+            input_file = client.files.create(file=f, purpose='batch')
+        batch = client.batches.create(input_file_id=input_file.id, endpoint='/v1/chat/completions', completion_window='24h')
+        return batch.id
+
+    def __poll_openai(self, model: str, batch_id: str, output_path: str):
+        """
+        :return: None while running, else dict custom_id -> response text (None on failure)
+        """
+        client = self.get_instance(model, output_path).client
+        batch = client.batches.retrieve(batch_id)
+        logging.info(f"Batch {batch_id} ({model}): {batch.status}")
+        if batch.status not in ['completed', 'failed', 'expired', 'cancelled']:
+            return None
+        results = {}
+        if batch.output_file_id:
+            for line in client.files.content(batch.output_file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get('response') or {}
+                if response.get('status_code') == 200:
+                    self.get_instance(model, output_path).record_usage(response['body'].get('usage'), batch=True)
+                    results[item['custom_id']] = response['body']['choices'][0]['message']['content']
+                else:
+                    logging.error(f"Batch request {item['custom_id']} failed: {item.get('error') or response}")
+                    results[item['custom_id']] = None
+        return results
+
+    # ---------- Anthropic
+
+    def __anthropic_http(self):
+        return httpx.Client(
+            base_url=settings.ANTHROPIC_BASE_URL or "https://api.anthropic.com",
+            headers={
+                'x-api-key': settings.ANTHROPIC_API_KEY or '',
+                'anthropic-version': self.ANTHROPIC_VERSION,
+                'anthropic-beta': self.ANTHROPIC_BETA,
+            },
+            timeout=settings.HTTP_TIMEOUT
+        )
+
+    def __submit_anthropic(self, model: str, requests: list, part: int):
+        body = {'requests': [{
+            'custom_id': custom_id,
+            'params': {
+                'model': model,
+                'temperature': info['temperature'],
+                'max_tokens': 6_000,
+                # Shared prefix marked for prompt caching (see `Pipeline.get_anthropic_request`)
+                'messages': self.get_instance(model, info['output_path']).get_anthropic_request(prompt_str)['messages']
+            }
+        } for custom_id, info, prompt_str in requests]}
+        # Keep a copy of the submitted requests next to the batch state
+        with open(os.path.join(self.work_dir, f'{model}_{part}_requests.jsonl'), 'w', encoding='utf-8') as f:
+            for request in body['requests']:
+                f.write(json.dumps(request) + '\n')
+        with self.__anthropic_http() as http:
+            response = http.post('/v1/messages/batches', json=body)
+            response.raise_for_status()
+            return response.json()['id']
+
+    def __poll_anthropic(self, model: str, batch_id: str, output_path: str):
+        """
+        :return: None while running, else dict custom_id -> response text (None on failure)
+        """
+        with self.__anthropic_http() as http:
+            response = http.get(f'/v1/messages/batches/{batch_id}')
+            response.raise_for_status()
+            batch = response.json()
+            logging.info(f"Batch {batch_id} ({model}): {batch['processing_status']}")
+            if batch['processing_status'] != 'ended':
+                return None
+            response = http.get(batch['results_url'])
+            response.raise_for_status()
+        results = {}
+        for line in io.StringIO(response.text):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            result = item['result']
+            if result['type'] == 'succeeded':
+                self.get_instance(model, output_path).record_usage(result['message'].get('usage'), batch=True)
+                results[item['custom_id']] = result['message']['content'][0]['text']
+            else:
+                logging.error(f"Batch request {item['custom_id']} {result['type']}: {result.get('error')}")
+                results[item['custom_id']] = None
+        return results
+
+    # ---------- Sweep
+
+    def submit(self):
+        """
+        Submit a batch job for every model with pending cells
+        :return: batch state
+        """
+        state = self.load_state()
+        if any(not batch.get('done') for batch in state['batches']):
+            logging.info(f"Resuming pending batches from '{self.state_path}'")
+            return state
+        state = {'batches': []}
+        for model, requests in self.build_requests().items():
+            provider = self.get_instance(model, requests[0][1]['output_path']).provider
+            # Providers cap the number of requests per batch
+            for part, start in enumerate(range(0, len(requests), settings.BATCH_MAX_REQUESTS)):
+                chunk = requests[start:start + settings.BATCH_MAX_REQUESTS]
+                if provider == 'openai':
+                    batch_id = self.__submit_openai(model, chunk, part)
+                else:
+                    batch_id = self.__submit_anthropic(model, chunk, part)
+                logging.info(f"Submitted batch {batch_id} with {len(chunk)} requests for '{model}'")
+                state['batches'].append({'id': batch_id, 'provider': provider, 'model': model, 'done': False,
+                                         'cells': {custom_id: info for custom_id, info, _ in chunk}})
+                self.save_state(state)
+        return state
+
+    def collect(self, batch: dict, results: dict):
+        """
+        Write the results of a batch to the `raw/` and `sc/` folders
+        :return: dict custom_id -> smart contract (None on failure)
+        """
+        smart_contracts = {}
+        for custom_id, info in batch['cells'].items():
+            new_code = results.get(custom_id)
+            legal_agreement_name = os.path.basename(info['legal_agreement_file_path']).split(".")[0]
+            if new_code is None:
+                logging.error(f"No batch result for '{legal_agreement_name}' t={info['temperature']} in '{info['output_path']}'")
+                smart_contracts[custom_id] = None
+                continue
+            inst = self.get_instance(info['model'], info['output_path'])
+            inst.cache_response(info.get('cache_key'), new_code)
+            _, raw_path, sc_path = inst.get_output_paths(info['legal_agreement_file_path'], info['temperature'])
+            try:
+                smart_contracts[custom_id] = Pipeline.save_response(new_code, raw_path, sc_path)
+            except Exception as e:
+                logging.error(f"Error while generating smart contract for '{legal_agreement_name}':\n{e}")
+                smart_contracts[custom_id] = None
+        return smart_contracts
+
+    def run(self, poll_interval: float = None):
+        """
+        Submit, wait for and collect every batch of the sweep
+        :param poll_interval: seconds between status checks, `settings.BATCH_POLL_INTERVAL` by default
+        :return: dict custom_id -> smart contract (None on failure)
+        """
+        poll_interval = settings.BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+        state = self.submit()
+        smart_contracts = {}
+        while True:
+            for batch in state['batches']:
+                if batch['done']:
+                    continue
+                output_path = next(iter(batch['cells'].values()))['output_path']
+                if batch['provider'] == 'openai':
+                    results = self.__poll_openai(batch['model'], batch['id'], output_path)
+                else:
+                    results = self.__poll_anthropic(batch['model'], batch['id'], output_path)
+                if results is not None:
+                    smart_contracts.update(self.collect(batch, results))
+                    batch['done'] = True
+                    self.save_state(state)
+            if all(batch['done'] for batch in state['batches']):
+                return smart_contracts
+            time.sleep(poll_interval)
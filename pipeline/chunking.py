@@ -0,0 +1,104 @@
+import re
+from .core.tokens import count_tokens, get_encoding
+
+# Map-reduce generation of the legal agreements exceeding the prompt budget of a model:
+#   1. the agreement is split by clause into chunks of at most CHUNK_TOKENS tokens,
+#   2. the obligations of every chunk are extracted (map),
+#   3. the extracted obligations replace the agreement in the generation prompt (reduce).
+
+# Clause headings: 'Article 3', 'SECTION IV', 'Clause 2', '§ 5', '1.', '2.3 Payment', '4) Term'
+CLAUSE_PATTERN = re.compile(r"^[ \t]*(?:(?:article|section|clause|schedule|§)[ \t]*[\dIVXLC]+\b|\d+(?:\.\d+)*[.)]?[ \t]+\S)",
+                            re.IGNORECASE | re.MULTILINE)
+SENTENCE_PATTERN = re.compile(r"(?<=[.;:])\s+")
+
+# Map rounds before giving up (each round condenses the output of the previous one)
+MAX_ROUNDS = 3
+
+EXTRACT_PROMPT = lambda chunk, part, n_parts: f"""You are a senior legal analyst. The following text is part {part} of {n_parts} of a legal agreement.
+Extract, as a concise bullet list, everything a smart contract implementing the agreement needs:
+parties and roles, payments (amounts, currencies, schedules), obligations, conditions, constraints, deadlines and termination.
+Keep names, amounts and dates verbatim. Do not write any code.
+
+{chunk}
+"""
+
+
+def split_clauses(text: str):
+    """
+    Split a legal agreement by clause (by paragraph if no clause heading is found)
+    :param text: legal agreement
+    :return: list of clauses
+    """
+    starts = [match.start() for match in CLAUSE_PATTERN.finditer(text)]
+    if starts:
+        bounds = [0] + starts + [len(text)]
+        parts = [text[start:end] for start, end in zip(bounds, bounds[1:])]
+    else:
+        parts = re.split(r"\n\s*\n", text)
+    return [part for part in parts if part.strip()]
+
+
+def _split_long(model: str, text: str, chunk_tokens: int):
+    # Clause longer than a chunk: split by sentence, sentences longer than a chunk by tokens
+    chunks, current = [], ''
+    for sentence in SENTENCE_PATTERN.split(text):
+        if count_tokens(model, sentence) > chunk_tokens:
+            if current:
+                chunks.append(current)
+                current = ''
+            encoding = get_encoding(model)
+            tokens = encoding.encode(sentence, disallowed_special=())
+            chunks.extend(encoding.decode(tokens[i:i + chunk_tokens]) for i in range(0, len(tokens), chunk_tokens))
+        elif current and count_tokens(model, current + ' ' + sentence) > chunk_tokens:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_agreement(model: str, text: str, chunk_tokens: int):
+    """
+    Pack the clauses of a legal agreement into chunks
+    :param model: model name (tokenizer)
+    :param text: legal agreement
+    :param chunk_tokens: max tokens per chunk
+    :return: list of chunks
+    """
+    chunks, current, current_tokens = [], [], 0
+    for clause in split_clauses(text):
+        no_tokens = count_tokens(model, clause)
+        if current and current_tokens + no_tokens > chunk_tokens:
+            chunks.append(''.join(current))
+            current, current_tokens = [], 0
+        if no_tokens > chunk_tokens:
+            chunks.extend(_split_long(model, clause, chunk_tokens))
+        else:
+            current.append(clause)
+            current_tokens += no_tokens
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+
+def get_map_prompts(model: str, text: str, prompt_budget: int, chunk_tokens: int):
+    """
+    Get the extraction prompts of a legal agreement, one per chunk
+    :param model: model name
+    :param text: legal agreement (or the output of a previous round)
+    :param prompt_budget: prompt tokens accepted by the model
+    :param chunk_tokens: max tokens per chunk
+    :return: list of prompts
+    """
+    overhead = count_tokens(model, EXTRACT_PROMPT('', 1, 1))
+    chunks = chunk_agreement(model, text, max(1, min(chunk_tokens, prompt_budget - overhead)))
+    return [EXTRACT_PROMPT(chunk, i + 1, len(chunks)) for i, chunk in enumerate(chunks)]
+
+
+def reduce_notes(notes: list):
+    """
+    Join the obligations extracted from every chunk into the condensed agreement
+    """
+    return '\n\n'.join(f"Part {i + 1} of {len(notes)}:\n{note.strip()}" for i, note in enumerate(notes)) + '\n'
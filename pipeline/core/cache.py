@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from .config import settings
+from .paths import shared_path, sqlite_journal_mode
+
+
+class ResponseCache:
+    """Persistent cache of raw model responses, keyed by a hash of provider, model,
+    fully rendered prompt and sampling parameters. Stored in a SQLite file and evicted
+    least-recently-used first once it grows over `max_bytes`."""
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.__lock = threading.Lock()
+        # Writers lock the whole file with the rollback journal (see `sqlite_journal_mode`)
+        self.__conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=60)
+        self.__conn.execute(f"PRAGMA journal_mode={sqlite_journal_mode(path)}")
+        self.__conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                provider TEXT,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                created REAL,
+                last_access REAL,
+                hits INTEGER DEFAULT 0
+            )""")
+        self.__conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    @classmethod
+    def default(cls):
+        """
+        Get the process-wide cache configured in settings, None if disabled
+        """
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return None
+        path = settings.RESPONSE_CACHE_PATH or shared_path('.cache', 'responses.sqlite')
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path, settings.RESPONSE_CACHE_MAX_BYTES)
+            return cls._instances[path]
+
+    @staticmethod
+    def key(provider: str, model: str, prompt: str, **params):
+        """
+        Compute the cache key of a request
+        :param provider: provider name
+        :param model: model name
+        :param prompt: fully rendered prompt
+        :param params: sampling parameters (temperature, sample index, ...)
+        :return: sha256 hex digest
+        """
+        payload = json.dumps({'provider': provider, 'model': model, 'prompt': prompt, 'params': params}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """
+        :return: cached response, None if missing
+        """
+        with self.__lock:
+            row = self.__conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__conn.execute("UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, response: str, provider: str = None, model: str = None):
+        now = time.time()
+        with self.__lock:
+            self.__conn.execute("INSERT OR REPLACE INTO responses (key, provider, model, response, size, created, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (key, provider, model, response, len(response.encode('utf-8')), now, now))
+            self.__evict()
+
+    def __evict(self):
+        total = self.__conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self.__conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.__conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logging.debug(f"Response cache: evicted {evicted} entries")
+
+    def stats(self):
+        """
+        :return: dict with entries, size and hits, overall and per model
+        """
+        with self.__lock:
+            entries, size, hits = self.__conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM responses").fetchone()
+            per_model = {model: {'entries': n, 'size': s, 'hits': h} for model, n, s, h in
+                         self.__conn.execute("SELECT model, COUNT(*), SUM(size), SUM(hits) FROM responses GROUP BY model").fetchall()}
+        return {
+            'path': self.path,
+            'entries': entries,
+            'size': size,
+            'max_size': self.max_bytes,
+            'hits': hits,
+            'session_hits': self.hits,
+            'session_misses': self.misses,
+            'models': per_model,
+        }
+
+    def clear(self):
+        with self.__lock:
+            self.__conn.execute("DELETE FROM responses")
+            self.__conn.execute("VACUUM")
+
+
+if __name__ == '__main__':
+    # python -m pipeline.core.cache [stats|clear]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    cache = ResponseCache.default()
+    if cache is None:
+        print("Response cache disabled (RESPONSE_CACHE_ENABLED=false)")
+    elif command == 'stats':
+        print(json.dumps(cache.stats(), indent=4))
+    elif command == 'clear':
+        cache.clear()
+        print(f"Response cache '{cache.path}' cleared")
+    else:
+        raise ValueError(f"Unknown command '{command}', use 'stats' or 'clear'")
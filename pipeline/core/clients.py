@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import logging
+import httpx
+from .config import settings
+
+# Shared registry of provider SDK clients, keyed by (provider, api key, ...).
+# Reusing the same client keeps the underlying httpx pool (keep-alive connections
+# and TLS sessions) warm across a whole sweep instead of handshaking on every call.
+# SDK-level retries are disabled, retries are handled by `core.scheduler`.
+# Provider SDKs are imported with their first client: a run only loads the SDKs of its models.
+
+_lock = threading.Lock()
+_clients = {}
+_genai_api_key = None
+
+
+def _limits(provider: str):
+    # Pool size follows the provider concurrency limit used by the async sweep
+    max_connections = getattr(settings, f"{provider.upper()}_MAX_CONCURRENCY")
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections, keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY)
+
+
+def _build_client(provider: str, api_key: str, model: str = None, asynchronous: bool = False):
+    global _genai_api_key
+    timeout = httpx.Timeout(settings.HTTP_TIMEOUT)
+    if provider == 'openai':
+        from openai import OpenAI, AsyncOpenAI
+        if asynchronous:
+            return AsyncOpenAI(api_key=api_key, base_url=settings.OPENAI_BASE_URL, http_client=httpx.AsyncClient(limits=_limits(provider), timeout=timeout), max_retries=0)
+        return OpenAI(api_key=api_key, base_url=settings.OPENAI_BASE_URL, http_client=httpx.Client(limits=_limits(provider), timeout=timeout), max_retries=0)
+    elif provider == 'anthropic':
+        from anthropic import Anthropic, AsyncAnthropic
+        if asynchronous:
+            return AsyncAnthropic(api_key=api_key, base_url=settings.ANTHROPIC_BASE_URL, http_client=httpx.AsyncClient(limits=_limits(provider), timeout=timeout), max_retries=0)
+        return Anthropic(api_key=api_key, base_url=settings.ANTHROPIC_BASE_URL, http_client=httpx.Client(limits=_limits(provider), timeout=timeout), max_retries=0)
+    elif provider == 'mistral':
+        from mistralai import Mistral
+        # The Mistral client exposes both sync and async methods
+        return Mistral(api_key=api_key, server_url=settings.MISTRAL_BASE_URL, client=httpx.Client(limits=_limits(provider), timeout=timeout),
+                       async_client=httpx.AsyncClient(limits=_limits(provider), timeout=timeout))
+    elif provider == 'google':
+        import google.generativeai as genai
+        # `genai.configure` sets a process-wide key, only redo it when the key changes
+        if _genai_api_key != api_key:
+            genai.configure(api_key=api_key)
+            _genai_api_key = api_key
+        return genai.GenerativeModel(model_name=model)
+    raise ValueError(f"Provider '{provider}' not supported")
+
+
+def get_client(provider: str, api_key: str, model: str = None, asynchronous: bool = False):
+    """
+    Get a pooled SDK client for the given provider
+    :param provider: one of `Pipeline.PROVIDERS`
+    :param api_key: provider API key
+    :param model: model name (Gemini clients are bound to a model)
+    :param asynchronous: return the async client
+    :return: SDK client
+    """
+    key = (provider, api_key, model if provider == 'google' else None, asynchronous)
+    if asynchronous and provider != 'google':
+        # httpx async pools are bound to the event loop that opened them
+        key += (id(asyncio.get_running_loop()),)
+    with _lock:
+        if key not in _clients:
+            logging.debug(f"Creating {'async ' if asynchronous else ''}{provider} client")
+            _clients[key] = _build_client(provider, api_key, model, asynchronous)
+        return _clients[key]
+
+
+def clear_clients():
+    """
+    Drop every pooled client (e.g. after changing API keys)
+    """
+    global _genai_api_key
+    with _lock:
+        _clients.clear()
+        _genai_api_key = None
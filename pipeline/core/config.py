@@ -1,3 +1,5 @@
+import os
+import functools
 from pydantic import Field, computed_field, PostgresDsn, BeforeValidator
 from pydantic_core import MultiHostUrl
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -24,26 +26,89 @@ class Settings(BaseSettings, cli_hide_none_type=True):
     API_V1_STR: str | None = Field(default=None)
     
     # OpenAI Constants
-    OPENAI_API_KEY: str
+    OPENAI_API_KEY: str | None = Field(default=None)
     OPENAI_ORG_ID: str | None = Field(default=None)
     OPENAI_PROJ_ID: str | None = Field(default=None)
     OPENAI_MODEL: str | None = Field(default=None)
+    OPENAI_BASE_URL: str | None = Field(default=None)
     OPENAI_MODELS: Annotated[list[str] | None, BeforeValidator(parse_lists)] = Field(default=None)
+    OPENAI_MAX_CONCURRENCY: int = Field(default=16)
     
     # Claude Constants
     ANTHROPIC_API_KEY: str | None = Field(default=None)
     ANTHROPIC_MODEL: str | None = Field(default=None)
+    ANTHROPIC_BASE_URL: str | None = Field(default=None)
     ANTHROPIC_MODELS: Annotated[list[str] | None, BeforeValidator(parse_lists)] = Field(default=None)
+    ANTHROPIC_MAX_CONCURRENCY: int = Field(default=8)
     
     # Mistral Constants
     MISTRAL_API_KEY: str | None = Field(default=None)
     MISTRAL_MODEL: str | None = Field(default=None)
+    MISTRAL_BASE_URL: str | None = Field(default=None)
     MISTRAL_MODELS: Annotated[list[str] | None, BeforeValidator(parse_lists)] = Field(default=None)
+    MISTRAL_MAX_CONCURRENCY: int = Field(default=4)
     
     # Gemini Constants
     GOOGLE_API_KEY: str | None = Field(default=None)
     GOOGLE_MODEL: str | None = Field(default=None)
     GOOGLE_MODELS: Annotated[list[str] | None, BeforeValidator(parse_lists)] = Field(default=None)
+    GOOGLE_MAX_CONCURRENCY: int = Field(default=8)
+    
+    # HTTP connection pool shared by the provider clients
+    HTTP_KEEPALIVE_EXPIRY: float = Field(default=120.0)
+    HTTP_TIMEOUT: float = Field(default=600.0)
+    
+    # Request scheduling: per-model budgets, i.e. RATE_LIMITS='{"gpt-4o": {"rpm": 500, "tpm": 30000}}'
+    RATE_LIMITS: dict[str, dict[str, int]] = Field(default={})
+    MAX_RETRIES: int = Field(default=5)
+    RETRY_BASE_DELAY: float = Field(default=1.0)
+    RETRY_MAX_DELAY: float = Field(default=60.0)
+    
+    # Batch API
+    BATCH_POLL_INTERVAL: float = Field(default=60.0)
+    BATCH_MAX_REQUESTS: int = Field(default=50_000)
+    
+    # Shared folder: pipeline outputs, caches, analysis workspace mounted by the tool containers,
+    # and the work queue of the distributed sweeps (a network share mounted on every node, see pipeline/distributed.py)
+    SHARED_ROOT: str = Field(default=os.path.join('~', 'slither_shared'))
+    
+    # Response cache (defaults to SHARED_ROOT/.cache/responses.sqlite)
+    RESPONSE_CACHE_ENABLED: bool = Field(default=True)
+    RESPONSE_CACHE_PATH: str | None = Field(default=None)
+    RESPONSE_CACHE_MAX_BYTES: int = Field(default=2 * 1024 ** 3)
+    
+    # Token usage log, prompt cache hits included (defaults to SHARED_ROOT/.cache/usage.jsonl)
+    USAGE_LOG_ENABLED: bool = Field(default=True)
+    USAGE_LOG_PATH: str | None = Field(default=None)
+    
+    # Instrumentation spans (defaults to SHARED_ROOT/.cache/spans.jsonl, see core/tracing.py) and prices
+    # in USD per 1M tokens by model name prefix, i.e. MODEL_PRICES='{"gpt-4o": {"input": 2.5, "output": 10, "cached_input": 1.25}}'
+    TRACE_ENABLED: bool = Field(default=True)
+    TRACE_PATH: str | None = Field(default=None)
+    MODEL_PRICES: dict[str, dict[str, float]] = Field(default={})
+    # Run recorded on the spans and usage entries, the summaries cover a single run
+    # (one per process by default, inherited by its child processes; distributed workers take the one of the sweep)
+    RUN_ID: str | None = Field(default=None)
+    
+    # Sweep ledger (sweep_ledger.sqlite under the output root, see pipeline/ledger.py): attempts before a cell stays failed,
+    # seconds without heartbeat after which a running cell (or worker) is considered abandoned and claimed again,
+    # heartbeat period and polling period of the idle distributed workers (seconds)
+    SWEEP_LEDGER_ENABLED: bool = Field(default=True)
+    SWEEP_MAX_ATTEMPTS: int = Field(default=3)
+    SWEEP_LEASE: float = Field(default=300)
+    SWEEP_HEARTBEAT: float = Field(default=30)
+    SWEEP_POLL_INTERVAL: float = Field(default=10)
+    
+    # Scoring (see pipeline/scoring.py): weight profile used by default, extra named profiles
+    SCORE_PROFILE: str = Field(default='default')
+    SCORE_WEIGHT_PROFILES: dict[str, dict] = Field(default={})
+    
+    # Prompt length: context windows by model name prefix (see core/tokens.py), tokens kept for the response,
+    # and map-reduce generation for the agreements exceeding the budget (see pipeline/chunking.py)
+    CONTEXT_WINDOWS: dict[str, int] = Field(default={})
+    COMPLETION_TOKENS: int = Field(default=6_000)
+    CHUNKING_ENABLED: bool = Field(default=True)
+    CHUNK_TOKENS: int = Field(default=4_000)
     
     # PostgresSQL
     POSTGRES_SERVER: str = Field(default="localhost")
@@ -66,4 +131,21 @@ class Settings(BaseSettings, cli_hide_none_type=True):
     
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding='utf-8')
     
-settings = Settings()
\ No newline at end of file
+
+@functools.lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """
+    Read the settings (environment and .env) on first use, once per process
+    """
+    return Settings()
+
+
+class LazySettings:
+    """Stand-in for `Settings` resolved on first attribute access, so that importing a module
+    does not read the environment (post-processing runs need no provider API key)"""
+
+    def __getattr__(self, name: str):
+        return getattr(get_settings(), name)
+
+
+settings = LazySettings()
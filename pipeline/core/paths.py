@@ -0,0 +1,51 @@
+import os
+import functools
+from .config import settings
+
+
+@functools.lru_cache(maxsize=None)
+def ensure_dir(path: str):
+    """
+    Create the given folder once per process. Subsequent calls for the same path are free.
+    :param path: folder to create
+    :return: path
+    """
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def shared_path(*parts: str):
+    """
+    Path in the shared folder (`SHARED_ROOT`, mounted by the analysis containers and shared by the sweep nodes)
+    :param parts: path parts relative to the shared folder (an absolute part replaces the shared folder)
+    :return: path
+    """
+    return os.path.join(os.path.expanduser(settings.SHARED_ROOT), *parts)
+
+
+def to_shared(path: str):
+    """
+    Portable form of a path, relative to the shared folder if inside it (absolute otherwise),
+    so that nodes mounting the shared folder at different places resolve it (see `from_shared`)
+    """
+    path = os.path.abspath(path)
+    root = os.path.abspath(shared_path())
+    return os.path.relpath(path, root) if path.startswith(root + os.sep) else path
+
+
+def from_shared(path: str):
+    """
+    Resolve a path given by `to_shared`
+    """
+    return path if os.path.isabs(path) else shared_path(path)
+
+
+def sqlite_journal_mode(path: str):
+    """
+    SQLite journal mode of a database file. WAL needs memory shared by the processes of a single host, which network
+    filesystems do not provide: databases under the shared folder (possibly a network share used by several nodes) use
+    the rollback journal, only relying on the file locks of the filesystem
+    :param path: database file
+    :return: 'DELETE' under the shared folder, 'WAL' elsewhere
+    """
+    return 'DELETE' if not os.path.isabs(to_shared(path)) else 'WAL'
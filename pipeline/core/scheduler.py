@@ -0,0 +1,252 @@
+import asyncio
+import collections
+import logging
+import random
+import threading
+import time
+from .config import settings
+from . import tracing
+
+# HTTP status codes worth retrying: timeouts, conflicts, rate limits and server errors
+# (529 is Anthropic's "overloaded")
+TRANSIENT_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# Exception class names raised by the provider SDKs (and httpx / google-api-core) for
+# transient failures. Matched by name so that no SDK has to be imported here.
+TRANSIENT_EXCEPTIONS = {
+    'RateLimitError', 'APITimeoutError', 'APIConnectionError', 'InternalServerError',
+    'OverloadedError', 'TimeoutException', 'ConnectError', 'ReadTimeout', 'ReadError',
+    'RemoteProtocolError', 'ResourceExhausted', 'ServiceUnavailable', 'DeadlineExceeded',
+    'TooManyRequests',
+}
+
+
+def is_transient(exc: Exception):
+    """
+    Whether the given provider error is worth retrying
+    :param exc: exception raised by a provider call
+    :return: True if the request can be retried
+    """
+    if isinstance(exc, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    if type(exc).__name__ in TRANSIENT_EXCEPTIONS:
+        return True
+    status_code = getattr(exc, 'status_code', None)
+    if not isinstance(status_code, int):
+        status_code = getattr(exc, 'code', None)
+    return isinstance(status_code, int) and status_code in TRANSIENT_STATUS_CODES
+
+
+def get_retry_after(exc: Exception):
+    """
+    Get the `retry-after` hint (seconds) sent with a provider error, if any
+    """
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Sliding one-minute window over requests (RPM) and tokens (TPM) of a single model.
+    `None` budgets are unlimited."""
+
+    WINDOW = 60.0
+
+    def __init__(self, rpm: int = None, tpm: int = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.__window = collections.deque()  # (timestamp, tokens)
+        self.__tokens = 0
+        self.__paused_until = 0.0
+        self.__lock = threading.Lock()
+
+    def __expire(self, now: float):
+        while self.__window and now - self.__window[0][0] >= self.WINDOW:
+            _, tokens = self.__window.popleft()
+            self.__tokens -= tokens
+
+    def __reserve(self, tokens: int):
+        """
+        Reserve budget for a request
+        :return: 0 if reserved, else the seconds to wait before trying again
+        """
+        with self.__lock:
+            now = time.monotonic()
+            if now < self.__paused_until:
+                return self.__paused_until - now
+            self.__expire(now)
+            wait = 0.0
+            if self.rpm is not None and len(self.__window) >= self.rpm:
+                wait = max(wait, self.WINDOW - (now - self.__window[0][0]))
+            if self.tpm is not None and self.__window and self.__tokens + tokens > self.tpm:
+                # Wait until enough tokens leave the window. A single request bigger
+                # than the whole budget goes through once the window is empty.
+                freed = self.__tokens + tokens - self.tpm
+                for ts, tk in self.__window:
+                    freed -= tk
+                    if freed <= 0:
+                        wait = max(wait, self.WINDOW - (now - ts))
+                        break
+            if wait > 0:
+                return wait
+            self.__window.append((now, tokens))
+            self.__tokens += tokens
+            return 0.0
+
+    def acquire(self, tokens: int = 0):
+        """
+        Block until the request fits the budgets
+        :param tokens: tokens of the request
+        :return: seconds spent waiting
+        """
+        waited = 0.0
+        while (wait := self.__reserve(tokens)) > 0:
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    async def aacquire(self, tokens: int = 0):
+        """
+        Async version of `acquire`
+        """
+        waited = 0.0
+        while (wait := self.__reserve(tokens)) > 0:
+            await asyncio.sleep(wait)
+            waited += wait
+        return waited
+
+    def pause(self, seconds: float):
+        """
+        Stop issuing requests for the given time (i.e., after a 429)
+        """
+        with self.__lock:
+            self.__paused_until = max(self.__paused_until, time.monotonic() + seconds)
+
+
+class Scheduler:
+    """Paces the requests of a model under its RPM/TPM budgets and retries transient
+    failures with jittered exponential backoff. One scheduler is shared per model."""
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, model: str, rpm: int = None, tpm: int = None, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.model = model
+        self.limiter = RateLimiter(rpm, tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.__lock = threading.Lock()
+        self.__stats = {
+            'requests': 0,
+            'retries': 0,
+            'failures': 0,
+            'throttle_time': 0.0,  # seconds spent waiting for budget or backing off
+            'useful_time': 0.0,  # seconds spent in successful provider calls
+            'failed_time': 0.0,  # seconds spent in failed provider calls
+        }
+
+    @classmethod
+    def for_model(cls, model: str):
+        """
+        Get the scheduler shared by every request to the given model. Budgets come from
+        `settings.RATE_LIMITS[model]` (`{"rpm": .., "tpm": ..}`), unlimited if missing.
+        :param model: model name
+        :return: Scheduler
+        """
+        with cls._registry_lock:
+            if model not in cls._registry:
+                limits = (settings.RATE_LIMITS or {}).get(model, {})
+                cls._registry[model] = cls(model, rpm=limits.get('rpm'), tpm=limits.get('tpm'), max_retries=settings.MAX_RETRIES,
+                                           base_delay=settings.RETRY_BASE_DELAY, max_delay=settings.RETRY_MAX_DELAY)
+            return cls._registry[model]
+
+    @property
+    def stats(self):
+        with self.__lock:
+            return dict(self.__stats)
+
+    def __count(self, **kwargs):
+        with self.__lock:
+            for key, val in kwargs.items():
+                self.__stats[key] += val
+
+    def __backoff(self, attempt: int, exc: Exception):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        # Full jitter, so that concurrent requests do not retry in lockstep
+        delay = random.uniform(0, delay)
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            self.limiter.pause(retry_after)
+        logging.warning(f"Transient error from '{self.model}' ({type(exc).__name__}: {exc}). Retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
+
+    def call(self, fn, tokens: int = 0):
+        """
+        Run a provider call under the model budgets
+        :param fn: function performing the request
+        :param tokens: tokens of the request
+        :return: `fn()` result
+        """
+        for attempt in range(self.max_retries + 1):
+            self.__count(requests=1, throttle_time=self.limiter.acquire(tokens))
+            start = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                self.__count(failed_time=time.monotonic() - start)
+                if not is_transient(e) or attempt == self.max_retries:
+                    self.__count(failures=1)
+                    raise
+                delay = self.__backoff(attempt, e)
+                self.__count(retries=1, throttle_time=delay)
+                tracing.count(retries=1, throttle_time=delay)
+                time.sleep(delay)
+            else:
+                self.__count(useful_time=time.monotonic() - start)
+                return result
+
+    async def acall(self, fn, tokens: int = 0):
+        """
+        Async version of `call`
+        :param fn: function returning the awaitable performing the request
+        :param tokens: tokens of the request
+        :return: `await fn()` result
+        """
+        for attempt in range(self.max_retries + 1):
+            self.__count(requests=1, throttle_time=await self.limiter.aacquire(tokens))
+            start = time.monotonic()
+            try:
+                result = await fn()
+            except Exception as e:
+                self.__count(failed_time=time.monotonic() - start)
+                if not is_transient(e) or attempt == self.max_retries:
+                    self.__count(failures=1)
+                    raise
+                delay = self.__backoff(attempt, e)
+                self.__count(retries=1, throttle_time=delay)
+                tracing.count(retries=1, throttle_time=delay)
+                await asyncio.sleep(delay)
+            else:
+                self.__count(useful_time=time.monotonic() - start)
+                return result
+
+    @classmethod
+    def report(cls):
+        """
+        Log and return the counters of every model scheduler
+        :return: dict model -> stats
+        """
+        with cls._registry_lock:
+            schedulers = dict(cls._registry)
+        report = {model: scheduler.stats for model, scheduler in schedulers.items()}
+        for model, stats in report.items():
+            logging.info(f"Scheduler '{model}': {stats['requests']} requests, {stats['retries']} retries, {stats['failures']} failures, "
+                         f"throttle time {stats['throttle_time']:.1f}s, useful time {stats['useful_time']:.1f}s")
+        return report
@@ -0,0 +1,73 @@
+import functools
+from .config import settings
+
+# Encoding used for models unknown to tiktoken (i.e., Mistral, Gemini, Claude).
+# It is only an estimate, good enough to pace requests against token budgets.
+DEFAULT_ENCODING = "cl100k_base"
+
+# Context windows (prompt + completion tokens), matched by the longest model name prefix.
+# Can be extended or overridden with CONTEXT_WINDOWS, i.e. '{"my-finetuned-gpt": 16384}'
+CONTEXT_WINDOWS = {
+    'gpt-4o': 128_000,
+    'gpt-4-turbo': 128_000,
+    'gpt-4-1106': 128_000,
+    'gpt-4-0125': 128_000,
+    'gpt-4-32k': 32_768,
+    'gpt-4': 8_192,
+    'gpt-3.5-turbo': 16_385,
+    'o1': 128_000,
+    'claude': 200_000,
+    'claude-2.0': 100_000,
+    'mistral-large': 128_000,
+    'mistral-medium': 32_000,
+    'mistral-small': 32_000,
+    'open-mistral-nemo': 128_000,
+    'open-mixtral-8x22b': 64_000,
+    'gemini-1.5': 1_048_576,
+    'gemini': 30_720,
+}
+DEFAULT_CONTEXT_WINDOW = 8_192
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """
+    Get the tiktoken encoder for the given model, built once per process
+    :param model: model name
+    :return: tiktoken encoding
+    """
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(model: str, text: str):
+    """
+    Count the tokens of the given text for the given model
+    :param model: model name
+    :param text: text to encode
+    :return: number of tokens
+    """
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+def get_context_window(model: str):
+    """
+    Get the context window of the given model
+    :param model: model name
+    :return: number of tokens
+    """
+    windows = {**CONTEXT_WINDOWS, **settings.CONTEXT_WINDOWS}
+    prefixes = [prefix for prefix in windows if model.startswith(prefix)]
+    return windows[max(prefixes, key=len)] if prefixes else DEFAULT_CONTEXT_WINDOW
+
+
+def get_prompt_budget(model: str):
+    """
+    Get the number of prompt tokens the given model accepts, keeping COMPLETION_TOKENS for the response
+    :param model: model name
+    :return: number of tokens
+    """
+    return get_context_window(model) - settings.COMPLETION_TOKENS
@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import inspect
+import logging
+import functools
+import threading
+import contextlib
+import contextvars
+from .config import settings
+from .paths import shared_path
+from .usage import UsageLog, normalize_usage, run_id, set_run_id
+
+# Instrumentation spans: every timed stage (generation, provider call, analysis stage) is appended
+# to a JSONL sink as {'time', 'run', 'name', 'id', 'parent_id', 'duration', 'status', 'error', **attributes}.
+# Attributes carry the token usage, retries and cache hits of the stage.
+# The span in progress follows the asyncio tasks (contextvars), threads and processes start new roots.
+_current = contextvars.ContextVar('span', default=None)
+
+# Name of the span of `SmartCMetrics.pipe`, its 'compilable' attribute (model -> compilable contracts) feeds the summary
+ANALYSIS_SPAN = 'SmartCMetrics.pipe'
+
+
+class Span:
+    """Stage in progress, attributes can be set until it ends"""
+
+    def __init__(self, name: str, parent=None, **attrs):
+        self.name = name
+        self.id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.id if parent is not None else None
+        self.attrs = dict(attrs)
+        self.status = 'ok'
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, **counters):
+        for key, val in counters.items():
+            self.attrs[key] = self.attrs.get(key, 0) + val
+
+    def fail(self, error):
+        """
+        Mark the stage as failed (for errors handled inside the stage)
+        """
+        self.status = 'error'
+        self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+
+class SpanLog:
+    """Append-only JSONL sink of the spans, shared by the threads and processes of a run"""
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def default(cls):
+        """
+        Get the process-wide sink configured in settings, None if disabled
+        """
+        if not settings.TRACE_ENABLED:
+            return None
+        path = settings.TRACE_PATH or shared_path('.cache', 'spans.jsonl')
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path)
+            return cls._instances[path]
+
+    def write(self, record: dict):
+        # A single write per line, appends of concurrent processes do not interleave
+        line = json.dumps(record, default=str) + '\n'
+        with self.__lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def read(self):
+        """
+        :return: iterator over the recorded spans
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def last_run(self):
+        """
+        :return: run of the last recorded span, None if none
+        """
+        last = None
+        for item in self.read():
+            last = item.get('run', last)
+        return last
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """
+    Time a stage and record it in the span sink (exceptions are recorded and raised again)
+    :param name: stage name, i.e. 'Pipeline.get_smart_contract_from_ai'
+    :param attrs: span attributes, i.e. model, provider
+    :return: `Span`, to set attributes known during the stage
+    """
+    current = Span(name, _current.get(), **attrs)
+    token = _current.set(current)
+    log = SpanLog.default()
+    start_time, start = time.time(), time.monotonic()
+    try:
+        yield current
+    except BaseException as e:
+        current.fail(e)
+        raise
+    finally:
+        _current.reset(token)
+        if log is not None:
+            log.write({'time': start_time, 'run': run_id(), 'name': name, 'id': current.id, 'parent_id': current.parent_id,
+                       'duration': time.monotonic() - start, 'status': current.status, 'error': current.error, **current.attrs})
+
+
+def traced(name: str = None, attrs=None):
+    """
+    Decorator recording every call of a function (sync or async) as a span
+    :param name: span name, the function qualified name by default
+    :param attrs: function (same arguments as the decorated one) returning the span attributes
+    """
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with span(span_name, **(attrs(*args, **kwargs) if attrs else {})):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with span(span_name, **(attrs(*args, **kwargs) if attrs else {})):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    """
+    :return: span in progress, None outside of any span
+    """
+    return _current.get()
+
+
+def annotate(**attrs):
+    """
+    Set attributes of the span in progress, if any
+    """
+    current = _current.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def count(**counters):
+    """
+    Increment counters of the span in progress, if any (i.e., retries, cache hits)
+    """
+    current = _current.get()
+    if current is not None:
+        current.add(**counters)
+
+
+def fail(error):
+    """
+    Mark the span in progress as failed, if any
+    """
+    current = _current.get()
+    if current is not None:
+        current.fail(error)
+
+
+def record_usage(provider: str, usage):
+    """
+    Add the token usage of a provider response to the span in progress
+    """
+    current = _current.get()
+    if current is not None and usage is not None:
+        current.add(**normalize_usage(provider, usage))
+
+
+def percentile(values: list, q: float):
+    """
+    Nearest-rank percentile
+    :param q: percentile in [0, 1]
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def summary(log: SpanLog = None, usage_log: UsageLog = None, run: str = None):
+    """
+    Summarize the spans and costs of a run
+    :param log: span sink, the default one if None
+    :param usage_log: token usage log (costs), the default one if None
+    :param run: run id, the current one if None
+    :return: dict with
+        'stages': span name -> model -> count, errors, p50, p95, mean and total duration (seconds),
+        'models': model -> cost (USD), compilable contracts, cost per compilable contract
+    """
+    log = log or SpanLog.default()
+    usage_log = usage_log or UsageLog.default()
+    run = run or run_id()
+    durations, errors, compilable = {}, {}, {}
+    for item in (log.read() if log is not None else []):
+        if item.get('run') != run:
+            continue
+        key = (item['name'], item.get('model') or '-')
+        durations.setdefault(key, []).append(item['duration'])
+        errors[key] = errors.get(key, 0) + (item['status'] == 'error')
+        if item['name'] == ANALYSIS_SPAN and item['status'] == 'ok':
+            # The last analysis of a model is the current one
+            compilable.update(item.get('compilable') or {})
+
+    stages = {}
+    for (name, model), values in sorted(durations.items()):
+        stages.setdefault(name, {})[model] = {
+            'count': len(values),
+            'errors': errors[(name, model)],
+            'p50': percentile(values, 0.5),
+            'p95': percentile(values, 0.95),
+            'mean': sum(values) / len(values),
+            'total': sum(values),
+        }
+
+    costs = {model: stats['cost'] for model, stats in (usage_log.summary(run) if usage_log is not None else {}).items()}
+    models = {}
+    for model in sorted(set(costs) | set(compilable)):
+        cost, n_compilable = costs.get(model), compilable.get(model)
+        models[model] = {
+            'cost': cost,
+            'compilable': n_compilable,
+            'cost_per_compilable': cost / n_compilable if cost is not None and n_compilable else None,
+        }
+    return {'stages': stages, 'models': models}
+
+
+def log_summary(run: str = None):
+    """
+    Log the p50/p95 latencies of every stage and the cost per compilable contract of every model, over a run
+    :param run: run id, the current one if None
+    :return: `summary()`
+    """
+    report = summary(run=run)
+    for name, models in report['stages'].items():
+        for model, stats in models.items():
+            logging.info(f"Stage '{name}' ({model}): {stats['count']} spans, {stats['errors']} errors, "
+                         f"p50 {stats['p50']:.2f}s, p95 {stats['p95']:.2f}s")
+    for model, stats in report['models'].items():
+        cost = f"${stats['cost']:.4f}" if stats['cost'] is not None else 'unknown'
+        per_contract = f"${stats['cost_per_compilable']:.4f}" if stats['cost_per_compilable'] is not None else 'unknown'
+        logging.info(f"Model '{model}': cost {cost}, {stats['compilable']} compilable contracts, {per_contract} per compilable contract")
+    return report
+
+
+if __name__ == '__main__':
+    # python -m pipeline.core.tracing [run id], the last recorded run by default
+    if SpanLog.default() is None:
+        print("Tracing disabled (TRACE_ENABLED=false)")
+    else:
+        print(json.dumps(summary(run=sys.argv[1] if len(sys.argv) > 1 else SpanLog.default().last_run()), indent=4))
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+from .config import settings
+from .paths import shared_path
+
+# Usage field names of the provider SDKs (and of the batch results), first match wins
+USAGE_FIELDS = {
+    'input_tokens': ['input_tokens', 'prompt_tokens', 'prompt_token_count'],
+    'output_tokens': ['output_tokens', 'completion_tokens', 'candidates_token_count'],
+    # Prompt tokens read from the provider prompt cache
+    'cached_tokens': ['cache_read_input_tokens', 'cached_content_token_count', 'prompt_tokens_details.cached_tokens'],
+    # Prompt tokens written to the provider prompt cache (Anthropic)
+    'cache_creation_tokens': ['cache_creation_input_tokens'],
+}
+
+# USD per 1M tokens, matched by the longest model name prefix. Can be extended or overridden with MODEL_PRICES.
+# 'cached_input' and 'cache_creation' default to the input price.
+MODEL_PRICES = {
+    'gpt-4o': {'input': 2.5, 'output': 10.0, 'cached_input': 1.25},
+    'gpt-4o-mini': {'input': 0.15, 'output': 0.6, 'cached_input': 0.075},
+    'gpt-4-turbo': {'input': 10.0, 'output': 30.0},
+    'gpt-4-1106': {'input': 10.0, 'output': 30.0},
+    'gpt-4-0125': {'input': 10.0, 'output': 30.0},
+    'gpt-4': {'input': 30.0, 'output': 60.0},
+    'gpt-3.5-turbo': {'input': 0.5, 'output': 1.5},
+    'claude-3-5-sonnet': {'input': 3.0, 'output': 15.0, 'cached_input': 0.3, 'cache_creation': 3.75},
+    'claude-3-opus': {'input': 15.0, 'output': 75.0, 'cached_input': 1.5, 'cache_creation': 18.75},
+    'claude-3-haiku': {'input': 0.25, 'output': 1.25, 'cached_input': 0.03, 'cache_creation': 0.3},
+    'mistral-large': {'input': 2.0, 'output': 6.0},
+    'mistral-small': {'input': 0.2, 'output': 0.6},
+    'open-mistral-nemo': {'input': 0.15, 'output': 0.15},
+    'gemini-1.5-pro': {'input': 1.25, 'output': 5.0},
+    'gemini-1.5-flash': {'input': 0.075, 'output': 0.3},
+}
+# Batch APIs bill half the price
+BATCH_DISCOUNT = 0.5
+
+_run_id = None
+_run_id_lock = threading.Lock()
+
+
+def run_id():
+    """
+    Id of the current run (RUN_ID, or a new one per process), recorded on the usage entries and spans
+    """
+    global _run_id
+    with _run_id_lock:
+        if _run_id is None:
+            _run_id = settings.RUN_ID or uuid.uuid4().hex[:12]
+            # Child processes (i.e., the analysis process pool) record the same run
+            os.environ['RUN_ID'] = _run_id
+        return _run_id
+
+
+def set_run_id(value: str):
+    """
+    Record the next usage entries and spans on the given run (i.e., the run of a distributed sweep)
+    """
+    global _run_id
+    with _run_id_lock:
+        _run_id = value
+        os.environ['RUN_ID'] = value
+
+
+def _get(obj, path: str):
+    for name in path.split('.'):
+        if obj is None:
+            return None
+        obj = obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+    return obj
+
+
+def normalize_usage(provider: str, usage):
+    """
+    Normalize the usage of a provider response (SDK object or dict)
+    :return: dict with 'input_tokens' (all prompt tokens), 'output_tokens', 'cached_tokens' and 'cache_creation_tokens'
+    """
+    normalized = {}
+    for key, paths in USAGE_FIELDS.items():
+        values = [_get(usage, path) for path in paths]
+        normalized[key] = next((value for value in values if isinstance(value, int)), 0)
+    if provider == 'anthropic':
+        # Anthropic input tokens exclude the ones read from or written to the cache
+        normalized['input_tokens'] += normalized['cached_tokens'] + normalized['cache_creation_tokens']
+    return normalized
+
+
+def get_prices(model: str):
+    """
+    Get the prices of the given model
+    :param model: model name
+    :return: dict with 'input', 'output', 'cached_input' and 'cache_creation' (USD per 1M tokens), None if unknown
+    """
+    prices = {**MODEL_PRICES, **settings.MODEL_PRICES}
+    prefixes = [prefix for prefix in prices if model.startswith(prefix)]
+    if not prefixes:
+        return None
+    price = prices[max(prefixes, key=len)]
+    return {'cached_input': price['input'], 'cache_creation': price['input'], **price}
+
+
+def get_cost(model: str, usage: dict, batch: bool = False):
+    """
+    Get the cost of a request
+    :param model: model name
+    :param usage: normalized usage (see `normalize_usage`)
+    :param batch: request sent through a batch API
+    :return: USD, None if the model has no price
+    """
+    prices = get_prices(model)
+    if prices is None:
+        return None
+    uncached = usage.get('input_tokens', 0) - usage.get('cached_tokens', 0) - usage.get('cache_creation_tokens', 0)
+    cost = (uncached * prices['input'] + usage.get('cached_tokens', 0) * prices['cached_input']
+            + usage.get('cache_creation_tokens', 0) * prices['cache_creation'] + usage.get('output_tokens', 0) * prices['output']) / 1e6
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+class UsageLog:
+    """Append-only JSONL log of the token usage of every provider request, prompt cache
+    reads and writes included, to follow the prompt cache hit rate of a sweep."""
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def default(cls):
+        """
+        Get the process-wide log configured in settings, None if disabled
+        """
+        if not settings.USAGE_LOG_ENABLED:
+            return None
+        path = settings.USAGE_LOG_PATH or shared_path('.cache', 'usage.jsonl')
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path)
+            return cls._instances[path]
+
+    def record(self, provider: str, model: str, usage=None, **extra):
+        """
+        Append the usage of a request
+        :param usage: usage of the provider response (SDK object or dict), None if unknown (i.e., interrupted stream)
+        :param extra: other fields, i.e. 'latency' and 'ttft' (seconds)
+        """
+        line = {'time': time.time(), 'run': run_id(), 'provider': provider, 'model': model, **normalize_usage(provider, usage), **extra}
+        with self.__lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(line) + '\n')
+
+    def summary(self, run: str = None):
+        """
+        :param run: run id to summarize, every run if None
+        :return: dict model -> requests, input tokens, cached tokens, cache hit rate (share of cached input tokens),
+            cost (USD, None if the model has no price)
+        """
+        summary = {}
+        if not os.path.exists(self.path):
+            return summary
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if run is not None and item.get('run') != run:
+                    continue
+                stats = summary.setdefault(item['model'], {'requests': 0, 'input_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0, 'cache_creation_tokens': 0, 'cost': 0.0})
+                stats['requests'] += 1
+                for key in ['input_tokens', 'output_tokens', 'cached_tokens', 'cache_creation_tokens']:
+                    stats[key] += item.get(key, 0)
+                cost = get_cost(item['model'], item, item.get('batch', False))
+                stats['cost'] = stats['cost'] + cost if cost is not None and stats['cost'] is not None else None
+        for stats in summary.values():
+            stats['cache_hit_rate'] = stats['cached_tokens'] / stats['input_tokens'] if stats['input_tokens'] else 0.0
+        return summary
+
+
+if __name__ == '__main__':
+    # python -m pipeline.core.usage [run id]
+    log = UsageLog.default()
+    if log is None:
+        print("Usage log disabled (USAGE_LOG_ENABLED=false)")
+    else:
+        print(json.dumps(log.summary(sys.argv[1] if len(sys.argv) > 1 else None), indent=4))
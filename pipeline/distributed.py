@@ -0,0 +1,272 @@
+"""
+Distributed sweeps: a coordinator records the generation cells and their analysis in the sweep ledger
+of a shared output root (see `pipeline.ledger`), worker nodes mounting the same SHARED_ROOT claim them
+until none is left, reporting heartbeats, and the coordinator collects the results.
+
+    python -m pipeline.distributed submit output ./test_contracts_txt --models gpt-4o,claude-3-5-sonnet-20240620 --n-iter 4
+    python -m pipeline.distributed worker output [--roles generate,analyze] [--n-workers 8]   # on every node
+    python -m pipeline.distributed status output
+    python -m pipeline.distributed collect output [--excel]
+    python -m pipeline.distributed local output --workers 4   # worker processes standing in for nodes, then collect
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import threading
+import subprocess
+from .core.config import settings
+from .core import tracing
+from .core.paths import shared_path
+from .ledger import SweepLedger
+from .sweep import iter_cells
+
+GENERATE = 'generate'
+ANALYZE = 'analyze'
+ROLES = [GENERATE, ANALYZE]
+
+
+def _get_config(ledger: SweepLedger):
+    # Config of the sweep, its run becomes the current one (see `core.tracing.summary`)
+    config = ledger.get_config()
+    if config.get('run_id'):
+        tracing.set_run_id(config['run_id'])
+    return config
+
+
+class SweepCoordinator:
+    """Submit a sweep to the shared ledger, follow its progress and collect the results"""
+
+    def __init__(self, output_root: str = 'output'):
+        """
+        :param output_root: output root of the sweep, relative to the shared folder
+        """
+        self.output_root = output_root
+        self.ledger = SweepLedger.for_output(output_root)
+
+    def submit(self, legal_agreement_path: str, models: list, prompts: str = 'PROMPTS', n_iter: int = 1, temperatures = [0.5],
+               overwrite: bool = False, resample: bool = False, stream: bool = False, n_samples: int = 1, vul_tool: str = 'slither',
+               backend: str = 'docker', path2sol_ref: str = None, analyze: bool = True):
+        """
+        Record the cells of a sweep (and their analysis) for the workers
+        :param legal_agreement_path: folder containing the legal agreements, copied to the shared folder
+        :param models: list of model names
+        :param prompts: name of the prompts dict in `pipeline.prompts` (i.e., 'PROMPTS', 'PREFIX_PROMPTS')
+        :param n_iter: number of repeated iterations
+        :param temperatures: temperatures to evaluate
+        :param overwrite: generate (and analyze) the cells again, done ones included
+        :param resample: bypass the response cache (see `Pipeline.get_smart_contract_from_ai`)
+        :param stream: stream the responses and stop once the code block is closed
+        :param n_samples: iterations generated per request (see `Pipeline.apipe`)
+        :param vul_tool: vulnerability tool(s) of the analysis, i.e. 'slither,mythril'
+        :param backend: analysis workers backend, 'docker' or 'local'
+        :param path2sol_ref: reference smart contract for the BLEU metrics
+        :param analyze: queue the analysis of the generated contracts
+        :return: number of new cells
+        """
+        from . import prompts as prompts_module
+        # Every node reads the agreements from the shared folder
+        agreements_dir = shared_path(self.output_root, '.agreements')
+        os.makedirs(agreements_dir, exist_ok=True)
+        for file in sorted(os.listdir(legal_agreement_path)):
+            if os.path.abspath(os.path.join(legal_agreement_path, file)) != os.path.abspath(os.path.join(agreements_dir, file)):
+                shutil.copy(os.path.join(legal_agreement_path, file), agreements_dir)
+        cells = list(iter_cells(agreements_dir, models, getattr(prompts_module, prompts), n_iter, temperatures, self.output_root))
+        added = self.ledger.add_cells(cells)
+        if overwrite:
+            self.ledger.reset(cells)
+        # The workers overwrite the existing smart contracts of the cells they claim (done cells are never claimed again)
+        # The spans and usage of the workers are recorded on the run of the sweep (see `core.tracing.summary`)
+        self.ledger.set_config(run_id=tracing.run_id(), prompts=prompts, overwrite=overwrite, resample=resample, stream=stream, n_samples=n_samples, vul_tool=vul_tool,
+                               backend=backend, path2sol_ref=path2sol_ref)
+        if analyze:
+            self.ledger.add_analyses()
+        logging.info(f"Sweep '{self.output_root}': {added}/{len(cells)} new cells")
+        return added
+
+    def status(self):
+        """
+        :return: dict with the cells and analysis jobs per model and state, and the workers
+        """
+        return {'cells': self.ledger.summary(), 'analyses': self.ledger.summary(analyses=True), 'workers': self.ledger.workers()}
+
+    def wait(self, poll_interval: float = None):
+        """
+        Wait until no cell or analysis job is pending or running
+        """
+        while self.ledger.active():
+            time.sleep(poll_interval or settings.SWEEP_POLL_INTERVAL)
+
+    def collect(self, excel: bool = False, profile: str = None):
+        """
+        Merge the results into the Parquet datasets of the output root (see `SmartCMetrics.pipe`).
+        Contracts analyzed by the workers come from the results store, the missing ones are analyzed here
+        :return: metrics and findings DataFrames
+        """
+        from .postprocessing import SmartCMetrics
+        config = _get_config(self.ledger)
+        return SmartCMetrics.pipe(shared_path(self.output_root), config.get('vul_tool', 'slither'), config.get('path2sol_ref'),
+                                  backend=config.get('backend', 'docker'), excel=excel, profile=profile)
+
+    def run_local(self, n_workers: int, roles: list = ROLES, worker_n_workers: int = None):
+        """
+        Run worker processes on this machine, standing in for the nodes, until the sweep is done
+        :param n_workers: number of worker processes
+        :param roles: roles of the workers
+        :param worker_n_workers: analysis workers per process (see `SweepWorker`)
+        :return: exit codes of the worker processes
+        """
+        cmd = [sys.executable, '-m', 'pipeline.distributed', 'worker', self.output_root, '--roles', ','.join(roles)]
+        if worker_n_workers:
+            cmd += ['--n-workers', str(worker_n_workers)]
+        procs = [subprocess.Popen(cmd) for _ in range(n_workers)]
+        return [proc.wait() for proc in procs]
+
+
+class SweepWorker:
+    """Worker node of a distributed sweep: generates the pending cells and analyzes the generated contracts
+    of the shared ledger, with a heartbeat so that the jobs of a crashed worker are claimed again"""
+
+    def __init__(self, output_root: str = 'output', roles: list = ROLES, n_workers: int = None, wait: bool = False):
+        """
+        :param output_root: output root of the sweep, relative to the shared folder
+        :param roles: 'generate' (provider requests) and/or 'analyze' (compilation, vulnerability detection, metrics)
+        :param n_workers: contracts analyzed at once (analysis workers), number of CPUs by default
+        :param wait: keep polling for new jobs once the sweep is done, instead of exiting
+        """
+        self.output_root = output_root
+        self.roles = roles
+        self.n_workers = n_workers or os.cpu_count()
+        self.wait = wait
+        self.ledger = SweepLedger.for_output(output_root)
+        self.worker = SweepLedger.worker_id()
+
+    def __heartbeat(self, stop: threading.Event):
+        while not stop.wait(settings.SWEEP_HEARTBEAT):
+            try:
+                self.ledger.heartbeat(self.worker)
+            except Exception as e:
+                logging.warning(f"[{self.worker}] Heartbeat failed: {e}")
+
+    def generate(self):
+        """
+        Generate the pending cells
+        :return: number of cells run
+        """
+        from . import prompts
+        from .pipeline import Pipeline
+        config = _get_config(self.ledger)
+        results = Pipeline.work(self.output_root, getattr(prompts, config.get('prompts', 'PROMPTS')), config.get('overwrite', False),
+                                config.get('resample', False), config.get('stream', False), config.get('n_samples', 1))
+        return len(results)
+
+    def analyze(self):
+        """
+        Analyze the generated contracts, `n_workers` at a time
+        :return: number of analysis jobs run
+        """
+        from .pipeline import Pipeline
+        from .postprocessing import SmartCMetrics
+        config = _get_config(self.ledger)
+        count = 0
+        while claimed := self.ledger.claim_analyses(self.worker, self.n_workers):
+            sol_paths = {analysis_id: Pipeline(cell.model, cell.output_path).get_output_paths(cell.legal_agreement_file_path, cell.temperature)[2]
+                         for analysis_id, cell in claimed}
+            missing = [analysis_id for analysis_id, path in sol_paths.items() if not os.path.exists(path)]
+            self.ledger.fail_analyses(missing, "Smart contract not found")
+            paths = [path for analysis_id, path in sol_paths.items() if analysis_id not in missing]
+            try:
+                metrics = SmartCMetrics.analyze(shared_path(self.output_root), paths, config.get('vul_tool', 'slither'), config.get('path2sol_ref'),
+                                                self.n_workers, config.get('backend', 'docker'))
+            except Exception as e:
+                logging.error(f"[{self.worker}] Analysis failed:\n{e}")
+                self.ledger.fail_analyses([analysis_id for analysis_id in sol_paths if analysis_id not in missing], e)
+                metrics = {}
+            self.ledger.complete_analyses([analysis_id for analysis_id, path in sol_paths.items() if metrics.get(path) is not None])
+            self.ledger.fail_analyses([analysis_id for analysis_id, path in sol_paths.items() if path in metrics and metrics[path] is None],
+                                      "Metrics not computed")
+            count += len(claimed)
+        return count
+
+    def run(self):
+        """
+        Claim and run jobs until the sweep is done (or forever with `wait`)
+        :return: number of jobs run
+        """
+        self.ledger.register(self.worker, self.roles)
+        logging.info(f"[{self.worker}] Worker started on '{self.output_root}' ({', '.join(self.roles)})")
+        stop = threading.Event()
+        threading.Thread(target=self.__heartbeat, args=(stop,), daemon=True).start()
+        total = 0
+        try:
+            while True:
+                count = 0
+                if GENERATE in self.roles:
+                    count += self.generate()
+                if ANALYZE in self.roles:
+                    count += self.analyze()
+                total += count
+                # Idle: the remaining jobs are running on other workers (claimed again if they stop reporting)
+                if not count:
+                    if not self.wait and not self.ledger.active():
+                        break
+                    time.sleep(settings.SWEEP_POLL_INTERVAL)
+        finally:
+            stop.set()
+            self.ledger.heartbeat(self.worker, 'stopped')
+        logging.info(f"[{self.worker}] Worker stopped, {total} jobs run")
+        return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Distributed sweep")
+    parser.add_argument('command', choices=['submit', 'worker', 'status', 'collect', 'local'])
+    parser.add_argument('output_root', help="sweep output root, relative to the shared folder (SHARED_ROOT)")
+    parser.add_argument('legal_agreement_path', nargs='?', help="folder containing the legal agreements (submit, local)")
+    parser.add_argument('--models', default=None, help="comma separated model names (submit, local)")
+    parser.add_argument('--prompts', default='PROMPTS', help="prompts dict of `pipeline.prompts`")
+    parser.add_argument('--n-iter', type=int, default=1)
+    parser.add_argument('--temperatures', default='0.5', help="comma separated temperatures")
+    parser.add_argument('--n-samples', type=int, default=1)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--overwrite', action='store_true')
+    parser.add_argument('--resample', action='store_true', help="bypass the response cache")
+    parser.add_argument('--vul-tool', default='slither')
+    parser.add_argument('--backend', default='docker', choices=['docker', 'local'])
+    parser.add_argument('--no-analysis', action='store_true', help="generation only")
+    parser.add_argument('--roles', default=','.join(ROLES), help="worker roles (worker, local)")
+    parser.add_argument('--n-workers', type=int, default=None, help="contracts analyzed at once per worker")
+    parser.add_argument('--workers', type=int, default=2, help="worker processes (local)")
+    parser.add_argument('--wait', action='store_true', help="keep the worker polling once the sweep is done")
+    parser.add_argument('--excel', action='store_true')
+    args = parser.parse_args()
+
+    coordinator = SweepCoordinator(args.output_root)
+    if args.command == 'submit' and not args.legal_agreement_path:
+        parser.error("the legal agreements folder is required to submit a sweep")
+    if args.command in ('submit', 'local') and args.legal_agreement_path:
+        if not args.models:
+            parser.error("--models is required to submit a sweep")
+        coordinator.submit(args.legal_agreement_path, args.models.split(','), args.prompts, args.n_iter,
+                           [float(t) for t in args.temperatures.split(',')], args.overwrite, args.resample, args.stream, args.n_samples,
+                           args.vul_tool, args.backend, analyze=not args.no_analysis)
+    if args.command == 'worker':
+        SweepWorker(args.output_root, args.roles.split(','), args.n_workers, args.wait).run()
+    elif args.command == 'status':
+        status = coordinator.status()
+        for kind in ['cells', 'analyses']:
+            for model, states in status[kind].items():
+                print(f"{kind} {model}: " + ', '.join(f"{state} {count}" for state, count in states.items()))
+        for worker in status['workers']:
+            print(f"worker {worker['id']} ({worker['roles']}): {worker['state']}, last heartbeat {time.time() - worker['heartbeat']:.0f}s ago"
+                  + ('' if worker['alive'] else ' (lost)'))
+    elif args.command == 'local':
+        codes = coordinator.run_local(args.workers, args.roles.split(','), args.n_workers)
+        if any(codes):
+            sys.exit(f"Workers exited with {codes}")
+        if not args.no_analysis:
+            coordinator.collect(args.excel)
+    elif args.command == 'collect':
+        coordinator.collect(args.excel)
@@ -0,0 +1,382 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from .core.config import settings
+from .core.paths import shared_path, to_shared, from_shared, sqlite_journal_mode
+from .sweep import SweepCell
+
+# Cell (and analysis) states: pending -> running -> done | failed. Failed cells are retried only when requeued
+# (see `SweepLedger.requeue`), running cells without heartbeat for SWEEP_LEASE are claimed again (crashed worker).
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+STATES = [PENDING, RUNNING, DONE, FAILED]
+
+# SweepCell field -> ledger column
+COLUMNS = {
+    'model': 'model',
+    'iteration': 'iteration',
+    'prompt_name': 'prompt',
+    'legal_agreement_file_path': 'agreement',
+    'temperature': 'temperature',
+    'output_path': 'output_path',
+}
+
+
+class SweepLedger:
+    """Durable ledger of the cells of a sweep (SQLite file under the output root).
+
+    Every (model, iteration, prompt, agreement, temperature) cell is recorded with its state,
+    attempts, last error and timings. Workers (coroutines, threads, processes or nodes sharing
+    the output root) claim cells atomically, so a cell is generated once even with several workers
+    on the same output, and a restarted sweep only runs the cells that are not done.
+    The analysis of the generated contracts is queued the same way (one job per cell, claimable
+    once the cell is done), and the workers of a distributed sweep report heartbeats
+    (see `pipeline.distributed`).
+    """
+
+    FILE_NAME = 'sweep_ledger.sqlite'
+
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=60)
+        self.__conn.row_factory = sqlite3.Row
+        if path != ':memory:':
+            self.__conn.execute(f"PRAGMA journal_mode={sqlite_journal_mode(path)}")
+        self.__conn.execute("""
+            CREATE TABLE IF NOT EXISTS cells (
+                id INTEGER PRIMARY KEY,
+                model TEXT,
+                iteration INTEGER,
+                prompt TEXT,
+                agreement TEXT,
+                temperature REAL,
+                output_path TEXT,
+                state TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                worker TEXT,
+                created REAL,
+                claimed REAL,
+                heartbeat REAL,
+                finished REAL,
+                duration REAL,
+                UNIQUE (model, iteration, prompt, agreement, temperature, output_path)
+            )""")
+        if 'heartbeat' not in [row['name'] for row in self.__conn.execute("PRAGMA table_info(cells)")]:
+            # Ledgers created before the heartbeats
+            self.__conn.execute("ALTER TABLE cells ADD COLUMN heartbeat REAL")
+            self.__conn.execute("UPDATE cells SET heartbeat = claimed")
+        self.__conn.execute("CREATE INDEX IF NOT EXISTS cells_state ON cells (state)")
+        # Analysis of the smart contract of a cell
+        self.__conn.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                id INTEGER PRIMARY KEY,
+                cell_id INTEGER UNIQUE REFERENCES cells (id),
+                state TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                worker TEXT,
+                created REAL,
+                claimed REAL,
+                heartbeat REAL,
+                finished REAL,
+                duration REAL
+            )""")
+        self.__conn.execute("CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, host TEXT, roles TEXT, started REAL, heartbeat REAL, state TEXT)")
+        # Sweep settings shared with the workers (prompts, analysis tool...)
+        self.__conn.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)")
+
+    @classmethod
+    def for_output(cls, output_root: str):
+        """
+        Get the ledger of a sweep output (`output_root` relative to the shared folder)
+        """
+        output_dir = shared_path(output_root)
+        os.makedirs(output_dir, exist_ok=True)
+        return cls(os.path.join(output_dir, cls.FILE_NAME))
+
+    @staticmethod
+    def worker_id():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @staticmethod
+    def to_row(cell: SweepCell):
+        # Agreements are recorded relative to the shared folder, so that every node finds them
+        return cell._replace(legal_agreement_file_path=to_shared(cell.legal_agreement_file_path))
+
+    @staticmethod
+    def to_cell(row: sqlite3.Row):
+        cell = SweepCell(**{field: row[col] for field, col in COLUMNS.items()})
+        return cell._replace(legal_agreement_file_path=from_shared(cell.legal_agreement_file_path))
+
+    def add_cells(self, cells: list):
+        """
+        Record the cells of a sweep, cells already in the ledger keep their state
+        :return: number of new cells
+        """
+        now = time.time()
+        with self.__lock:
+            before = self.__conn.total_changes
+            self.__conn.execute("BEGIN IMMEDIATE")
+            self.__conn.executemany(f"INSERT OR IGNORE INTO cells ({', '.join(COLUMNS.values())}, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    [(*self.to_row(cell), now) for cell in cells])
+            self.__conn.execute("COMMIT")
+            return self.__conn.total_changes - before
+
+    def reset(self, cells: list):
+        """
+        Set the given cells, and their analysis, back to pending (i.e., to generate them again with `overwrite`)
+        """
+        where = ' AND '.join(f'{col} = ?' for col in COLUMNS.values())
+        rows = [self.to_row(cell) for cell in cells]
+        with self.__lock:
+            self.__conn.execute("BEGIN IMMEDIATE")
+            self.__conn.executemany(f"UPDATE cells SET state = ?, error = NULL WHERE {where}", [(PENDING, *row) for row in rows])
+            self.__conn.executemany(f"UPDATE analyses SET state = ?, error = NULL WHERE cell_id IN (SELECT id FROM cells WHERE {where})",
+                                    [(PENDING, *row) for row in rows])
+            self.__conn.execute("COMMIT")
+
+    def claim(self, worker: str, group: int = 1, lease: float = None, **filters):
+        """
+        Atomically claim the next pending cell
+        :param worker: worker id (see `worker_id`)
+        :param group: also claim up to `group` cells of the same (model, prompt, agreement, temperature), i.e. the iterations
+            generated by a single request
+        :param lease: seconds without heartbeat after which a running cell is considered abandoned (crashed worker)
+            and claimed again, SWEEP_LEASE by default
+        :param filters: column -> accepted values (i.e., model=['gpt-4o'], prompt=['PR1'])
+        :return: list of (cell id, `SweepCell`), empty when there is nothing left to claim
+        """
+        now = time.time()
+        lease = settings.SWEEP_LEASE if lease is None else lease
+        where = ["(state = ? OR (state = ? AND heartbeat < ?))"]
+        params = [PENDING, RUNNING, now - lease]
+        for col, values in filters.items():
+            values = [to_shared(value) for value in values] if col == 'agreement' else list(values)
+            where.append(f"{col} IN ({', '.join('?' * len(values))})")
+            params += values
+        with self.__lock:
+            self.__conn.execute("BEGIN IMMEDIATE")
+            try:
+                first = self.__conn.execute(f"SELECT * FROM cells WHERE {' AND '.join(where)} ORDER BY id LIMIT 1", params).fetchone()
+                if first is None:
+                    self.__conn.execute("COMMIT")
+                    return []
+                rows = [first]
+                if group > 1:
+                    rows = self.__conn.execute(
+                        f"SELECT * FROM cells WHERE {' AND '.join(where)} AND model = ? AND prompt = ? AND agreement = ? AND temperature = ? "
+                        f"ORDER BY iteration LIMIT ?",
+                        params + [first['model'], first['prompt'], first['agreement'], first['temperature'], group]).fetchall()
+                self.__start('cells', [row['id'] for row in rows], worker, now)
+                self.__conn.execute("COMMIT")
+            except Exception:
+                self.__conn.execute("ROLLBACK")
+                raise
+        return [(row['id'], self.to_cell(row)) for row in rows]
+
+    def __start(self, table: str, ids: list, worker: str, now: float):
+        self.__conn.execute(f"UPDATE {table} SET state = ?, worker = ?, claimed = ?, heartbeat = ?, attempts = attempts + 1 WHERE id IN ({', '.join('?' * len(ids))})",
+                            [RUNNING, worker, now, now, *ids])
+
+    def __finish(self, table: str, ids: list, state: str, error=None):
+        now = time.time()
+        if isinstance(error, BaseException):
+            error = f"{type(error).__name__}: {error}"
+        with self.__lock:
+            self.__conn.executemany(f"UPDATE {table} SET state = ?, error = ?, finished = ?, duration = ? - claimed WHERE id = ?",
+                                    [(state, error, now, now, row_id) for row_id in ids])
+
+    def complete(self, ids: list):
+        """
+        Mark the given cells as done
+        """
+        self.__finish('cells', ids, DONE)
+
+    def fail(self, ids: list, error):
+        """
+        Mark the given cells as failed
+        :param error: exception or message
+        """
+        self.__finish('cells', ids, FAILED, error)
+
+    def add_analyses(self):
+        """
+        Queue the analysis of every cell (claimable once the cell is done)
+        :return: number of new analysis jobs
+        """
+        with self.__lock:
+            before = self.__conn.total_changes
+            self.__conn.execute("INSERT OR IGNORE INTO analyses (cell_id, created) SELECT id, ? FROM cells", (time.time(),))
+            return self.__conn.total_changes - before
+
+    def claim_analyses(self, worker: str, n: int = 1, lease: float = None):
+        """
+        Atomically claim the analysis of up to n generated cells
+        :param worker: worker id (see `worker_id`)
+        :param lease: seconds without heartbeat after which a running analysis is claimed again, SWEEP_LEASE by default
+        :return: list of (analysis id, `SweepCell`), empty when there is nothing left to claim
+        """
+        now = time.time()
+        lease = settings.SWEEP_LEASE if lease is None else lease
+        with self.__lock:
+            self.__conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.__conn.execute(
+                    "SELECT analyses.id AS analysis_id, cells.* FROM analyses JOIN cells ON cells.id = analyses.cell_id "
+                    "WHERE cells.state = ? AND (analyses.state = ? OR (analyses.state = ? AND analyses.heartbeat < ?)) ORDER BY analyses.id LIMIT ?",
+                    (DONE, PENDING, RUNNING, now - lease, n)).fetchall()
+                if rows:
+                    self.__start('analyses', [row['analysis_id'] for row in rows], worker, now)
+                self.__conn.execute("COMMIT")
+            except Exception:
+                self.__conn.execute("ROLLBACK")
+                raise
+        return [(row['analysis_id'], self.to_cell(row)) for row in rows]
+
+    def complete_analyses(self, ids: list):
+        """
+        Mark the given analysis jobs as done
+        """
+        self.__finish('analyses', ids, DONE)
+
+    def fail_analyses(self, ids: list, error):
+        """
+        Mark the given analysis jobs as failed
+        :param error: exception or message
+        """
+        self.__finish('analyses', ids, FAILED, error)
+
+    def requeue(self, max_attempts: int = None, running: bool = False, lease: float = None):
+        """
+        Set the failed cells and analysis jobs back to pending
+        :param max_attempts: cells failed this many times stay failed, SWEEP_MAX_ATTEMPTS by default
+        :param running: also requeue the running ones left by a crashed worker, i.e. without heartbeat for `lease`
+            (the ones of live workers are left alone)
+        :param lease: seconds without heartbeat after which a running cell is abandoned, SWEEP_LEASE by default
+        :return: number of requeued cells and analysis jobs
+        """
+        max_attempts = settings.SWEEP_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        stale = time.time() - (settings.SWEEP_LEASE if lease is None else lease)
+        with self.__lock:
+            before = self.__conn.total_changes
+            for table in ['cells', 'analyses']:
+                self.__conn.execute(f"UPDATE {table} SET state = ? WHERE (state = ? AND attempts < ?) OR (state = ? AND ? AND heartbeat < ?)",
+                                    (PENDING, FAILED, max_attempts, RUNNING, running, stale))
+            return self.__conn.total_changes - before
+
+    def active(self):
+        """
+        :return: True while cells or analysis jobs (of cells not failed) are pending or running
+        """
+        with self.__lock:
+            row = self.__conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM cells WHERE state IN (?, ?)) "
+                "OR EXISTS (SELECT 1 FROM analyses JOIN cells ON cells.id = analyses.cell_id WHERE analyses.state IN (?, ?) AND cells.state != ?)",
+                (PENDING, RUNNING, PENDING, RUNNING, FAILED)).fetchone()
+        return bool(row[0])
+
+    def register(self, worker: str, roles: list):
+        """
+        Record a worker of a distributed sweep
+        """
+        now = time.time()
+        with self.__lock:
+            self.__conn.execute("INSERT OR REPLACE INTO workers (id, host, roles, started, heartbeat, state) VALUES (?, ?, ?, ?, ?, ?)",
+                                (worker, socket.gethostname(), ','.join(roles), now, now, RUNNING))
+
+    def heartbeat(self, worker: str, state: str = None):
+        """
+        Report that a worker is alive: its running cells and analysis jobs are not claimed by other workers
+        :param state: new worker state (i.e., 'stopped' when it exits)
+        """
+        now = time.time()
+        with self.__lock:
+            for table in ['cells', 'analyses']:
+                self.__conn.execute(f"UPDATE {table} SET heartbeat = ? WHERE state = ? AND worker = ?", (now, RUNNING, worker))
+            self.__conn.execute("UPDATE workers SET heartbeat = ?, state = COALESCE(?, state) WHERE id = ?", (now, state, worker))
+
+    def workers(self):
+        """
+        :return: list of the workers (dict with id, host, roles, started, heartbeat, state and alive)
+        """
+        now = time.time()
+        with self.__lock:
+            rows = self.__conn.execute("SELECT * FROM workers ORDER BY started").fetchall()
+        return [{**row, 'alive': row['state'] != 'stopped' and row['heartbeat'] >= now - settings.SWEEP_LEASE} for row in map(dict, rows)]
+
+    def set_config(self, **values):
+        """
+        Save sweep settings for the workers (JSON values)
+        """
+        with self.__lock:
+            self.__conn.executemany("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", [(key, json.dumps(val)) for key, val in values.items()])
+
+    def get_config(self):
+        """
+        :return: dict of the sweep settings saved by `set_config`
+        """
+        with self.__lock:
+            return {key: json.loads(value) for key, value in self.__conn.execute("SELECT key, value FROM config")}
+
+    def summary(self, analyses: bool = False):
+        """
+        :param analyses: count the analysis jobs instead of the cells
+        :return: dict model -> state -> number of cells
+        """
+        with self.__lock:
+            if analyses:
+                rows = self.__conn.execute("SELECT cells.model, analyses.state, COUNT(*) FROM analyses JOIN cells ON cells.id = analyses.cell_id "
+                                           "GROUP BY cells.model, analyses.state").fetchall()
+            else:
+                rows = self.__conn.execute("SELECT model, state, COUNT(*) FROM cells GROUP BY model, state").fetchall()
+        summary = {}
+        for model, state, count in rows:
+            summary.setdefault(model, dict.fromkeys(STATES, 0))[state] = count
+        return summary
+
+    def failures(self):
+        """
+        :return: list of the failed cells (dict with the cell columns, attempts and error)
+        """
+        with self.__lock:
+            rows = self.__conn.execute("SELECT * FROM cells WHERE state = ? ORDER BY id", (FAILED,)).fetchall()
+        return [{**row, 'agreement': from_shared(row['agreement'])} for row in map(dict, rows)]
+
+
+if __name__ == '__main__':
+    # python -m pipeline.ledger status|failures|requeue|resume <output root> [--max-attempts N] [--prompts PROMPTS]
+    parser = argparse.ArgumentParser(description="Sweep ledger")
+    parser.add_argument('command', choices=['status', 'failures', 'requeue', 'resume'])
+    parser.add_argument('output_root', help="sweep output root, relative to the shared folder (SHARED_ROOT)")
+    parser.add_argument('--max-attempts', type=int, default=None, help="cells failed this many times are not requeued")
+    parser.add_argument('--lease', type=float, default=None, help="requeue the running cells without heartbeat for this many seconds (SWEEP_LEASE)")
+    parser.add_argument('--prompts', default='PROMPTS', help="prompts dict of `pipeline.prompts` the sweep ran with")
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--n-samples', type=int, default=1)
+    args = parser.parse_args()
+
+    ledger = SweepLedger.for_output(args.output_root)
+    if args.command == 'status':
+        for model, states in ledger.summary().items():
+            print(f"{model}: " + ', '.join(f"{state} {count}" for state, count in states.items()))
+    elif args.command == 'failures':
+        for cell in ledger.failures():
+            print(f"{cell['model']} iter={cell['iteration']} {cell['prompt']} '{os.path.basename(cell['agreement'])}' t={cell['temperature']} "
+                  f"({cell['attempts']} attempts): {cell['error']}")
+    elif args.command == 'requeue':
+        print(f"{ledger.requeue(args.max_attempts, running=True, lease=args.lease)} cells requeued")
+    else:
+        from . import prompts
+        from .pipeline import Pipeline
+        results = Pipeline.resume(args.output_root, getattr(prompts, args.prompts), args.max_attempts, stream=args.stream, n_samples=args.n_samples)
+        print(f"{sum(result is not None for result in results.values())}/{len(results)} cells generated")
+        sys.exit(0 if all(result is not None for result in results.values()) else 1)
@@ -1,11 +1,22 @@
 import os
-from openai import OpenAI
+import asyncio
 from pprint import pformat
-import tiktoken
 import logging
 import re
+import time
 from .core.config import settings
-import google.generativeai as genai 
+from .core.clients import get_client
+from .core.paths import ensure_dir, shared_path
+from .core.scheduler import Scheduler
+from .core.tokens import count_tokens, get_prompt_budget
+from .core.cache import ResponseCache
+from .core.usage import UsageLog
+from .core import tracing
+from .core.tracing import traced
+from .prompts import SplitPrompt
+from .sweep import iter_cells
+from .chunking import get_map_prompts, reduce_notes, MAX_ROUNDS
+from .streaming import SolidityStreamExtractor, CODE_ONLY_PATTERN
 
 # Logging
 
@@ -13,45 +24,104 @@ logging.basicConfig(
     level=logging.DEBUG,
     format="%(asctime)s [%(levelname)s] %(message)s")
 
-# This import must be here to avoid basiConfig of logging to be set to ERROR only
-# See. https://github.com/mistralai/client-python/blob/f9b006a94cb9a8624e8509dba4a7082a5f001239/src/mistralai/client_base.py#L17
-from mistralai import Mistral
-from anthropic import Anthropic
+def _span_attrs(self, *args, **kwargs):
+    # Attributes of the spans of the Pipeline methods (see `core.tracing`)
+    return {'provider': self.provider, 'model': self.model}
+
 
 class Pipeline:
     CURR_DIR = os.path.dirname(os.path.realpath(__file__))
     PARENT_DIR = os.path.dirname(CURR_DIR)
+    PROVIDERS = ['openai', 'mistral', 'google', 'anthropic']
+    ANTHROPIC_PROMPT_CACHING_BETA = 'prompt-caching-2024-07-31'
+    # Providers returning several completions per request (`n`), the others get concurrent requests
+    N_SAMPLES_PROVIDERS = ['openai']
 
     def __init__(self, model: str = "gpt-4-turbo", output_path: str = 'output'):
         self.output_path = output_path
         self.model = model
-        self.output_dir = os.path.join(os.path.join(os.path.expanduser('~'), 'slither_shared'), output_path)
+        self.output_dir = shared_path(output_path)
         self.output_dir_raw = os.path.join(self.output_dir, "raw")
         self.output_dir_sc = os.path.join(self.output_dir, "sc")
         self.output_dir_vul = os.path.join(self.output_dir, "vul")
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
-        if not os.path.exists(self.output_dir_raw):
-            os.makedirs(self.output_dir_raw)
-        if not os.path.exists(self.output_dir_sc):
-            os.makedirs(self.output_dir_sc)
-        if not os.path.exists(self.output_dir_vul):
-            os.makedirs(self.output_dir_vul)
+        # Folder creation is cached, so it happens once per path and process
+        for folder in [self.output_dir, self.output_dir_raw, self.output_dir_sc, self.output_dir_vul]:
+            ensure_dir(folder)
         self.model = model
-        if model in settings.OPENAI_MODELS:
-            self.client = OpenAI(api_key = settings.OPENAI_API_KEY)
-        elif model in settings.MISTRAL_MODELS:
-            logging.info(f"Mistral api key: {settings.MISTRAL_API_KEY}")
-            self.client = Mistral(api_key=settings.MISTRAL_API_KEY)
-        elif model in settings.GOOGLE_MODELS:
-            genai.configure(api_key=settings.GOOGLE_API_KEY)
-            self.client = genai.GenerativeModel(model_name=model)
-        elif model in settings.ANTHROPIC_MODELS:
-            self.client = Anthropic(api_key=settings.ANTHROPIC_API_KEY)
-        else:
-            ## USe OpenAI by default
-            self.client = OpenAI(api_key = settings.OPENAI_API_KEY)
-    
+        self.provider = self.get_provider(model)
+        # Requests-per-minute and tokens-per-minute budgets are shared by every instance of the same model
+        self.scheduler = Scheduler.for_model(model)
+
+    @staticmethod
+    def get_provider(model: str):
+        """
+        Get the provider serving the given model
+        :param model: model name
+        :return: one of `Pipeline.PROVIDERS`
+        """
+        if model in (settings.OPENAI_MODELS or []):
+            return 'openai'
+        elif model in (settings.MISTRAL_MODELS or []):
+            return 'mistral'
+        elif model in (settings.GOOGLE_MODELS or []):
+            return 'google'
+        elif model in (settings.ANTHROPIC_MODELS or []):
+            return 'anthropic'
+        ## USe OpenAI by default
+        return 'openai'
+
+    @staticmethod
+    def get_max_concurrency(provider: str):
+        """
+        Maximum number of in-flight requests for the given provider in async mode
+        :param provider: one of `Pipeline.PROVIDERS`
+        :return: concurrency limit
+        """
+        return getattr(settings, f"{provider.upper()}_MAX_CONCURRENCY")
+
+    @property
+    def api_key(self):
+        api_key = getattr(settings, f"{self.provider.upper()}_API_KEY")
+        if api_key is None:
+            raise ValueError(f"{self.provider.upper()}_API_KEY is required for model '{self.model}'")
+        return api_key
+
+    @property
+    def client(self):
+        # SDK clients are shared by every Pipeline instance (see `core.clients`), and created on first use:
+        # runs served from the response cache never import the provider SDK
+        return get_client(self.provider, self.api_key, self.model)
+
+    @property
+    def aclient(self):
+        # Async clients are created on first use, sync-only runs never build them
+        return get_client(self.provider, self.api_key, self.model, asynchronous=True)
+
+    def get_anthropic_request(self, prompt: str):
+        """
+        Anthropic messages, the shared prefix of a `SplitPrompt` (see `pipeline.prompts.PREFIX_PROMPTS`) is marked for prompt caching.
+        OpenAI caches prompt prefixes automatically, other providers get the prompt as is.
+        :return: `messages.create` kwargs
+        """
+        if isinstance(prompt, SplitPrompt):
+            content = [
+                {'type': 'text', 'text': prompt.prefix, 'cache_control': {'type': 'ephemeral'}},
+                {'type': 'text', 'text': prompt.suffix}
+            ]
+            return {'messages': [{'role': 'user', 'content': content}], 'extra_headers': {'anthropic-beta': self.ANTHROPIC_PROMPT_CACHING_BETA}}
+        return {'messages': [{'role': 'user', 'content': prompt}]}
+
+    def record_usage(self, usage=None, **extra):
+        """
+        Record the token usage of a request, prompt cache hits included (see `core.usage.UsageLog`)
+        """
+        log = UsageLog.default()
+        if log is not None:
+            log.record(self.provider, self.model, usage, **extra)
+        # Token usage of the provider call span in progress
+        tracing.record_usage(self.provider, usage)
+
+    @traced(attrs=_span_attrs)
     def __call_openai(self, model:str = 'gpt-4-turbo', prompt:str=None, temperature: float = 0.1):
         """
         Call OpenAI API
@@ -70,9 +140,11 @@ class Pipeline:
                     }
                 ]
             )
+        self.record_usage(completions.usage)
         new_code = completions.choices[0].message.content
         return new_code
     
+    @traced(attrs=_span_attrs)
     def __call_mistralai(self, model:str = 'mistral-medium', prompt:str=None, temperature: float = 0.1):
         """
         Call MistralAI API
@@ -93,9 +165,11 @@ class Pipeline:
             messages=messages,
             max_tokens=10_000
         )
+        self.record_usage(response.usage)
         new_code = response.choices[0].message.content
         return new_code
     
+    @traced(attrs=_span_attrs)
     def __call_googleai(self, model:str = 'palm', prompt:str=None, temperature: float = 0.1):
         """
         Call GoogleAI API
@@ -105,38 +179,442 @@ class Pipeline:
         :return: response
         """
         response = self.client.generate_content(prompt)
+        self.record_usage(getattr(response, 'usage_metadata', None))
         return response.text
     
+    @traced(attrs=_span_attrs)
     def __call_anthropic(self, model: str, prompt: str, temperature: float = 0.0):
         response = self.client.messages.create(
             model=model,
             temperature=temperature,
             max_tokens=6_000,
+            **self.get_anthropic_request(prompt)
+        )
+        self.record_usage(response.usage)
+        return response.content[0].text
+
+    @traced(attrs=_span_attrs)
+    async def __acall_openai(self, model: str, prompt: str, temperature: float = 0.1):
+        completions = await self.aclient.chat.completions.create(
+                model=model,
+                temperature=temperature,
+                messages = [
+                    {
+                        'role': 'user',
+                        'content': prompt
+                    }
+                ]
+            )
+        self.record_usage(completions.usage)
+        return completions.choices[0].message.content
+
+    @traced(attrs=_span_attrs)
+    async def __acall_openai_n(self, model: str, prompt: str, temperature: float, n: int):
+        """
+        :return: list of n completions of the same prompt
+        """
+        completions = await self.aclient.chat.completions.create(
+                model=model,
+                temperature=temperature,
+                n=n,
+                messages = [
+                    {
+                        'role': 'user',
+                        'content': prompt
+                    }
+                ]
+            )
+        self.record_usage(completions.usage, n=n)
+        return [choice.message.content for choice in sorted(completions.choices, key=lambda choice: choice.index)]
+
+    @traced(attrs=_span_attrs)
+    async def __acall_mistralai(self, model: str, prompt: str, temperature: float = 0.1):
+        response = await self.aclient.chat.complete_async(
+            model=model,
+            temperature=temperature,
             messages=[
                 {
-                    "role": "user",
-                    "content": prompt
+                    'role': 'user',
+                    'content': prompt
                 }
-            ]
+            ],
+            max_tokens=10_000
+        )
+        self.record_usage(response.usage)
+        return response.choices[0].message.content
+
+    @traced(attrs=_span_attrs)
+    async def __acall_googleai(self, model: str, prompt: str, temperature: float = 0.1):
+        response = await self.aclient.generate_content_async(prompt)
+        self.record_usage(getattr(response, 'usage_metadata', None))
+        return response.text
+
+    @traced(attrs=_span_attrs)
+    async def __acall_anthropic(self, model: str, prompt: str, temperature: float = 0.0):
+        response = await self.aclient.messages.create(
+            model=model,
+            temperature=temperature,
+            max_tokens=6_000,
+            **self.get_anthropic_request(prompt)
         )
+        self.record_usage(response.usage)
         return response.content[0].text
-    
-    def get_smart_contract_from_ai(self, prompt, legal_agreement_file_path: str, temperature: float = 0.1, overwrite: bool = False):
+
+    def __stream_openai(self, prompt_str: str, temperature: float, usage: dict):
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            temperature=temperature,
+            messages=[{'role': 'user', 'content': prompt_str}],
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    usage['usage'] = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Closing the response stops the generation (and the billing) server side
+            stream.close()
+
+    def __stream_mistralai(self, prompt_str: str, temperature: float, usage: dict):
+        with self.client.chat.stream(
+            model=self.model,
+            temperature=temperature,
+            messages=[{'role': 'user', 'content': prompt_str}],
+            max_tokens=10_000
+        ) as stream:
+            for event in stream:
+                if event.data.usage:
+                    usage['usage'] = event.data.usage
+                delta = event.data.choices[0].delta.content
+                if delta:
+                    yield delta
+
+    def __stream_googleai(self, prompt_str: str, temperature: float, usage: dict):
+        for chunk in self.client.generate_content(prompt_str, stream=True):
+            usage['usage'] = getattr(chunk, 'usage_metadata', None)
+            yield chunk.text
+
+    def __stream_anthropic(self, prompt_str: str, temperature: float, usage: dict):
+        with self.client.messages.stream(
+            model=self.model,
+            temperature=temperature,
+            max_tokens=6_000,
+            **self.get_anthropic_request(prompt_str)
+        ) as stream:
+            try:
+                yield from stream.text_stream
+            finally:
+                # Input and cache usage come with the first event, even if the generation is stopped early
+                usage['usage'] = stream.current_message_snapshot.usage
+
+    async def __astream_openai(self, prompt_str: str, temperature: float, usage: dict):
+        stream = await self.aclient.chat.completions.create(
+            model=self.model,
+            temperature=temperature,
+            messages=[{'role': 'user', 'content': prompt_str}],
+            stream=True
+        )
+        try:
+            async for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    usage['usage'] = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+
+    async def __astream_mistralai(self, prompt_str: str, temperature: float, usage: dict):
+        stream = await self.aclient.chat.stream_async(
+            model=self.model,
+            temperature=temperature,
+            messages=[{'role': 'user', 'content': prompt_str}],
+            max_tokens=10_000
+        )
+        async with stream:
+            async for event in stream:
+                if event.data.usage:
+                    usage['usage'] = event.data.usage
+                delta = event.data.choices[0].delta.content
+                if delta:
+                    yield delta
+
+    async def __astream_googleai(self, prompt_str: str, temperature: float, usage: dict):
+        response = await self.aclient.generate_content_async(prompt_str, stream=True)
+        async for chunk in response:
+            usage['usage'] = getattr(chunk, 'usage_metadata', None)
+            yield chunk.text
+
+    async def __astream_anthropic(self, prompt_str: str, temperature: float, usage: dict):
+        async with self.aclient.messages.stream(
+            model=self.model,
+            temperature=temperature,
+            max_tokens=6_000,
+            **self.get_anthropic_request(prompt_str)
+        ) as stream:
+            try:
+                async for text in stream.text_stream:
+                    yield text
+            finally:
+                usage['usage'] = stream.current_message_snapshot.usage
+
+    @traced(attrs=_span_attrs)
+    def __consume_stream(self, deltas, ai_response_raw_path: str, usage: dict):
+        """
+        Write the streamed response to the raw file as it arrives and stop the
+        generation as soon as the Solidity code block is closed
+        :param usage: filled with the usage of the request by the stream
+        :return: response text
+        """
+        extractor = SolidityStreamExtractor()
+        start = time.monotonic()
+        ttft = None
+        try:
+            with open(ai_response_raw_path, "w") as ff:
+                for delta in deltas:
+                    ttft = ttft if ttft is not None else time.monotonic() - start
+                    ff.write(delta)
+                    ff.flush()
+                    if extractor.feed(delta):
+                        logging.info(f"Solidity code block closed after {time.monotonic() - start:.1f}s, stopping generation")
+                        break
+        finally:
+            deltas.close()
+            tracing.annotate(ttft=ttft)
+            self.record_usage(usage.get('usage'), ttft=ttft, latency=time.monotonic() - start)
+        return extractor.text
+
+    @traced(attrs=_span_attrs)
+    async def __aconsume_stream(self, deltas, ai_response_raw_path: str, usage: dict):
+        extractor = SolidityStreamExtractor()
+        start = time.monotonic()
+        ttft = None
+        try:
+            with open(ai_response_raw_path, "w") as ff:
+                async for delta in deltas:
+                    ttft = ttft if ttft is not None else time.monotonic() - start
+                    ff.write(delta)
+                    ff.flush()
+                    if extractor.feed(delta):
+                        logging.info(f"Solidity code block closed after {time.monotonic() - start:.1f}s, stopping generation")
+                        break
+        finally:
+            await deltas.aclose()
+            tracing.annotate(ttft=ttft)
+            self.record_usage(usage.get('usage'), ttft=ttft, latency=time.monotonic() - start)
+        return extractor.text
+
+    def __get_stream_call(self, prompt_str: str, temperature: float, ai_response_raw_path: str):
+        stream = {
+            'openai': self.__stream_openai,
+            'mistral': self.__stream_mistralai,
+            'google': self.__stream_googleai,
+            'anthropic': self.__stream_anthropic,
+        }[self.provider]
+        usage = {}
+        return lambda: self.__consume_stream(stream(prompt_str, temperature, usage), ai_response_raw_path, usage)
+
+    def __get_stream_acall(self, prompt_str: str, temperature: float, ai_response_raw_path: str):
+        stream = {
+            'openai': self.__astream_openai,
+            'mistral': self.__astream_mistralai,
+            'google': self.__astream_googleai,
+            'anthropic': self.__astream_anthropic,
+        }[self.provider]
+        usage = {}
+        return lambda: self.__aconsume_stream(stream(prompt_str, temperature, usage), ai_response_raw_path, usage)
+
+    def __get_call(self, prompt_str: str, temperature: float):
+        if self.provider == 'mistral':
+            logging.debug("Running MISTRAL MODELS")
+            return lambda: self.__call_mistralai(model=self.model, prompt=prompt_str, temperature=temperature)
+        elif self.provider == 'google':
+            return lambda: self.__call_googleai(model=self.model, prompt=prompt_str, temperature=temperature)
+        elif self.provider == 'anthropic':
+            return lambda: self.__call_anthropic(model=self.model, prompt=prompt_str, temperature=temperature)
+        return lambda: self.__call_openai(model=self.model, prompt=prompt_str, temperature=temperature)
+
+    def __get_acall(self, prompt_str: str, temperature: float):
+        if self.provider == 'mistral':
+            return lambda: self.__acall_mistralai(model=self.model, prompt=prompt_str, temperature=temperature)
+        elif self.provider == 'google':
+            return lambda: self.__acall_googleai(model=self.model, prompt=prompt_str, temperature=temperature)
+        elif self.provider == 'anthropic':
+            return lambda: self.__acall_anthropic(model=self.model, prompt=prompt_str, temperature=temperature)
+        return lambda: self.__acall_openai(model=self.model, prompt=prompt_str, temperature=temperature)
+
+    def get_cached_response(self, prompt_str: str, temperature: float, sample: int = 0, require_code: bool = True):
+        """
+        Look up the response cache
+        :param require_code: a cached response without Solidity code is a miss (generation responses, not the chunk notes)
+        :return: (cache key, cached response or None)
+        """
+        cache = ResponseCache.default()
+        if cache is None:
+            return None, None
+        key = ResponseCache.key(self.provider, self.model, prompt_str, temperature=temperature, sample=sample)
+        new_code = cache.get(key)
+        if require_code and new_code is not None and not re.search(CODE_ONLY_PATTERN, new_code, re.DOTALL):
+            new_code = None  # cached before unparseable responses were skipped
+        tracing.count(cache_hits=int(new_code is not None), cache_misses=int(new_code is None))
+        if new_code is not None:
+            logging.info(f"Response cache hit for '{self.model}' t={temperature} sample={sample}")
+        return key, new_code
+
+    def cache_response(self, key: str, new_code: str, require_code: bool = True):
+        cache = ResponseCache.default()
+        if cache is None or key is None or new_code is None:
+            return
+        # A generation response without Solidity code fails in `save_response`: not cached, so its retry calls the provider again
+        if require_code and not re.search(CODE_ONLY_PATTERN, new_code, re.DOTALL):
+            logging.warning(f"Response of '{self.model}' has no Solidity code, not cached")
+            return
+        cache.put(key, new_code, self.provider, self.model)
+
+    def __generate(self, prompt_str: str, temperature: float, sample: int = 0, resample: bool = False, stream_to: str = None, require_code: bool = True):
+        key, new_code = self.get_cached_response(prompt_str, temperature, sample, require_code) if not resample else (None, None)
+        if new_code is not None:
+            return new_code
+        call = self.__get_stream_call(prompt_str, temperature, stream_to) if stream_to else self.__get_call(prompt_str, temperature)
+        new_code = self.scheduler.call(call, count_tokens(self.model, prompt_str))
+        self.cache_response(key or ResponseCache.key(self.provider, self.model, prompt_str, temperature=temperature, sample=sample), new_code, require_code)
+        return new_code
+
+    async def __agenerate(self, prompt_str: str, temperature: float, sample: int = 0, resample: bool = False, stream_to: str = None, require_code: bool = True):
+        key, new_code = self.get_cached_response(prompt_str, temperature, sample, require_code) if not resample else (None, None)
+        if new_code is not None:
+            return new_code
+        call = self.__get_stream_acall(prompt_str, temperature, stream_to) if stream_to else self.__get_acall(prompt_str, temperature)
+        new_code = await self.scheduler.acall(call, count_tokens(self.model, prompt_str))
+        self.cache_response(key or ResponseCache.key(self.provider, self.model, prompt_str, temperature=temperature, sample=sample), new_code, require_code)
+        return new_code
+
+    async def __agenerate_samples(self, prompt_str: str, temperature: float, samples: list, resample: bool = False):
+        """
+        Generate several samples of the same prompt, in a single request when the provider supports it
+        :param samples: sample indexes (part of the response cache key)
+        :return: list of responses
+        """
+        cached = [self.get_cached_response(prompt_str, temperature, sample) if not resample else (None, None) for sample in samples]
+        responses = [new_code for _, new_code in cached]
+        missing = [i for i, new_code in enumerate(responses) if new_code is None]
+        if not missing:
+            return responses
+        no_tokens = count_tokens(self.model, prompt_str)
+        if self.provider in self.N_SAMPLES_PROVIDERS:
+            new_codes = await self.scheduler.acall(lambda: self.__acall_openai_n(self.model, prompt_str, temperature, len(missing)), no_tokens)
+        else:
+            new_codes = await asyncio.gather(*[self.scheduler.acall(self.__get_acall(prompt_str, temperature), no_tokens) for _ in missing])
+        for i, new_code in zip(missing, new_codes):
+            responses[i] = new_code
+            self.cache_response(cached[i][0] or ResponseCache.key(self.provider, self.model, prompt_str, temperature=temperature, sample=samples[i]), new_code)
+        return responses
+
+    def check_prompt(self, prompt, legal_agreement: list):
+        """
+        Render the prompt and check it against the prompt budget of the model
+        :param prompt: lambda prompt
+        :param legal_agreement: lines of the legal agreement
+        :return: (prompt, number of tokens, whether it fits)
+        """
+        prompt_str = prompt(legal_agreement)
+        no_tokens = count_tokens(self.model, prompt_str)
+        budget = get_prompt_budget(self.model)
+        logging.info(f"Number of tokens for prompt: {no_tokens} (budget of '{self.model}': {budget})")
+        return prompt_str, no_tokens, no_tokens <= budget
+
+    def get_prompt(self, prompt, legal_agreement: list):
+        """
+        Get the generation prompt. Legal agreements exceeding the prompt budget are condensed first (map-reduce),
+        prompts that cannot fit are never sent
+        :param prompt: lambda prompt
+        :param legal_agreement: lines of the legal agreement
+        :return: prompt
+        """
+        prompt_str, no_tokens, fits = self.check_prompt(prompt, legal_agreement)
+        text = ''.join(legal_agreement)
+        for _ in range(MAX_ROUNDS if settings.CHUNKING_ENABLED else 0):
+            if fits:
+                break
+            map_prompts = get_map_prompts(self.model, text, get_prompt_budget(self.model), settings.CHUNK_TOKENS)
+            logging.info(f"Prompt too long ({no_tokens} tokens), condensing the legal agreement in {len(map_prompts)} chunks")
+            text = reduce_notes([self.__generate(map_prompt, 0.0, require_code=False) for map_prompt in map_prompts])
+            prompt_str, no_tokens, fits = self.check_prompt(prompt, text.splitlines(keepends=True))
+        if not fits:
+            raise ValueError(f"Prompt of {no_tokens} tokens exceeds the budget of '{self.model}' ({get_prompt_budget(self.model)} tokens)")
+        return prompt_str
+
+    async def aget_prompt(self, prompt, legal_agreement: list):
+        """
+        Async version of `get_prompt`, the chunks are condensed concurrently
+        """
+        prompt_str, no_tokens, fits = self.check_prompt(prompt, legal_agreement)
+        text = ''.join(legal_agreement)
+        for _ in range(MAX_ROUNDS if settings.CHUNKING_ENABLED else 0):
+            if fits:
+                break
+            map_prompts = get_map_prompts(self.model, text, get_prompt_budget(self.model), settings.CHUNK_TOKENS)
+            logging.info(f"Prompt too long ({no_tokens} tokens), condensing the legal agreement in {len(map_prompts)} chunks")
+            text = reduce_notes(await asyncio.gather(*[self.__agenerate(map_prompt, 0.0, require_code=False) for map_prompt in map_prompts]))
+            prompt_str, no_tokens, fits = self.check_prompt(prompt, text.splitlines(keepends=True))
+        if not fits:
+            raise ValueError(f"Prompt of {no_tokens} tokens exceeds the budget of '{self.model}' ({get_prompt_budget(self.model)} tokens)")
+        return prompt_str
+
+    def get_output_paths(self, legal_agreement_file_path: str, temperature: float):
+        """
+        Get the raw and sc output paths of a generation
+        :param legal_agreement_file_path: path to legal agreement
+        :param temperature: temperature
+        :return: (legal agreement name, raw response path, smart contract path)
+        """
+        legal_agreement_name = os.path.basename(legal_agreement_file_path).split(".")[0]
+        ai_response_raw_path = os.path.join(self.output_dir_raw, legal_agreement_name + f'_t{temperature}_raw.txt')
+        ai_gen_smart_contract_path = os.path.join(self.output_dir_sc, legal_agreement_name + f'_t{temperature}.sol')
+        return legal_agreement_name, ai_response_raw_path, ai_gen_smart_contract_path
+
+    @staticmethod
+    def save_response(new_code: str, ai_response_raw_path: str, ai_gen_smart_contract_path: str):
+        """
+        Save the raw response and the Solidity code extracted from it
+        :param new_code: raw model response
+        :param ai_response_raw_path: where to save the raw response
+        :param ai_gen_smart_contract_path: where to save the smart contract
+        :return: smart contract
+        """
+        # Save raw content for evaluation in the output_path folder as <legal agreement name>_raw.txt
+        with open(ai_response_raw_path, "w") as ff:
+            ff.write(new_code)
+
+        logging.debug(f"NEW CODE: {new_code}")
+
+        gen_smart_contract = re.search(CODE_ONLY_PATTERN, new_code, re.DOTALL).group(0)
+        # Save the file with the new Solidity code (hopefully) provided by ChatGPT
+        with open(ai_gen_smart_contract_path, "w") as ff:
+            ff.write(gen_smart_contract)
+        return gen_smart_contract
+
+    @traced(attrs=_span_attrs)
+    def get_smart_contract_from_ai(self, prompt, legal_agreement_file_path: str, temperature: float = 0.1, overwrite: bool = False, sample: int = 0, resample: bool = False, stream: bool = False):
         """
         Get smart contract from AI
         :param legal_agreement_file_path: path to legal agreements
+        :param sample: sample index, part of the response cache key (i.e., the sweep iteration)
+        :param resample: bypass the response cache lookup and pay for a new response (use with `overwrite`)
+        :param stream: stream the response and stop the generation once the Solidity code block is closed
         :return: smart contract
         """
         # Get legal agreement
         assert os.path.exists(legal_agreement_file_path), f"Given path for legal agreements'{legal_agreement_file_path}' does not exist"
         # Get legal agreement name
-        legal_agreement_name = os.path.basename(legal_agreement_file_path).split(".")[0]
-        self.ai_response_raw_path = os.path.join(self.output_dir_raw, legal_agreement_name + f'_t{temperature}_raw.txt')
-        self.ai_gen_smart_contract_path = os.path.join(self.output_dir_sc, legal_agreement_name + f'_t{temperature}.sol')
+        legal_agreement_name, self.ai_response_raw_path, self.ai_gen_smart_contract_path = self.get_output_paths(legal_agreement_file_path, temperature)
+        tracing.annotate(legal_agreement=legal_agreement_name, temperature=temperature, sample=sample)
 
         # 'overwrite' param needed in order to not waste time and money generating the same smart contract
         if os.path.exists(self.ai_gen_smart_contract_path) and not overwrite:
             logging.info(f"Smart contract already generated for '{legal_agreement_name}'")
+            tracing.annotate(existing=True)
             with open(self.ai_gen_smart_contract_path, "r", encoding='utf-8') as ff:
                 gen_smart_contract = ff.read()
         else:
@@ -144,42 +622,99 @@ class Pipeline:
                 legal_agreement = f.readlines()
             
             try:
-                prompt_str = prompt(legal_agreement)
-                # Verify if the prompt exceedes the maximum number of tokens
-                if self.model in settings.OPENAI_MODELS:
-                    # enc = tiktoken.get_encoding(self.model)
-                    # no_tokens = len(enc.encode(prompt(legal_agreement)))
-                    # logging.info(f"Number of tokens for prompt: {no_tokens}")
-                    new_code = self.__call_openai(model=self.model, prompt=prompt_str, temperature=temperature)
-                elif self.model in settings.MISTRAL_MODELS:
-                    logging.debug("Running MISTRAL MODELS")
-                    new_code = self.__call_mistralai(model=self.model, prompt=prompt_str, temperature=temperature)
-                elif self.model in settings.GOOGLE_MODELS:
-                    new_code = self.__call_googleai(model=self.model, prompt=prompt_str, temperature=temperature)
-                elif self.model in settings.ANTHROPIC_MODELS:
-                    new_code = self.__call_anthropic(model=self.model, prompt=prompt_str, temperature=temperature)
-                else:
-                    new_code = self.__call_openai(model=self.model, prompt=prompt_str, temperature=temperature)
-
-                # Save raw content for evaluation in the output_path folder as <legal agreement name>_raw.txt
-                with open(self.ai_response_raw_path, "w") as ff:
-                    ff.write(new_code)
-
-                logging.debug(f"NEW CODE: {new_code}")
-                
-                code_only_pattern = r"pragma solidity.*}"
-                gen_smart_contract = re.search(code_only_pattern, new_code, re.DOTALL).group(0)
-                # Save the file with the new Solidity code (hopefully) provided by ChatGPT
-                with open(self.ai_gen_smart_contract_path, "w") as ff:
-                    ff.write(gen_smart_contract)
+                # Verify if the prompt exceedes the maximum number of tokens (condensed if so)
+                prompt_str = self.get_prompt(prompt, legal_agreement)
+                new_code = self.__generate(prompt_str, temperature, sample, resample, self.ai_response_raw_path if stream else None)
+                gen_smart_contract = self.save_response(new_code, self.ai_response_raw_path, self.ai_gen_smart_contract_path)
             except Exception as e:
                 logging.error(f"Error while generating smart contract for '{legal_agreement_name}':\n{e}")
+                tracing.fail(e)
                 gen_smart_contract = None
 
         return gen_smart_contract
-    
+
+    @traced(attrs=_span_attrs)
+    async def aget_smart_contract_from_ai(self, prompt, legal_agreement_file_path: str, temperature: float = 0.1, overwrite: bool = False, sample: int = 0, resample: bool = False, stream: bool = False,
+                                          raise_errors: bool = False):
+        """
+        Async version of `get_smart_contract_from_ai`. Output paths are kept local,
+        so the same instance can serve concurrent requests for different temperatures.
+        :param legal_agreement_file_path: path to legal agreements
+        :param raise_errors: raise the generation errors instead of returning None (i.e., to record them in the sweep ledger)
+        :return: smart contract
+        """
+        assert os.path.exists(legal_agreement_file_path), f"Given path for legal agreements'{legal_agreement_file_path}' does not exist"
+        legal_agreement_name, ai_response_raw_path, ai_gen_smart_contract_path = self.get_output_paths(legal_agreement_file_path, temperature)
+        tracing.annotate(legal_agreement=legal_agreement_name, temperature=temperature, sample=sample)
+
+        if os.path.exists(ai_gen_smart_contract_path) and not overwrite:
+            logging.info(f"Smart contract already generated for '{legal_agreement_name}'")
+            tracing.annotate(existing=True)
+            with open(ai_gen_smart_contract_path, "r", encoding='utf-8') as ff:
+                return ff.read()
+
+        with open(legal_agreement_file_path, 'r') as f:
+            legal_agreement = f.readlines()
+
+        try:
+            prompt_str = await self.aget_prompt(prompt, legal_agreement)
+            new_code = await self.__agenerate(prompt_str, temperature, sample, resample, ai_response_raw_path if stream else None)
+            gen_smart_contract = self.save_response(new_code, ai_response_raw_path, ai_gen_smart_contract_path)
+        except Exception as e:
+            logging.error(f"Error while generating smart contract for '{legal_agreement_name}':\n{e}")
+            tracing.fail(e)
+            if raise_errors:
+                raise
+            gen_smart_contract = None
+        return gen_smart_contract
+
+    @traced(attrs=_span_attrs)
+    async def aget_smart_contract_samples_from_ai(self, prompt, legal_agreement_file_path: str, temperature: float, targets: list, overwrite: bool = False, resample: bool = False,
+                                                  raise_errors: bool = False):
+        """
+        Get several samples of the same smart contract (i.e., the sweep iterations) from as few requests as possible:
+        one request with `n` completions on the providers supporting it, concurrent requests otherwise
+        :param legal_agreement_file_path: path to legal agreements
+        :param targets: list of (sample index, `Pipeline` instance whose output folder receives the sample)
+        :param raise_errors: raise the generation errors instead of returning None for every sample
+        :return: list of smart contracts (None on failure), in the order of `targets`
+        """
+        assert os.path.exists(legal_agreement_file_path), f"Given path for legal agreements'{legal_agreement_file_path}' does not exist"
+        paths = [inst.get_output_paths(legal_agreement_file_path, temperature) for _, inst in targets]
+        tracing.annotate(legal_agreement=paths[0][0], temperature=temperature, samples=[sample for sample, _ in targets])
+        results = [None] * len(targets)
+        pending = []
+        for i, (legal_agreement_name, _, ai_gen_smart_contract_path) in enumerate(paths):
+            if os.path.exists(ai_gen_smart_contract_path) and not overwrite:
+                logging.info(f"Smart contract already generated for '{legal_agreement_name}' (sample {targets[i][0]})")
+                with open(ai_gen_smart_contract_path, "r", encoding='utf-8') as ff:
+                    results[i] = ff.read()
+            else:
+                pending.append(i)
+        if not pending:
+            return results
+
+        with open(legal_agreement_file_path, 'r') as f:
+            legal_agreement = f.readlines()
+        try:
+            prompt_str = await self.aget_prompt(prompt, legal_agreement)
+            responses = await self.__agenerate_samples(prompt_str, temperature, [targets[i][0] for i in pending], resample)
+        except Exception as e:
+            logging.error(f"Error while generating smart contracts for '{paths[0][0]}':\n{e}")
+            tracing.fail(e)
+            if raise_errors:
+                raise
+            return results
+        for i, new_code in zip(pending, responses):
+            try:
+                results[i] = self.save_response(new_code, paths[i][1], paths[i][2])
+            except Exception as e:
+                logging.error(f"Error while saving smart contract for '{paths[i][0]}' (sample {targets[i][0]}):\n{e}")
+        return results
+
     @classmethod
-    def pipe(cls, legal_agreement_path: str, model: str = "gpt-4-turbo", output_path: str = 'output', temperatures = [0.0, 0.2, 0.5, 0.7, 1],lambda_prompt: None = lambda x: f"{x}"):
+    def pipe(cls, legal_agreement_path: str, model: str = "gpt-4-turbo", output_path: str = 'output', temperatures = [0.0, 0.2, 0.5, 0.7, 1],lambda_prompt: None = lambda x: f"{x}", sample: int = 0):
+        # sample: iteration of the run, part of the response cache key (one call per iteration gets distinct responses)
         # Temperatures accoding to https://arxiv.org/pdf/2309.08221.pdf
         assert os.path.exists(legal_agreement_path), f"Given path for legal agreements'{legal_agreement_path}' does not exist"
         assert os.listdir(legal_agreement_path), f"Given path for legal agreements'{legal_agreement_path}' is empty"
@@ -187,10 +722,176 @@ class Pipeline:
         for file in os.listdir(legal_agreement_path):
             abs_file = os.path.join(legal_agreement_path, file)
             logging.info(f"Processing file '{file}'")
+            file_name, _ = os.path.splitext(file)
+            inst = cls(model, os.path.join(output_path, file_name))
             for temperature in temperatures:
-                file_name, _ = os.path.splitext(file)
-
-                inst = cls(model, os.path.join(output_path, file_name))
-                sc_gen = inst.get_smart_contract_from_ai(lambda_prompt, temperature=temperature, legal_agreement_file_path=abs_file)
+                sc_gen = inst.get_smart_contract_from_ai(lambda_prompt, temperature=temperature, legal_agreement_file_path=abs_file, sample=sample)
                 logging.debug(f"Smart contract generated for '{file}':\n{pformat(sc_gen)}")
-        
\ No newline at end of file
+        Scheduler.report()
+        
+
+    @classmethod
+    async def apipe(cls, legal_agreement_path: str, models: list, prompts: dict, n_iter: int = 1, temperatures = [0.5], output_root: str = 'output', overwrite: bool = False, resample: bool = False, stream: bool = False,
+                    n_samples: int = 1):
+        """
+        Run the whole (model, iteration, prompt, agreement, temperature) grid concurrently.
+        In-flight requests are bounded per provider by `<PROVIDER>_MAX_CONCURRENCY` in settings.
+        The cells are recorded in the sweep ledger of `output_root` (see `pipeline.ledger.SweepLedger`, `SWEEP_LEDGER_ENABLED`):
+        a restarted sweep skips the cells already done, the failed ones are retried by `resume`.
+        :param legal_agreement_path: folder containing the legal agreements
+        :param models: list of model names
+        :param prompts: dict prompt name -> lambda prompt (see `pipeline.prompts.PROMPTS`)
+        :param n_iter: number of repeated iterations
+        :param temperatures: temperatures to evaluate
+        :param output_root: output root relative to the shared folder
+        :param overwrite: generate the cells again, done ones included
+        :param resample: bypass the response cache (see `get_smart_contract_from_ai`)
+        :param stream: stream the responses and stop once the code block is closed
+        :param n_samples: iterations generated per request on the providers supporting several completions (`N_SAMPLES_PROVIDERS`),
+            the samples are written to their iteration folders (not with `stream`)
+        :return: dict `SweepCell` -> smart contract (None on failure) of the cells run by this call
+        """
+        from .ledger import SweepLedger
+        cells = list(iter_cells(legal_agreement_path, models, prompts, n_iter, temperatures, output_root))
+        ledger = SweepLedger.for_output(output_root) if settings.SWEEP_LEDGER_ENABLED else SweepLedger()
+        added = ledger.add_cells(cells)
+        if overwrite:
+            ledger.reset(cells)
+        elif added < len(cells):
+            logging.info(f"Sweep ledger: {len(cells) - added}/{len(cells)} cells already recorded, the done ones are skipped")
+        filters = {'model': models, 'prompt': list(prompts.keys()), 'agreement': sorted({cell.legal_agreement_file_path for cell in cells}),
+                   'temperature': list(temperatures), 'iteration': list(range(1, n_iter + 1))}
+        return await cls.__arun_ledger(ledger, prompts, filters, overwrite, resample, stream, n_samples)
+
+    @classmethod
+    async def aresume(cls, output_root: str = 'output', prompts: dict = None, max_attempts: int = None, resample: bool = False, stream: bool = False, n_samples: int = 1):
+        """
+        Resume a sweep from its ledger: requeue the failed cells (and the ones left running by a crashed worker, without
+        heartbeat for SWEEP_LEASE), then run every pending cell. Done cells, and the ones running on live workers, are not generated again.
+        :param output_root: output root of the sweep, relative to the shared folder
+        :param prompts: dict prompt name -> lambda prompt the sweep ran with, `pipeline.prompts.PROMPTS` by default
+            (cells of other prompts stay pending)
+        :param max_attempts: cells failed this many times are not requeued, `SWEEP_MAX_ATTEMPTS` by default
+        :return: dict `SweepCell` -> smart contract (None on failure) of the cells run by this call
+        """
+        from .ledger import SweepLedger
+        logging.info(f"Sweep ledger: {SweepLedger.for_output(output_root).requeue(max_attempts, running=True)} cells requeued")
+        return await cls.awork(output_root, prompts, False, resample, stream, n_samples)
+
+    @classmethod
+    async def awork(cls, output_root: str = 'output', prompts: dict = None, overwrite: bool = False, resample: bool = False, stream: bool = False,
+                    n_samples: int = 1):
+        """
+        Run the pending cells of a sweep ledger until none is left (i.e., on a worker node of a distributed sweep,
+        see `pipeline.distributed`). Failed cells are not retried
+        :param output_root: output root of the sweep, relative to the shared folder
+        :param prompts: dict prompt name -> lambda prompt the sweep ran with, `pipeline.prompts.PROMPTS` by default
+            (cells of other prompts stay pending)
+        :param overwrite: generate the claimed cells again even if their smart contract exists (i.e., cells reset by an overwriting sweep)
+        :param resample: bypass the response cache (see `get_smart_contract_from_ai`)
+        :return: dict `SweepCell` -> smart contract (None on failure) of the cells run by this call
+        """
+        from .ledger import SweepLedger
+        if prompts is None:
+            from .prompts import PROMPTS as prompts
+        ledger = SweepLedger.for_output(output_root)
+        filters = {'model': list(ledger.summary().keys()), 'prompt': list(prompts.keys())}
+        return await cls.__arun_ledger(ledger, prompts, filters, overwrite, resample, stream, n_samples)
+
+    @classmethod
+    async def __arun_ledger(cls, ledger, prompts: dict, filters: dict, overwrite: bool, resample: bool, stream: bool, n_samples: int):
+        """
+        Claim and run the cells of the ledger matching `filters` (column -> values, see `SweepLedger.claim`) until none is left.
+        Each provider runs `<PROVIDER>_MAX_CONCURRENCY` claim loops, so other processes can work on the same ledger.
+        """
+        worker = ledger.worker_id()
+        # One instance per output folder, shared by all the temperatures of that folder
+        instances = {}
+        results = {}
+
+        def get_instance(cell):
+            if (cell.model, cell.output_path) not in instances:
+                instances[(cell.model, cell.output_path)] = cls(cell.model, cell.output_path)
+            return instances[(cell.model, cell.output_path)]
+
+        async def run(claimed: list, samples: bool):
+            ids = [cell_id for cell_id, _ in claimed]
+            group = [cell for _, cell in claimed]
+            insts = [get_instance(cell) for cell in group]
+            cell = group[0]
+            logging.info(f"Processing {cell.prompt_name} '{os.path.basename(cell.legal_agreement_file_path)}' t={cell.temperature} iter={[c.iteration for c in group]} ({cell.model})")
+            try:
+                if samples:
+                    gen = await insts[0].aget_smart_contract_samples_from_ai(prompts[cell.prompt_name], cell.legal_agreement_file_path, cell.temperature,
+                                                                             [(c.iteration, inst) for c, inst in zip(group, insts)], overwrite, resample, raise_errors=True)
+                else:
+                    gen = [await insts[0].aget_smart_contract_from_ai(prompts[cell.prompt_name], cell.legal_agreement_file_path, cell.temperature, overwrite,
+                                                                      cell.iteration, resample, stream, raise_errors=True)]
+            except Exception as e:
+                ledger.fail(ids, e)
+                gen = [None] * len(group)
+            else:
+                ledger.complete([cell_id for cell_id, sc in zip(ids, gen) if sc is not None])
+                ledger.fail([cell_id for cell_id, sc in zip(ids, gen) if sc is None], "Smart contract not saved")
+            results.update(zip(group, gen))
+
+        async def work(provider: str, models: list):
+            # The iterations of a (model, prompt, agreement, temperature) share their requests
+            group = n_samples if n_samples > 1 and not stream and provider in cls.N_SAMPLES_PROVIDERS else 1
+            while claimed := ledger.claim(worker, group, **{**filters, 'model': models}):
+                await run(claimed, group > 1)
+
+        async def heartbeat():
+            # Running cells without heartbeat for SWEEP_LEASE are claimed again by other workers
+            while True:
+                await asyncio.sleep(settings.SWEEP_HEARTBEAT)
+                ledger.heartbeat(worker)
+
+        providers = {}
+        for model in filters['model']:
+            providers.setdefault(cls.get_provider(model), []).append(model)
+        beat = asyncio.create_task(heartbeat())
+        try:
+            await asyncio.gather(*[work(provider, models) for provider, models in providers.items() for _ in range(cls.get_max_concurrency(provider))])
+        finally:
+            beat.cancel()
+        if not results:
+            # Nothing left to claim (i.e., an idle distributed worker)
+            return results
+        failed = sum(sc is None for sc in results.values())
+        if failed:
+            logging.warning(f"Sweep ledger: {failed}/{len(results)} cells failed, requeue them with `python -m pipeline.ledger resume <output root>`")
+        Scheduler.report()
+        tracing.log_summary()
+        return results
+
+    @classmethod
+    def sweep(cls, legal_agreement_path: str, models: list, prompts: dict, n_iter: int = 1, temperatures = [0.5], output_root: str = 'output', overwrite: bool = False, resample: bool = False, stream: bool = False,
+              n_samples: int = 1):
+        """
+        Blocking entry point for `apipe`
+        """
+        return asyncio.run(cls.apipe(legal_agreement_path, models, prompts, n_iter, temperatures, output_root, overwrite, resample, stream, n_samples))
+
+    @classmethod
+    def resume(cls, output_root: str = 'output', prompts: dict = None, max_attempts: int = None, resample: bool = False, stream: bool = False, n_samples: int = 1):
+        """
+        Blocking entry point for `aresume`
+        """
+        return asyncio.run(cls.aresume(output_root, prompts, max_attempts, resample, stream, n_samples))
+
+    @classmethod
+    def work(cls, output_root: str = 'output', prompts: dict = None, overwrite: bool = False, resample: bool = False, stream: bool = False, n_samples: int = 1):
+        """
+        Blocking entry point for `awork`
+        """
+        return asyncio.run(cls.awork(output_root, prompts, overwrite, resample, stream, n_samples))
+
+    @classmethod
+    def batch(cls, legal_agreement_path: str, models: list, prompts: dict, n_iter: int = 1, temperatures = [0.5], output_root: str = 'output', overwrite: bool = False, poll_interval: float = None):
+        """
+        Run the grid through the OpenAI/Anthropic batch APIs (see `pipeline.batch.BatchSweep`).
+        Slower to complete, but cheaper and not bound by the synchronous rate limits.
+        """
+        from .batch import BatchSweep
+        return BatchSweep(legal_agreement_path, models, prompts, n_iter, temperatures, output_root, overwrite).run(poll_interval)
@@ -1,14 +1,21 @@
 import os
-import pandas as pd
 from pprint import pformat
-from nltk.translate.bleu_score import sentence_bleu, corpus_bleu
-from pprint import pformat
-import solcx
 import logging
 import re
 import json
-import docker
-import nltk
+import concurrent.futures
+import functools
+import subprocess
+from typing import NamedTuple
+from .analysis.workers import AnalysisWorkerPool, worker_name, TIMEOUT_EXIT_CODE, KILLED_EXIT_CODE
+from .analysis.deps import DependencyStore
+from .analysis.compilers import SolcManager
+from .analysis.store import ResultsStore, sha256_file
+from .analysis.compile import compile_contracts
+from .analysis import findings
+from .solparser import parse_solidity, get_version
+from .core import tracing
+from .core.paths import shared_path
 
 # Logging
 
@@ -16,6 +23,35 @@ logging.basicConfig(
     level=logging.DEBUG,
     format="%(asctime)s [%(levelname)s] %(message)s")
 
+class ContractItem(NamedTuple):
+    """A generated smart contract found in the pipeline output"""
+    model: str
+    iteration: str
+    prompt: str
+    legal_agreement: str
+    sol_path: str
+
+
+def _subdirs(path: str):
+    # Hidden folders (i.e., '.batch', '.deps') and Parquet datasets are not part of the results tree
+    return sorted((entry for entry in os.scandir(path) if entry.is_dir() and not entry.name.startswith('.') and not entry.name.endswith('.parquet')),
+                  key=lambda entry: entry.name)
+
+
+def _solc_remaps(remaps: list):
+    # Slither option for the remappings of the contract dependencies, left out when there are none
+    return f" --solc-remaps '{' '.join(remaps)}'" if remaps else ''
+
+
+def _compute_sc_metrics(path2sol: str, vul_tool: str, path2sol_ref: str, backend: str):
+    # Runs in a worker process of `SmartCMetrics.pipe`
+    try:
+        return SmartCMetrics.get_sc_metrics(path2sol, vul_tool, path2sol_ref, backend)
+    except Exception as e:
+        logging.error(f"Error while computing the metrics of '{path2sol}':\n{e}")
+        return None
+
+
 class SmartCMetrics:
     """This class is responsible for evaluating the quality of the smart contract evaluating the following metrics:
     1- compilability [OK]
@@ -29,29 +65,82 @@ class SmartCMetrics:
     9- CodeBLEU score (if a reference is available)
     """
 
+    # Bump when the metrics computation changes, so that the results store recomputes them
+    METRICS_VERSION = 2
+
     VUL_TOOLS = {
         "slither": {
             "docker_name": "slither",
             "docker_image": "trailofbits/eth-security-toolbox",
-            "host_path": os.path.join(os.path.expanduser('~'), 'slither_shared' ),
+            # Shared folder mounted by the containers, SHARED_ROOT if None (see `get_vul_tool_config`)
+            "host_path": None,
+            "version_cmd": "slither --version",
             "container_path": "/share",
-            "cmd": lambda sol_file, pragma: [f"solc-select install {pragma}", f"solc-select use {pragma}", f"npm install --prefix {os.path.dirname(sol_file)} @openzeppelin/contracts@4.9.5", f"mv {os.path.dirname(sol_file)}/node_modules/@openzeppelin {os.path.dirname(sol_file)}", f"slither {sol_file} --json -"],
-            "cmd_err" : lambda sol_file, pragma: [f"solc-select use {pragma}", f"slither {sol_file}"] # This is the command to run if the last cmd returns a void json. Most likely, the smart contract does not compile
+            # Imports (i.e., @openzeppelin/contracts) are resolved from the shared `DependencyStore` through remappings
+            # The compiler is installed up front and pinned per job by `SolcManager` (no global `solc-select use`)
+            "deps": True,
+            "solc_select": True,
+            # Wall-clock limit of a job (seconds), memory and CPU caps of a job, max concurrent jobs (None: one per worker)
+            "timeout": 600,
+            "mem_limit": "4g",
+            "cpus": 1.0,
+            "max_concurrency": None,
+            # Commands get the contract path, the solc version, the remappings and the shared folder, as seen by the worker
+            "cmd": lambda sol_file, pragma, remaps, root: [f"slither {sol_file}{_solc_remaps(remaps)} --json -"],
+            "cmd_err" : lambda sol_file, pragma, remaps, root: [f"slither {sol_file}{_solc_remaps(remaps)}"] # This is the command to run if the last cmd returns a void json. Most likely, the smart contract does not compile
         },
-        # Other vulnerability detection tools can be added
+        "mythril": {
+            "docker_name": "mythril",
+            "docker_image": "mythril/myth",
+            # The image entrypoint is `myth`, the container is kept alive with a shell instead
+            "docker_entrypoint": "/bin/sh",
+            "host_path": None,
+            "version_cmd": "myth version",
+            "container_path": "/share",
+            # Symbolic execution is slow: long timeout and few concurrent jobs. Mythril downloads the compiler itself
+            "timeout": 1800,
+            "mem_limit": "8g",
+            "cpus": 1.0,
+            "max_concurrency": 2,
+            "cmd": lambda sol_file, pragma, remaps, root: [f"myth analyze {sol_file} --solv {pragma} --execution-timeout 900 -o json"],
+            "cmd_err": lambda sol_file, pragma, remaps, root: []
+        },
+        "solhint": {
+            "docker_name": "solhint",
+            "docker_image": "protodb/protofire-solhint",
+            "docker_entrypoint": "/bin/sh",
+            "host_path": None,
+            "version_cmd": "solhint --version",
+            "container_path": "/share",
+            # Written to the shared folder before the tool runs
+            "files": {".solhint.json": '{"extends": "solhint:recommended"}'},
+            "timeout": 120,
+            "mem_limit": "1g",
+            "cpus": 1.0,
+            "max_concurrency": None,
+            "cmd": lambda sol_file, pragma, remaps, root: [f"solhint -c {root}/.solhint.json -f json {sol_file}"],
+            "cmd_err": lambda sol_file, pragma, remaps, root: []
+        },
+        # Other vulnerability detection tools can be added (see `analysis.findings` for their report parser)
     }
 
-    def __init__(self, path2sol: str, vul_tool: str = 'slither', path2sol_ref: str = None):
+    def __init__(self, path2sol: str, vul_tool: str | list = 'slither', path2sol_ref: str = None, backend: str = 'docker'):
         assert os.path.exists(path2sol), f"Path to smart contract {path2sol} does not exist"
-        self.vul_tool_name = vul_tool
-        self.vul_tool = self.VUL_TOOLS[self.vul_tool_name]
+        # Analysis workers backend of a report missing at this point (see `run_vulnerability_detection`)
+        self.backend = backend
+        # The first tool decides compilability, the findings of the others are merged
+        self.vul_tools = self.get_vul_tools(vul_tool)
+        self.vul_tool_name = self.vul_tools[0]
+        self.vul_tool = self.get_vul_tool_config(self.vul_tool_name)
         self.__path2sol = path2sol
         with open(self.__path2sol, 'r') as f:
             self.__sol_code_raw = f.read()
 
-        self.__sol_code = self.remove_comments(self.__sol_code_raw)
-        self.__pragma = self.get_pragma(self.__sol_code)
-        solcx.install_solc(self.__pragma)
+        # Comments, pragma, contracts, functions, state variables and imports in a single traversal
+        self.__parsed_sol = parse_solidity(self.__sol_code_raw)
+        self.__sol_code = self.__parsed_sol['code']
+        self.__pragma = self.normalize_pragma(get_version(self.__parsed_sol['pragma']))
+        SolcManager.install_local(self.__pragma)
 
         # Get file name and positin
         # Assuming the following stucture generated by the pipeline.
@@ -66,31 +155,34 @@ class SmartCMetrics:
         #             <legal agreement name>_t<tempersture value>.sol.json
 
         self.__file_name = os.path.basename(path2sol) # <legal agreement name>_t<tempersture value>.sol
-        self.__vul_folder = os.path.dirname(path2sol).replace('sc', 'vul') # abs path to 'vul' folder
-        self.__vul_report_file_path = os.path.join(self.__vul_folder, self.__file_name + '.json') # abs path to vulnerability report file '<legal agreement name>_t<tempersture value>.sol.json'
+        self.__vul_report_file_path = self.get_vul_report_path(path2sol) # abs path to vulnerability report file '<legal agreement name>_t<tempersture value>.sol.json'
         if os.path.exists(self.__vul_report_file_path):
             self.__vul_report = self.get_vulns(self.__vul_report_file_path)
         else:
             self.run_vulnerability_detection(self.__path2sol)
             self.__vul_report = self.get_vulns(self.__vul_report_file_path)
-        self.__contracts = self.get_contract_names(self.__sol_code)
+        if len(self.vul_tools) > 1:
+            # Reports of the other tools are produced by `run_vulnerability_detection_pool`, a missing one adds no findings
+            reports = {self.vul_tool_name: self.__vul_report}
+            for tool in self.vul_tools[1:]:
+                report_path = self.get_vul_report_path(path2sol, tool)
+                reports[tool] = self.get_vulns(report_path, tool) if os.path.exists(report_path) else None
+            self.__vul_report = findings.merge(reports, self.vul_tool_name)
+        self.__contracts = [name for name, contract in self.__parsed_sol['contracts'].items() if 'contract' in contract['kind']]
         self.__no_contracts = len(self.__contracts)
-        self.__external_calls = self.get_external_calls(self.__sol_code)
+        self.__external_calls = self.__parsed_sol['imports']
         self.__no_external_calls = len(self.__external_calls)
         self.__path2sol_ref = path2sol_ref
 
         if self.is_compilable:
-            # self.__abi = solcx.compile_files([self.__path2sol], solc_version=self.__pragma, allow_paths=os.path.dirname(self.__path2sol))
-            # # Parse the generated smart contract
-            # self.__functions_per_contract = {contract: [abi_item['name'] for abi_item in self.__abi[f"{self.__path2sol}:{contract}".replace("\\", "/")]['abi'] if abi_item.get('type', False) == 'function']
-            #                                 for contract in self.__contracts}
-            # self.__no_functions_per_contract = {contract: len(self.__functions_per_contract[contract]) for contract in self.__functions_per_contract.keys()}
-            # self.__no_functions = sum(self.__no_functions_per_contract.values())
+            # Functions come from the parsed source, no compilation needed
             self.__abi = {}
-            self.__functions_per_contract = {}
-            self.__no_functions_per_contract = {}
-            self.__no_functions = 0
+            self.__functions_per_contract = {name: contract['functions'] for name, contract in self.__parsed_sol['contracts'].items()}
+            self.__no_functions_per_contract = {name: len(functions) for name, functions in self.__functions_per_contract.items()}
+            self.__no_functions = sum(self.__no_functions_per_contract.values())
         else:
+            if self.is_compilable is None:
+                logging.warning(f"Analysis of the smart contract did not complete ({self.status}).")
             logging.warning("Smart contract does not compile. Skipping BLEU and CodeBLEU score calculation.")
             self.__abi = {}
             self.__functions_per_contract = {}
@@ -171,6 +263,11 @@ class SmartCMetrics:
     @property
     def is_compilable(self):
         return self.__vul_report['compilable']
+
+    @property
+    def status(self):
+        # 'analyzed', 'not_compilable', 'timeout' or 'killed' (compilability unknown)
+        return findings.get_status(self.__vul_report)
     
     @property
     def vul_summary(self):
@@ -180,9 +277,6 @@ class SmartCMetrics:
     def get_parsed_sol(self):
         return self.__parsed_sol
     
-    @property
-    def get_parsed_obj(self):
-        return self.__parsed_obj
     
     @property
     def param_with_initial_value(self):
@@ -214,86 +308,135 @@ class SmartCMetrics:
     
     @staticmethod
     def remove_comments(string):
-        pattern = r"(\".*?\"|\'.*?\')|(/\*.*?\*/|//[^\r\n]*$)"
-        # first group captures quoted strings (double or single)
-        # second group captures comments (//single-line or /* multi-line */)
-        regex = re.compile(pattern, re.MULTILINE|re.DOTALL)
-        def _replacer(match):
-            # if the 2nd group (capturing comments) is not None,
-            # it means we have captured a non-quoted (real) comment string.
-            if match.group(2) is not None:
-                return "" # so we will return empty to remove the comment
-            else: # otherwise, we will return the 1st group
-                return match.group(1) # captured quoted-string
-        return regex.sub(_replacer, string)
+        return parse_solidity(string)['code']
     
+    @staticmethod
+    def get_vul_report_path(path2sol: str, vul_tool: str = 'slither'):
+        """
+        Get the vulnerability report path of a smart contract (`<...>/sc/<name>.sol` -> `<...>/vul/<name>.sol.json`,
+        `<...>/vul/<name>.sol.<tool>.json` for tools other than slither)
+        """
+        vul_folder = os.path.join(os.path.dirname(os.path.dirname(path2sol)), 'vul') # abs path to 'vul' folder
+        suffix = '.json' if vul_tool == 'slither' else f'.{vul_tool}.json'
+        return os.path.join(vul_folder, os.path.basename(path2sol) + suffix)
+
+    @classmethod
+    def get_vul_tools(cls, vul_tool: str | list):
+        """
+        Get the list of analysis tools from a name, a comma separated list of names (i.e., 'slither,mythril') or a list
+        """
+        vul_tools = vul_tool.split(',') if isinstance(vul_tool, str) else list(vul_tool)
+        vul_tools = [tool.strip() for tool in vul_tools]
+        for tool in vul_tools:
+            if tool not in cls.VUL_TOOLS:
+                raise ValueError(f"Vulnerability tool '{tool}' not supported, use one of {list(cls.VUL_TOOLS)}")
+        return vul_tools
+
+    @classmethod
+    def get_vul_tool_config(cls, vul_tool: str):
+        """
+        Get the configuration of an analysis tool (see `VUL_TOOLS`), with the shared folder resolved
+        """
+        vul_tool_cfg = cls.VUL_TOOLS[vul_tool]
+        return {**vul_tool_cfg, 'host_path': vul_tool_cfg['host_path'] or shared_path()}
+
     def run_vulnerability_detection(self, sc_sol: str = None, cmd: list = None):
         """
         Run vulnerability detection tool on given smart contract
         :param cmd: command to run vulnerability detection tool
         :return: vulnerability report
         """
-        # Verify if docker is running
+        worker = AnalysisWorkerPool.BACKENDS[self.backend](worker_name(self.vul_tool), self.vul_tool)
         try:
-            self.docker_client = docker.from_env()
-            self.docker_client.containers.list()
-        except Exception as e:
-            logging.error(f"Docker is not running. Error: {e}")
-            raise e
-
-        # Get docker container instance, else create it
-        try:
-            container = self.docker_client.containers.get(self.vul_tool['docker_name'])
-        except Exception as e:
-
-            container = self.docker_client.containers.run(
-                image=self.vul_tool['docker_image'],
-                detach=True,
-                name=self.vul_tool['docker_name'],
-                volumes= {self.vul_tool['host_path']: {'bind': self.vul_tool['container_path'], 'mode': 'rw'}}
-            )
-
-        if container.status != 'running':
-            logging.debug(f"Container {self.vul_tool['docker_name']} is not running. Starting it...")
-            container.start()
-            logging.info(f"Container {self.vul_tool['docker_name']} started.")
+            output = self.run_detection_job(worker, sc_sol or self.__path2sol, self.vul_tool_name, cmd)
+        finally:
+            worker.close()
+        self.__pragma = self.get_pragma(output['sc_txt'])
+        return output['output']
 
+    @classmethod
+    @tracing.traced(attrs=lambda cls, worker, path2sol, vul_tool='slither', cmd=None: {'tool': vul_tool, 'worker': worker.name})
+    def run_detection_job(cls, worker, path2sol: str, vul_tool: str = 'slither', cmd: list = None):
+        """
+        Run vulnerability detection tool on given smart contract with the given worker
+        and save the report in the 'vul' folder
+        :param worker: analysis worker (see `analysis.workers`)
+        :param path2sol: path to the smart contract
+        :param vul_tool: vulnerability detection tool
+        :param cmd: command to run vulnerability detection tool
+        :return: dict with the smart contract source and the tool output
+        """
+        vul_tool_cfg = cls.get_vul_tool_config(vul_tool)
         # Get smart contract solidity file
-        with open(sc_sol, 'r') as f:
+        with open(path2sol, 'r') as f:
             sc_txt = f.read()
         
         # Get pragma 
-        pragma = self.get_pragma(sc_txt)
-        self.__pragma = pragma
+        pragma = cls.get_pragma(sc_txt)
         logging.info(f"Pragma: {pragma}")
 
         # Run vulnerability detection tool
+        cmd_err = []
         if cmd is None:
-            relative_path2sc_sol_in_shared_folder = self.__path2sol.replace(self.vul_tool['host_path'] +'\\', '').replace('\\', '/')
-            path2sc_sol_in_shared_folder = '/'.join([self.vul_tool['container_path'], relative_path2sc_sol_in_shared_folder])
+            path2sc_sol_in_shared_folder = worker.to_worker_path(path2sol)
             logging.info(f"Path to smart contract in shared folder: {path2sc_sol_in_shared_folder}")
-            cmd = self.vul_tool['cmd'](path2sc_sol_in_shared_folder, pragma)
+            remaps = []
+            if vul_tool_cfg.get('deps'):
+                # Installed once for all the contracts, then only remapped
+                deps = DependencyStore.for_tool(vul_tool_cfg)
+                deps.ensure(worker)
+                remaps = deps.remappings(worker)
+            root = worker.to_worker_path(vul_tool_cfg['host_path'])
+            cmd = vul_tool_cfg['cmd'](path2sc_sol_in_shared_folder, pragma, remaps, root)
             logging.info(cmd)
-            cmd_err = self.vul_tool['cmd_err'](path2sc_sol_in_shared_folder, pragma)
+            cmd_err = vul_tool_cfg['cmd_err'](path2sc_sol_in_shared_folder, pragma, remaps, root)
+        environment = None
+        if vul_tool_cfg.get('solc_select'):
+            # Installed once per worker (no-op if already provisioned), then pinned for this job only
+            SolcManager.install_on_worker(worker, [pragma])
+            environment = SolcManager.env(pragma)
+        timeout = vul_tool_cfg.get('timeout')
         
         # Run command
         if isinstance(cmd, list):
             for c in cmd:
-                logging.info(f"Running command: {c}")
-                _, output = container.exec_run(cmd=c, stdin=True)
-                logging.info(f'Slither output:\n{_}\n{output}')
+                logging.info(f"[{worker.name}] Running command: {c}")
+                exit_code, output = worker.run(c, environment, timeout)
+                logging.info(f'{vul_tool} output:\n{exit_code}\n{output}')
+                if exit_code in (TIMEOUT_EXIT_CODE, KILLED_EXIT_CODE):
+                    break
             
             # If the last output is empty, run the command to check if the smart contract compiles 
             # since the last command did not return a valid JSON
-            if output.decode('utf-8') == '':
+            if output.decode('utf-8') == '' and exit_code not in (TIMEOUT_EXIT_CODE, KILLED_EXIT_CODE):
                 for c in cmd_err:
                     logging.debug(f"Compilatin error detected. Running command: {c}")
-                    _, output = container.exec_run(cmd=c, stdin=True)
-                    logging.info(f'Slither output:\n{_}\n{output}')
+                    exit_code, output = worker.run(c, environment, timeout)
+                    logging.info(f'{vul_tool} output:\n{exit_code}\n{output}')
         else:
             raise ValueError(f"Command must be a list, not {type(cmd)}")
+        if exit_code == TIMEOUT_EXIT_CODE:
+            # Recorded as such (see `analysis.findings`), not as a compilation error
+            logging.error(f"[{worker.name}] {vul_tool} timed out after {timeout}s on '{path2sol}'")
+            json_out = {
+                "success": False,
+                "status": findings.STATUS_TIMEOUT,
+                "message": f"Timeout after {timeout}s"
+            }
+        elif exit_code == KILLED_EXIT_CODE:
+            logging.error(f"[{worker.name}] {vul_tool} killed on '{path2sol}' (memory limit: {vul_tool_cfg.get('mem_limit')})")
+            json_out = {
+                "success": False,
+                "status": findings.STATUS_KILLED,
+                "message": f"Killed (memory limit: {vul_tool_cfg.get('mem_limit')})"
+            }
+        else:
+            json_out = None
+        tracing.annotate(exit_code=exit_code)
+        if json_out is not None:
+            tracing.fail(json_out['message'])
         try:
-            json_out = json.loads(output.decode('utf-8'))
+            json_out = json_out or json.loads(output.decode('utf-8'))
         except Exception as e:
             # TODO: Most likely, this happends when the smart contract is not compilable
             # Try to catch the error "raise 'InvalidCompilation'..." with regex
@@ -303,46 +446,108 @@ class SmartCMetrics:
                 "message": output.decode('utf-8')
             }
 
-        with open(self.__vul_report_file_path, "w") as ff:
+        with open(cls.get_vul_report_path(path2sol, vul_tool), "w") as ff:
             json.dump(json_out, ff, indent=4)
-        return output.decode('utf-8')
+        return {'sc_txt': sc_txt, 'output': output.decode('utf-8')}
+
+    @classmethod
+    @tracing.traced()
+    def run_compilation(cls, sol_paths: list, vul_tool: str | list = 'slither', n_workers: int = None):
+        """
+        Compile the smart contracts missing a vulnerability report in process (solc standard JSON),
+        and write the report of the ones that do not compile, so that only compilable contracts
+        are sent to the vulnerability detection tool
+        :param sol_paths: paths to smart contracts
+        :param vul_tool: vulnerability detection tool(s)
+        :param n_workers: number of parallel compilations, number of CPUs by default
+        :return: dict path -> compilation result (None if undecided, i.e. unresolved imports)
+        """
+        vul_tools = cls.get_vul_tools(vul_tool)
+        pending = [path for path in sol_paths if not os.path.exists(cls.get_vul_report_path(path, vul_tools[0]))]
+        if not pending:
+            return {}
+        results = compile_contracts(pending, cls.get_pragma, DependencyStore.for_tool(cls.get_vul_tool_config(vul_tools[0])), n_workers)
+        not_compilable = [path for path, result in results.items() if result is not None and not result['compilable']]
+        logging.info(f"Compiled {len(pending)} smart contracts in process, {len(not_compilable)} do not compile")
+        tracing.annotate(contracts=len(pending), not_compilable=len(not_compilable))
+        for path in not_compilable:
+            # Same format as the tool output on compilation errors (see `get_vulns`)
+            json_out = {
+                "success": False,
+                "message": "InvalidCompilation: " + "\n".join(results[path]['errors'])
+            }
+            # None of the tools is run on it
+            for tool in vul_tools:
+                with open(cls.get_vul_report_path(path, tool), "w") as ff:
+                    json.dump(json_out, ff, indent=4)
+        return results
 
-    def get_vulns(self, vul_report_file: str):
+    @classmethod
+    @tracing.traced(attrs=lambda cls, sol_paths, vul_tool='slither', *args, **kwargs: {'tool': vul_tool if isinstance(vul_tool, str) else ','.join(vul_tool)})
+    def run_vulnerability_detection_pool(cls, sol_paths: list, vul_tool: str | list = 'slither', n_workers: int = None, backend: str = 'docker'):
+        """
+        Run the vulnerability detection of every smart contract missing a report on a pool of workers.
+        Several tools run at the same time, each one on its own pool (see the 'max_concurrency' of `VUL_TOOLS`)
+        :param sol_paths: paths to smart contracts
+        :param vul_tool: vulnerability detection tool(s)
+        :param n_workers: number of workers (per tool), number of CPUs by default
+        :param backend: 'docker' (one container per worker) or 'local' (tools installed on the host)
+        """
+        vul_tools = cls.get_vul_tools(vul_tool)
+        if len(vul_tools) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(vul_tools), thread_name_prefix='tool') as executor:
+                futures = {executor.submit(cls.run_vulnerability_detection_pool, sol_paths, tool, n_workers, backend): tool for tool in vul_tools}
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logging.error(f"Vulnerability detection with '{futures[future]}' failed:\n{e}")
+            return
+        vul_tool = vul_tools[0]
+        vul_tool_cfg = cls.get_vul_tool_config(vul_tool)
+        pending = [path for path in sol_paths if not os.path.exists(cls.get_vul_report_path(path, vul_tool))]
+        if not pending:
+            return
+        for file_name, content in vul_tool_cfg.get('files', {}).items():
+            with open(os.path.join(vul_tool_cfg['host_path'], file_name), 'w') as f:
+                f.write(content)
+        n_workers = min(n_workers or os.cpu_count(), vul_tool_cfg.get('max_concurrency') or len(pending), len(pending))
+        # Contracts grouped by compiler version: every version is installed once up front,
+        # and jobs are queued version by version
+        groups = SolcManager.group_by_version(pending, cls.get_pragma)
+        logging.info(f"Running {vul_tool} on {len(pending)} smart contracts ({n_workers} workers), solc versions: {sorted(v for v in groups if v is not None)}")
+        tracing.annotate(contracts=len(pending), workers=n_workers)
+        with AnalysisWorkerPool(vul_tool_cfg, n_workers=n_workers, backend=backend) as pool:
+            if vul_tool_cfg.get('solc_select'):
+                pool.broadcast(SolcManager.install_on_worker, list(groups.keys()))
+            futures = {pool.submit(cls.run_detection_job, path, vul_tool): path
+                       for version in sorted(groups, key=lambda v: v or '') for path in groups[version]}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"Vulnerability detection ({vul_tool}) failed for '{futures[future]}':\n{e}")
+
+    def get_vulns(self, vul_report_file: str, vul_tool: str = None):
         """
         Get vulnerability report from vulnerability detection tool
-        :param cmd: command to run vulnerability detection tool
-        :return: vulnerability report
+        :param vul_report_file: report of the tool (JSON output)
+        :param vul_tool: tool that produced the report, the first tool by default
+        :return: vulnerability report, normalized (see `analysis.findings`)
         """
+        vul_tool = vul_tool or self.vul_tool_name
         with open(vul_report_file, "r") as ff:
             vulns_raw = json.load(ff)
             logging.debug(pformat(vulns_raw))
-        if self.vul_tool_name == "slither":
-            if vulns_raw.get("results", {}).get("detectors", False):
-                vulns = {
-                    'compilable': True,
-                    'vulns': list(map(lambda x: {key: x[key] for key in ["description", "check", "impact", "confidence","first_markdown_element"]}, 
-                                  vulns_raw["results"]["detectors"]))
-                }
-            else:
-                # If vulnerability detectioin tool fails, return the error.
-                # Commonly, this happens when the pragma is not supported or the smart contract does not compile
-                pattern_not_compilable = r'InvalidCompilation: (.*)'
-                logging.error(f"Slither execution failed:\n\n{pformat(vulns_raw)}")
-                vulns = {
-                    'compilable': False,
-                    'vulns': [{
-                        "impact":"High",
-                        "confidence":"High",
-                        "description": re.findall(pattern_not_compilable, vulns_raw["message"], re.DOTALL)
-                    }]
-                }
-        # Add `elif` with other vulnerability detection tools (i.e., Mythril)
-        else:
-            raise ValueError(f"Vulnerability tool '{self.vul_tool}' not supported")
+        vulns = findings.normalize(vul_tool, vulns_raw)
+        if not vulns['compilable']:
+            # Commonly, this happens when the pragma is not supported or the smart contract does not compile
+            logging.error(f"{vul_tool} execution failed:\n\n{pformat(vulns_raw)}")
         return vulns
     
     def __compute_bleu(self):
         if self.__path2sol_ref is not None:
+            import nltk
             # Compute BLEU score
             tk_code =  nltk.tokenize.sent_tokenize(self.__sol_code)
             tk_code_ref = nltk.tokenize.sent_tokenize(self.__sol_code_ref) 
@@ -351,13 +556,17 @@ class SmartCMetrics:
         return None
     
     @staticmethod
-    def get_pragma(sc_txt):
-        # Get pragma 
-        pattern = r"(pragma solidity ).{0,2}(\d\.\d+\.\d+)+"
-        pragma = re.findall(pattern, sc_txt)[0][1]
+    def normalize_pragma(pragma: str):
+        if pragma is None:
+            raise ValueError("No 'pragma solidity' version found")
         if int(pragma.split(".")[1]) == 4 and int(pragma.split(".")[2]) < 11:
             pragma = "0.4.11"
         return pragma
+
+    @staticmethod
+    def get_pragma(sc_txt):
+        # Get pragma 
+        return SmartCMetrics.normalize_pragma(get_version(parse_solidity(sc_txt)['pragma']))
     
     def __get_vul_summary(self):
         if self.__vul_report['compilable']:
@@ -365,6 +574,9 @@ class SmartCMetrics:
             for item in self.__vul_report['vulns']:
                 key = (item['check'], item['confidence'], item['impact'])
                 occurrences[key] = occurrences.get(key, 0) + 1
+        elif self.__vul_report['compilable'] is None:
+            # Analysis timed out or killed: no findings, and no compilation error either
+            occurrences = {}
         else:
             occurrences = {
                 ('Compilation error', 'High', 'High'): 1
@@ -392,14 +604,7 @@ class SmartCMetrics:
     def __get_param_with_initial_value(self):
         # Execute the function only if the smart contract is compilable
         if self.__vul_report['compilable']:
-            valued_param = {contract: [] for contract in self.__contracts}
-            for contract in self.__contracts:
-                nodes = self.__abi[f"{self.__path2sol}:{contract}".replace("\\", "/")]['ast']['nodes'][1]['nodes']
-                for node in nodes:
-                    # if node.get('constant', False):
-                    if node.get('name', False):
-                        valued_param[contract].append((node['name'], node['value'].get('value', None) if node.get('value', False) else None))
-            return valued_param
+            return {name: contract['state_variables'] for name, contract in self.__parsed_sol['contracts'].items()}
         return {}
     
     def __get_no_param_with_initial_value(self):
@@ -414,61 +619,34 @@ class SmartCMetrics:
     
     @staticmethod
     def get_contract_names(sol_txt: str):
-        pattern_contract = 'contract (.*) {'
-        return re.findall(pattern_contract, sol_txt)
+        return [name for name, contract in parse_solidity(sol_txt)['contracts'].items() if 'contract' in contract['kind']]
     
     @staticmethod
     def get_external_calls(sol_txt: str):
         # If there are any imports, the smart contract has external calls
-        pattern_contract = 'import (.*);'
-        return re.findall(pattern_contract, sol_txt)
+        return parse_solidity(sol_txt)['imports']
 
     @classmethod
-    def get_sc_metrics(cls, path2sol: str, vul_tool: str = 'slither', path2sol_ref: str = None):
+    @tracing.traced()
+    def get_sc_metrics(cls, path2sol: str, vul_tool: str = 'slither', path2sol_ref: str = None, backend: str = 'docker'):
         """Get smart contract metrics
         :param path2sol: path to smart contract
         :param vul_tool: vulnerability detection tool
         :param path2sol_ref: path to reference smart contract
+        :param backend: analysis workers backend ('docker' or 'local') if the report is missing
         :return: smart contract metrics
         """
 
-        def compute_scores(metrics: dict, weights: dict):
-            score = {'compilable': 0}
-            if metrics['compilable']:
-                for key, val in weights.items():
-                    if isinstance(val, dict):
-                        for k, v in val.items():
-                            score[f'{key}_score'] = metrics[key][k] * v
-                    else:
-                        if key == 'pragma':
-                            score[f'{key}_score'] = val(metrics[key])
-                        else:
-                            score[f'{key}_score'] = metrics[key] * val
-            return score
-
-        sc = cls(path2sol, vul_tool, path2sol_ref)
-
-        weights = {
-            'compilable': 1,
-            'vul_count': {
-                'high': -1,
-                'medium': -0.5,
-                'low': -0.25
-            },
-            'has_comments': 0.5,
-            'no_param_with_initial_value': 0.5,
-            'no_contracts': 0.25,
-            'no_functions': 0.15,
-            # 'no_external_calls': 0.5,
-            'pragma': lambda x: 1 if x.split('.')[1] == '8' else 0
-        }
+        sc = cls(path2sol, vul_tool, path2sol_ref, backend)
 
         metrics = {
             'compilable': sc.is_compilable,
+            'status': sc.status,
+            'tool_status': sc.vul_report.get('tool_status', {sc.vul_tool_name: sc.status}),
             'name': sc.file_name,
             'pragma': sc.pragma,
             'no_pragma': int(sc.pragma.split(".")[1]),
-            'temperature': re.findall(r"_t(.*).sol", sc.file_name)[0] if re.findall(r"_t(.*).sol", sc.file_name) else 'N/A',
+            'temperature': cls.get_temperature(sc.file_name),
             'vul_report': sc.vul_report,
             'vul_summary': sc.vul_summary,
             'vul_count': sc.vul_count,
@@ -478,36 +656,180 @@ class SmartCMetrics:
             'has_comments': sc.has_comments,
             'external_calls': sc.external_calls if sc.is_compilable else 0,
             'no_external_calls': sc.no_external_calls if sc.is_compilable else 0,
-            # 'param_with_initial_value': sc.param_with_initial_value if sc.is_compilable else 0,
-            'param_with_initial_value': 0,
-            # 'no_param_with_initial_value': sc.no_param_with_initial_value if sc.is_compilable else 0,
-            'no_param_with_initial_value': 0,
+            'param_with_initial_value': sc.param_with_initial_value if sc.is_compilable else 0,
+            'no_param_with_initial_value': sc.no_param_with_initial_value if sc.is_compilable else 0,
             # 'bleu': sc.__compute_bleu(),
             # 'code_bleu': self.code_bleu_score
         }
-        scores = compute_scores(metrics, weights)
-        metrics.update(scores)
-        metrics.update({'total_score': sum(scores.values())})
+        # Scores are computed on the whole metrics table (see `scoring.score`)
         return metrics
 
 
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get_tool_version(vul_tool: str = 'slither', backend: str = 'docker'):
+        """Get the version of the vulnerability detection tool, part of the results store key
+
+        Parameters
+        ----------
+        vul_tool : str, optional
+            Vulnerability tool, by default 'slither'
+        backend : str, optional
+            Analysis workers backend, by default 'docker'
+
+        Returns
+        -------
+        str
+            Tool version ('unknown' if it cannot be determined)
+        """
+        vul_tool_cfg = SmartCMetrics.VUL_TOOLS[vul_tool]
+        try:
+            if backend == 'docker':
+                import docker
+                # The image id changes whenever the toolbox (and the detectors in it) is updated
+                return docker.from_env().images.get(vul_tool_cfg['docker_image']).id
+            return subprocess.run(vul_tool_cfg['version_cmd'].split(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True).stdout.strip()
+        except Exception as e:
+            logging.warning(f"Cannot get the version of '{vul_tool}': {e}")
+            return 'unknown'
+
+    @staticmethod
+    def get_temperature(file_name: str):
+        return re.findall(r"_t(.*).sol", file_name)[0] if re.findall(r"_t(.*).sol", file_name) else 'N/A'
+
+    @classmethod
+    def remove_stale_reports(cls, store: ResultsStore, sol_paths: list, hashes: dict, vul_tool: str, tool_version: str):
+        """Remove the vulnerability reports computed on a previous version of the contract (or of the tool)"""
+        for path in sol_paths:
+            report_path = cls.get_vul_report_path(path, vul_tool)
+            if os.path.exists(report_path) and not store.is_report_current(report_path, path, hashes[path], vul_tool, tool_version):
+                logging.info(f"Removing stale vulnerability report '{report_path}'")
+                os.remove(report_path)
+
+    @classmethod
+    def discover_contracts(cls, pipe_output_path: str):
+        """Yield every generated smart contract under the pipeline output
+        (<model>/<n_iter>/<prompt key>/<legal agreement name>/sc/*.sol)
+
+        Parameters
+        ----------
+        pipe_output_path : str
+            The root path of the pipeline output
+
+        Yields
+        ------
+        ContractItem
+            Smart contract and its position in the results tree
+        """
+        for model in _subdirs(pipe_output_path):
+            for n_test in _subdirs(model.path):
+                for prompt in _subdirs(n_test.path):
+                    for legal_agreement in _subdirs(prompt.path):
+                        legal_agreement_sc_path = os.path.join(legal_agreement.path, 'sc')
+                        if not os.path.isdir(legal_agreement_sc_path):
+                            logging.warning(f"Path '{legal_agreement_sc_path}' is not a directory")
+                            continue
+                        for sol in sorted(os.scandir(legal_agreement_sc_path), key=lambda entry: entry.name):
+                            if sol.name.endswith('.sol') and sol.is_file():
+                                yield ContractItem(model.name, n_test.name, prompt.name, legal_agreement.name, sol.path)
+
     @classmethod
-    def pipe(cls, pipe_output_path: str, vul_tool: str = 'slither', path2sol_ref: str = None):
+    def analyze(cls, pipe_output_path: str, sol_paths: list, vul_tool: str | list = 'slither', path2sol_ref: str = None, n_workers: int = None,
+                backend: str = 'docker'):
+        """Analyze the given smart contracts and save their metrics in the results store of the pipeline output.
+        Only new or changed contracts (by source hash and tool version) are analyzed
+
+        Parameters
+        ----------
+        pipe_output_path : str
+            The root path of the pipeline output
+        sol_paths : list
+            Paths to the smart contracts, under `pipe_output_path`
+        vul_tool : str | list, optional
+            Vulnerability tool(s) to use, by default 'slither'
+        path2sol_ref : str, optional
+            Reference smart contract to compute BLEU and CodeBLEU metrics, by default None
+        n_workers : int, optional
+            Number of concurrent analysis workers and metrics processes, by default the number of CPUs
+        backend : str, optional
+            Analysis workers backend, 'docker' or 'local', by default 'docker'
+
+        Returns
+        -------
+        dict
+            Path -> metrics (None if they could not be computed)
+        """
+        store = ResultsStore.for_output(pipe_output_path)
+        vul_tools = cls.get_vul_tools(vul_tool)
+        # Reports only depend on the tool version, the stored metrics also on the metrics computation (METRICS_VERSION)
+        tool_versions = {tool: cls.get_tool_version(tool, backend) for tool in vul_tools}
+        # Results of a combination of tools are stored under '<tool>+<tool>'
+        tool_key, tool_version = '+'.join(tool_versions), '+'.join(tool_versions.values()) + f"/metrics-{cls.METRICS_VERSION}"
+        hashes = {path: sha256_file(path) for path in sol_paths}
+        metrics = {path: store.get(sha256, tool_key, tool_version) for path, sha256 in hashes.items()}
+        pending = [path for path, sc_metrics in metrics.items() if sc_metrics is None]
+        logging.info(f"{len(sol_paths)} smart contracts, {len(pending)} new or changed")
+        tracing.annotate(tool=tool_key, contracts=len(sol_paths), pending=len(pending))
+        for tool in vul_tools:
+            cls.remove_stale_reports(store, pending, hashes, tool, tool_versions[tool])
+
+        # Fast path: compile in process, contracts that do not compile get their report
+        # without going through the vulnerability detection tool
+        cls.run_compilation(pending, vul_tool, n_workers)
+
+        # Run the vulnerability detection of all the pending contracts concurrently,
+        # the metrics below then read the reports from the 'vul' folders
+        cls.run_vulnerability_detection_pool(pending, vul_tool, n_workers, backend)
+
+        # CPU-bound metrics computation spread over a process pool
+        if pending:
+            with tracing.span('SmartCMetrics.compute_metrics', contracts=len(pending)), \
+                    concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = {executor.submit(_compute_sc_metrics, path, vul_tool, path2sol_ref, backend): path for path in pending}
+                for future in concurrent.futures.as_completed(futures):
+                    path = futures[future]
+                    metrics[path] = future.result()
+                    report_paths = {tool: cls.get_vul_report_path(path, tool) for tool in vul_tools}
+                    # Contracts missing a report (i.e., a tool crashed) are analyzed again on the next run
+                    if metrics[path] is not None and all(os.path.exists(report_path) for report_path in report_paths.values()):
+                        store.put(hashes[path], tool_key, tool_version, metrics[path])
+                        for tool, report_path in report_paths.items():
+                            store.record_report(report_path, hashes[path], tool, tool_versions[tool])
+
+        return metrics
+
+    @classmethod
+    @tracing.traced(tracing.ANALYSIS_SPAN)
+    def pipe(cls, pipe_output_path: str, vul_tool: str | list = 'slither', path2sol_ref: str = None, n_workers: int = None, backend: str = 'docker', excel: bool = False,
+             profile: str = None):
         """Post-processing pipeline
 
         Parameters
         ----------
         pipe_output_path : str
             The root path of the pipeline output
-        vul_tool : str, optional
-            Vulnerability tool to use, by default 'slither'
+        vul_tool : str | list, optional
+            Vulnerability tool(s) to use, i.e. 'slither,mythril' (run concurrently, the first one decides compilability), by default 'slither'
         path2sol_ref : str, optional
             Reference smart contract to compute BLEU and CodeBLEU metrics, by default None
+        n_workers : int, optional
+            Number of concurrent analysis workers and metrics processes, by default the number of CPUs
+        backend : str, optional
+            Analysis workers backend, 'docker' (one container per worker) or 'local', by default 'docker'
+        excel : bool, optional
+            Also derive the per (model, iteration) Excel workbooks from the Parquet dataset, by default False
+        profile : str, optional
+            Scoring weight profile (see `scoring.WEIGHT_PROFILES`), by default settings.SCORE_PROFILE
+
+        Returns
+        -------
+        tuple
+            Metrics and findings DataFrames, also saved as Parquet datasets under `pipe_output_path`
 
         """
         ### Path created by the pipeline
-        # C:\Users\<user name>\slither_shared
+        # SHARED_ROOT (i.e., C:\Users\<user name>\slither_shared)
         # |   
         # \---output
         #     |   
@@ -529,42 +851,37 @@ class SmartCMetrics:
         #     |   |     |   |    \---vul
         #     .   .     .   .
 
-        for model_name_path in os.listdir(pipe_output_path):
-            model_path = os.path.join(pipe_output_path, model_name_path)
-            logging.info("=====================================")
-            logging.info(f"Model path: {model_path}")
-            if os.path.isdir(model_path):
-                for n_test_name in os.listdir(model_path):
-                    n_test_path = os.path.join(model_path, n_test_name)
-                    logging.info(f"    -> n_test path: {n_test_path}")
-                    to_pandas = []
-                    if os.path.isdir(n_test_path):
-                        for prompt_name_path in os.listdir(n_test_path):
-                            prompt_path = os.path.join(n_test_path, prompt_name_path)
-                            logging.info(f"        -> Prompt path: {prompt_path}")
-                            if os.path.isdir(prompt_path):
-                                for legal_agreement_name_path in os.listdir(prompt_path):
-                                    legal_agreement_path = os.path.join(prompt_path, legal_agreement_name_path)
-                                    logging.info(f"            -> Legal agreement name path: {legal_agreement_path}")
-                                    if os.path.isdir(legal_agreement_path):
-                                        legal_agreement_sc_path = os.path.join(legal_agreement_path, 'sc')
-                                        for sol_name_path in os.listdir(legal_agreement_sc_path):
-                                            if sol_name_path.endswith('.sol'):
-                                                sol_path = os.path.join(legal_agreement_sc_path, sol_name_path)
-                                                logging.info(f"                -> Smart contract path: {sol_path}")
-                                                if os.path.isfile(sol_path):
-                                                    sc_sol_metrics = SmartCMetrics.get_sc_metrics(sol_path, vul_tool, path2sol_ref)
-                                                    sc_sol_metrics.update({'prompt': prompt_name_path})
-                                                    sc_sol_metrics.update({'legal_agreement': legal_agreement_name_path})
-                                                    to_pandas.append(sc_sol_metrics)
-                                                else:
-                                                    logging.warning(f"                ->Path '{sol_path}' is not a file")
-                                    else:
-                                        logging.warning(f"            -> Path '{legal_agreement_path}' is not a directory")
-                    data = pd.DataFrame(to_pandas)
-                    if not data.empty:
-                        logging.info(f"        -> Metrics:{data}")
-                        data.set_index(['prompt', 'legal_agreement'], inplace=True)
-                        where_to_save = os.path.join(model_path, f'sc_metrics_{model_name_path}_{n_test_name}.xlsx')
-                        data.to_excel(where_to_save, index=True, header=True)
-                        logging.info(f"        -> Metrics saved to {where_to_save}")
\ No newline at end of file
+        with tracing.span('SmartCMetrics.discover_contracts'):
+            items = list(cls.discover_contracts(pipe_output_path))
+        # Only new or changed contracts are analyzed, the others (i.e., analyzed by the distributed workers) come from the results store
+        metrics = cls.analyze(pipe_output_path, [item.sol_path for item in items], vul_tool, path2sol_ref, n_workers, backend)
+
+        # Merge the results into the columnar tables (partitioned by model/iteration/prompt)
+        rows = []
+        for item in items:
+            if metrics[item.sol_path] is None:
+                continue
+            sc_sol_metrics = dict(metrics[item.sol_path])
+            # Same source, possibly stored under another name
+            file_name = os.path.basename(item.sol_path)
+            sc_sol_metrics.update({'name': file_name, 'temperature': cls.get_temperature(file_name)})
+            sc_sol_metrics.update({'model': item.model, 'iteration': item.iteration})
+            sc_sol_metrics.update({'prompt': item.prompt})
+            sc_sol_metrics.update({'legal_agreement': item.legal_agreement})
+            rows.append(sc_sol_metrics)
+
+        # pandas (and pyarrow) are only loaded by this stage
+        from . import results, scoring
+        data, findings_data = results.flatten_metrics(rows)
+        if data.empty:
+            logging.warning(f"No smart contract metrics found in '{pipe_output_path}'")
+            return data, findings_data
+        with tracing.span('SmartCMetrics.write_results'):
+            data = scoring.score(data, profile)
+            results.write_dataset(pipe_output_path, data, findings_data)
+            if excel:
+                results.export_excel(pipe_output_path, data)
+        # Compilable contracts per model, for the cost per compilable contract (see `core.tracing.summary`)
+        compilable = data[data['compilable'].fillna(False).astype(bool)].groupby('model').size()
+        tracing.annotate(compilable={model: int(n) for model, n in compilable.items()})
+        return data, findings_data
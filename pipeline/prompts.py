@@ -186,6 +186,79 @@ PROMPTS = {
     
 }
 
+### Prompts sharing the legal agreement as prefix
+# The agreement comes first and is identical for every prompt, temperature and iteration, so that
+# providers can serve it from their prompt cache (Anthropic `cache_control`, OpenAI automatic prefix caching);
+# the COSTAR variant comes after it.
+
+class SplitPrompt(str):
+    """Rendered prompt that remembers where its shared prefix ends"""
+
+    def __new__(cls, prefix: str, suffix: str):
+        prompt = super().__new__(cls, prefix + suffix)
+        prompt.prefix = prefix
+        prompt.suffix = suffix
+        return prompt
+
+
+class PrefixPrompt:
+    """COSTAR prompt with the legal agreement as shared prefix, used like the `PROMPTS` lambdas"""
+
+    PREFIX = "Legal agreement:\n\n{legal_agreement}\n\n"
+
+    def __init__(self, suffix: str):
+        self.suffix = inspect.cleandoc(suffix)
+
+    def __call__(self, x):
+        legal_agreement = ''.join(x) if isinstance(x, list) else x
+        return SplitPrompt(self.PREFIX.format(legal_agreement=legal_agreement.strip()), self.suffix)
+
+
+GOAL_PREFIXED = {key: val.replace("the following legal agreement", "the legal agreement above") for key, val in GOAL.items()}
+
+# Own keys (and so own output folders, cache entries and ledger cells): the prefix contracts never mix with the `PROMPTS` ones
+PREFIX_PROMPTS = {
+    ### ---------- Senior developer
+    'PR12-prefix': PrefixPrompt(f"""
+    {CONTEXT[3]} {GOAL_PREFIXED[1]}
+    {REQUIREMENTS[1]}
+    {STYLE[2]}
+    {AUDIENCE[4]}
+    """),
+    'PR13-prefix': PrefixPrompt(f"""
+    {CONTEXT[3]} {GOAL_PREFIXED[1]}
+    {REQUIREMENTS[1]}
+    {STYLE[3]}
+    {AUDIENCE[4]}
+    """),
+    'PR14-prefix': PrefixPrompt(f"""
+    {CONTEXT[3]} {GOAL_PREFIXED[1]}
+    {REQUIREMENTS[2]}
+    {STYLE[3]}
+    {AUDIENCE[4]}
+    """),
+    'PR15-prefix': PrefixPrompt(f"""
+    {CONTEXT[3]} {GOAL_PREFIXED[2]}
+    {REQUIREMENTS[2]}
+    {STYLE[3]}
+    {AUDIENCE[4]}
+    """),
+    ### ---------- Senior developer with reward
+    'PR16-prefix': PrefixPrompt(f"""
+    {CONTEXT[3]} A company will pay you $500,000 for the completion of the project. {GOAL_PREFIXED[2]}
+    {REQUIREMENTS[2]}
+    {STYLE[3]}
+    {AUDIENCE[4]}
+    """),
+    ### ---------- Senior developer that delivers to an attorney
+    'PR17-prefix': PrefixPrompt(f"""
+    {CONTEXT[3]} A company will pay you $500,000 for the completion of the project. {GOAL_PREFIXED[2]}
+    {REQUIREMENTS[2]}
+    {STYLE[3]}
+    {AUDIENCE[5]}
+    """),
+}
+
 ### Uncomment to get the prompts in a file
 # with open('prompt.txt', 'w') as f:
 #     for key, val in PROMPTS.items():
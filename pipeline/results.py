@@ -0,0 +1,135 @@
+import os
+import json
+import shutil
+import logging
+import pandas as pd
+from urllib.parse import quote
+
+# Columnar post-processing output, under the pipeline output root:
+#   sc_metrics.parquet/model=<model>/iteration=<n_iter>/prompt=<prompt key>/*.parquet   one row per smart contract
+#   sc_findings.parquet/model=<model>/iteration=<n_iter>/prompt=<prompt key>/*.parquet  one row per finding
+METRICS_DATASET = 'sc_metrics.parquet'
+FINDINGS_DATASET = 'sc_findings.parquet'
+PARTITION_COLS = ['model', 'iteration', 'prompt']
+
+# Nested metrics kept as JSON strings in the metrics table
+JSON_COLUMNS = ['no_functions_per_contract', 'external_calls', 'param_with_initial_value', 'tool_status']
+# Nested metrics moved to the findings table (or flattened)
+NESTED_COLUMNS = ['vul_report', 'vul_summary', 'vul_count']
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The columnar output requires pyarrow (`pip install pyarrow`)") from e
+    return pyarrow
+
+
+def _partition_dir(dataset_path: str, partition: tuple):
+    # Hive directory of a (model, iteration, prompt) partition, values URI-escaped as pyarrow writes them
+    return os.path.join(dataset_path, *[f"{col}={quote(str(val), safe='')}" for col, val in zip(PARTITION_COLS, partition)])
+
+
+def flatten_metrics(rows: list):
+    """
+    Split the metrics of `SmartCMetrics.get_sc_metrics` (plus model, iteration, prompt and legal agreement)
+    into a flat metrics table and a long-format findings table
+    :param rows: list of metrics dicts
+    :return: (metrics DataFrame, findings DataFrame)
+    """
+    metrics = []
+    findings = []
+    for row in rows:
+        flat = {key: val for key, val in row.items() if key not in NESTED_COLUMNS}
+        # Results stored before the analysis status existed
+        flat.setdefault('status', 'analyzed' if row.get('compilable') else 'not_compilable')
+        vul_count = row.get('vul_count') or {}
+        for impact in ['high', 'medium', 'low']:
+            flat[f'vul_{impact}'] = vul_count.get(impact, 0)
+        for key in JSON_COLUMNS:
+            if key in flat:
+                flat[key] = json.dumps(flat[key], default=str)
+        flat['temperature'] = str(flat.get('temperature'))
+        flat['iteration'] = str(flat.get('iteration'))
+        metrics.append(flat)
+
+        compilable = row.get('compilable')
+        for vuln in (row.get('vul_report') or {}).get('vulns', []):
+            description = vuln.get('description')
+            findings.append({
+                'model': row.get('model'),
+                'iteration': str(row.get('iteration')),
+                'prompt': row.get('prompt'),
+                'legal_agreement': row.get('legal_agreement'),
+                'name': row.get('name'),
+                # Results stored before other tools were supported are slither's
+                'tool': vuln.get('tool', 'slither'),
+                'check': vuln.get('check', 'Compilation error' if not compilable else None),
+                'impact': vuln.get('impact'),
+                'confidence': vuln.get('confidence'),
+                'description': '\n'.join(description) if isinstance(description, list) else description,
+                'first_markdown_element': vuln.get('first_markdown_element'),
+            })
+    return pd.DataFrame(metrics), pd.DataFrame(findings, columns=['model', 'iteration', 'prompt', 'legal_agreement', 'name', 'tool', 'check', 'impact', 'confidence', 'description', 'first_markdown_element'])
+
+
+def write_dataset(pipe_output_path: str, metrics: pd.DataFrame, findings: pd.DataFrame = None):
+    """
+    Write the metrics and findings tables as Parquet datasets partitioned by model/iteration/prompt.
+    Partitions being written replace the existing ones, the others are left untouched. Given a findings
+    table, the findings of every metrics partition written are replaced too, even when it has no finding.
+    :param pipe_output_path: root path of the pipeline output
+    :param findings: findings of the metrics, None to only write the metrics (i.e., re-scoring)
+    """
+    pyarrow = _require_pyarrow()
+    if findings is None:
+        findings = pd.DataFrame()
+    elif not metrics.empty:
+        # 'delete_matching' only replaces the partitions written, stale findings would be left where none is found anymore
+        for partition in metrics[PARTITION_COLS].drop_duplicates().itertuples(index=False):
+            shutil.rmtree(_partition_dir(os.path.join(pipe_output_path, FINDINGS_DATASET), tuple(partition)), ignore_errors=True)
+    for data, name in [(metrics, METRICS_DATASET), (findings, FINDINGS_DATASET)]:
+        if data.empty:
+            continue
+        table = pyarrow.Table.from_pandas(data, preserve_index=False)
+        pyarrow.parquet.write_to_dataset(table, os.path.join(pipe_output_path, name), partition_cols=PARTITION_COLS,
+                                         existing_data_behavior='delete_matching')
+        logging.info(f"{len(data)} rows saved to {os.path.join(pipe_output_path, name)}")
+
+
+def load_metrics(pipe_output_path: str, filters: list = None):
+    """
+    Load the metrics table of every model, iteration and prompt
+    :param pipe_output_path: root path of the pipeline output
+    :param filters: pyarrow filters, i.e. [('model', '==', 'gpt-4o')]
+    :return: DataFrame
+    """
+    _require_pyarrow()
+    return pd.read_parquet(os.path.join(pipe_output_path, METRICS_DATASET), filters=filters)
+
+
+def load_findings(pipe_output_path: str, filters: list = None):
+    """
+    Load the findings table (one row per finding) of every model, iteration and prompt
+    :param pipe_output_path: root path of the pipeline output
+    :param filters: pyarrow filters, i.e. [('impact', '==', 'High')]
+    :return: DataFrame
+    """
+    _require_pyarrow()
+    return pd.read_parquet(os.path.join(pipe_output_path, FINDINGS_DATASET), filters=filters)
+
+
+def export_excel(pipe_output_path: str, metrics: pd.DataFrame = None):
+    """
+    Derive the `<model>/sc_metrics_<model>_<n_iter>.xlsx` workbooks from the metrics dataset
+    :param pipe_output_path: root path of the pipeline output
+    :param metrics: metrics table, loaded from the dataset if None
+    """
+    metrics = load_metrics(pipe_output_path) if metrics is None else metrics
+    for (model, n_test), data in metrics.groupby(['model', 'iteration'], observed=True):
+        data = data.drop(columns=['model', 'iteration']).set_index(['prompt', 'legal_agreement'])
+        where_to_save = os.path.join(pipe_output_path, str(model), f'sc_metrics_{model}_{n_test}.xlsx')
+        data.to_excel(where_to_save, index=True, header=True)
+        logging.info(f"Metrics saved to {where_to_save}")
@@ -0,0 +1,99 @@
+import sys
+import logging
+import pandas as pd
+from .core.config import settings
+
+# Named weight profiles over the columns of the metrics table (see `results.flatten_metrics`).
+# A nested dict sums several columns into a single score, i.e. 'vul_count' -> 'vul_count_score'.
+# Extra profiles can be configured with SCORE_WEIGHT_PROFILES, i.e. '{"secure": {"compilable": 1, "vul_count": {"vul_high": -5}}}'
+WEIGHT_PROFILES = {
+    'default': {
+        'compilable': 1,
+        'vul_count': {
+            'vul_high': -1,
+            'vul_medium': -0.5,
+            'vul_low': -0.25
+        },
+        'has_comments': 0.5,
+        'no_param_with_initial_value': 0.5,
+        'no_contracts': 0.25,
+        'no_functions': 0.15,
+        # 'no_external_calls': 0.5,
+        'pragma': 1
+    },
+}
+
+# Derived features, scored like any other column
+FEATURES = {
+    # Solidity 0.8.x (checked arithmetic)
+    'pragma': lambda data: (data['no_pragma'] == 8).astype(int),
+}
+
+
+def get_profile(profile: str | dict = None):
+    """
+    Get a weight profile
+    :param profile: profile name (SCORE_PROFILE by default) or weights dict
+    :return: weights dict
+    """
+    if isinstance(profile, dict):
+        return profile
+    profiles = {**WEIGHT_PROFILES, **settings.SCORE_WEIGHT_PROFILES}
+    name = profile or settings.SCORE_PROFILE
+    if name not in profiles:
+        raise ValueError(f"Unknown weight profile '{name}', available profiles: {', '.join(profiles)}")
+    return profiles[name]
+
+
+def score(data: pd.DataFrame, profile: str | dict = None):
+    """
+    Score every smart contract of the metrics table in a single columnar pass.
+    Non compilable contracts score 0.
+    :param data: metrics table (one row per contract)
+    :param profile: weight profile name or weights dict
+    :return: copy of the table with a '<key>_score' column per weight and 'total_score'
+    """
+    weights = get_profile(profile)
+    # Scores of a previous weighting are replaced
+    data = data.drop(columns=[col for col in data.columns if col.endswith('_score')])
+    compilable = data['compilable'].fillna(False).astype(bool)
+
+    def column(key):
+        values = FEATURES[key](data) if key in FEATURES else data[key]
+        return pd.to_numeric(values, errors='coerce').fillna(0)
+
+    scores = {}
+    for key, val in weights.items():
+        if isinstance(val, dict):
+            scores[f'{key}_score'] = sum(column(k) * v for k, v in val.items())
+        else:
+            scores[f'{key}_score'] = column(key) * val
+    scores = pd.DataFrame(scores, index=data.index).where(compilable, 0)
+    scores['total_score'] = scores.sum(axis=1)
+    return pd.concat([data, scores], axis=1)
+
+
+def rescore(pipe_output_path: str, profile: str | dict = None, excel: bool = False):
+    """
+    Re-score the metrics dataset of a pipeline output with another weight profile, without re-running the analysis
+    :param pipe_output_path: root path of the pipeline output
+    :param profile: weight profile name or weights dict
+    :param excel: also derive the Excel workbooks
+    :return: scored metrics table
+    """
+    from . import results
+    data = score(results.load_metrics(pipe_output_path), profile)
+    # Partition columns are read back as categories
+    for col in results.PARTITION_COLS:
+        data[col] = data[col].astype(str)
+    # The findings are not touched by the scores
+    results.write_dataset(pipe_output_path, data)
+    if excel:
+        results.export_excel(pipe_output_path, data)
+    logging.info(f"{len(data)} smart contracts re-scored with profile '{profile or settings.SCORE_PROFILE}'")
+    return data
+
+
+if __name__ == '__main__':
+    # python -m pipeline.scoring <pipe output path> [profile]
+    rescore(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,140 @@
+import re
+
+# Single tokenizer for the whole source: comments and strings are matched first, so that
+# keywords inside them are never mistaken for code. Whitespace is skipped by `finditer`.
+TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>//[^\r\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>"(?:\\.|[^"\\\r\n])*"|'(?:\\.|[^'\\\r\n])*')
+  | (?P<ident>[A-Za-z_$][A-Za-z0-9_$]*)
+  | (?P<number>\d[\w.]*)
+  | (?P<operator>=>|==|!=|<=|>=|[-+*/%|&^]=)
+  | (?P<punct>[{}();=])
+  | (?P<other>[^\sA-Za-z0-9_${}();="'/]+|/)
+""", re.DOTALL | re.VERBOSE)
+
+VERSION_PATTERN = re.compile(r"\d+\.\d+\.\d+")
+
+CONTAINER_KINDS = {'contract', 'interface', 'library'}
+
+# Contract-level statements that are not state variable declarations
+NON_VARIABLE_KEYWORDS = {'function', 'modifier', 'constructor', 'fallback', 'receive', 'event', 'error', 'struct', 'enum', 'using'}
+
+
+def parse_solidity(source: str):
+    """
+    Parse a Solidity source in a single pass
+    :param source: Solidity source code
+    :return: dict with
+        'code': source without comments,
+        'comments': list of comments,
+        'pragma': solidity version constraint (i.e., '^0.8.0'), None if missing,
+        'imports': list of imported paths (text between `import` and `;`),
+        'contracts': dict name -> {'kind', 'functions', 'modifiers', 'state_variables': [(name, initial value or None)]}
+    """
+    code = []
+    comments = []
+    imports = []
+    contracts = {}
+    pragma = None
+
+    last_end = 0
+    depth = 0
+    contract = None  # contract being parsed
+    contract_depth = None  # depth of the contract body
+    header = []  # tokens of the current top-level header (pragma, import, contract declaration)
+    stmt = []  # tokens of the current contract-level statement
+
+    for match in TOKEN_PATTERN.finditer(source):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == 'comment':
+            comments.append(text)
+            code.append(source[last_end:match.start()])
+            last_end = match.end()
+            continue
+
+        if contract is None:
+            # ---- Top level: pragma, imports and contract declarations
+            if text == ';':
+                if header and header[0][1] == 'pragma' and len(header) > 1 and header[1][1] == 'solidity' and pragma is None:
+                    pragma = source[header[1][2]:match.start()].strip()
+                elif header and header[0][1] == 'import':
+                    imports.append(source[header[0][2]:match.start()].strip())
+                header = []
+            elif text == '{':
+                idents = [t for k, t, _ in header if k == 'ident']
+                container = next((i for i, t in enumerate(idents) if t in CONTAINER_KINDS), None)
+                if container is not None and container + 1 < len(idents):
+                    name = idents[container + 1]
+                    kind_name = ('abstract ' if 'abstract' in idents[:container] else '') + idents[container]
+                    contract = contracts.setdefault(name, {'kind': kind_name, 'functions': [], 'modifiers': [], 'state_variables': []})
+                    contract_depth = depth + 1
+                header = []
+                depth += 1
+            elif text == '}':
+                depth = max(0, depth - 1)
+            else:
+                header.append((kind, text, match.end()))
+            continue
+
+        # ---- Inside a contract
+        if text == '{':
+            if depth == contract_depth:
+                _add_statement(contract, stmt, source, match.start(), has_body=True)
+                stmt = []
+            depth += 1
+        elif text == '}':
+            depth -= 1
+            if depth < contract_depth:
+                contract = None
+                contract_depth = None
+                stmt = []
+        elif depth == contract_depth:
+            if text == ';':
+                _add_statement(contract, stmt, source, match.start(), has_body=False)
+                stmt = []
+            else:
+                stmt.append((kind, text, match.end()))
+
+    code.append(source[last_end:])
+    return {
+        'code': ''.join(code),
+        'comments': comments,
+        'pragma': pragma,
+        'imports': imports,
+        'contracts': contracts,
+    }
+
+
+def _add_statement(contract: dict, stmt: list, source: str, end: int, has_body: bool):
+    if not stmt:
+        return
+    first = stmt[0][1]
+    if first == 'function':
+        name = stmt[1][1] if len(stmt) > 1 and stmt[1][0] == 'ident' else 'fallback'
+        contract['functions'].append(name)
+    elif first == 'modifier':
+        if len(stmt) > 1:
+            contract['modifiers'].append(stmt[1][1])
+    elif first in NON_VARIABLE_KEYWORDS or has_body:
+        return
+    else:
+        # State variable: `<type> [visibility/constant/...] <name> [= <value>];`
+        texts = [t for _, t, _ in stmt]
+        if '=' in texts:
+            idx = texts.index('=')
+            idents = [t for k, t, _ in stmt[:idx] if k == 'ident']
+            value = source[stmt[idx][2]:end].strip()
+        else:
+            idents = [t for k, t, _ in stmt if k == 'ident']
+            value = None
+        if idents:
+            contract['state_variables'].append((idents[-1], value))
+
+
+def get_version(pragma: str):
+    """
+    Get the first explicit version of a pragma constraint (i.e., '>=0.8.0 <0.9.0' -> '0.8.0')
+    """
+    match = VERSION_PATTERN.search(pragma or '')
+    return match.group(0) if match else None
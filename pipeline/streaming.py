@@ -0,0 +1,68 @@
+import re
+
+CODE_ONLY_PATTERN = r"pragma solidity.*}"
+
+
+class SolidityStreamExtractor:
+    """Follows a streamed model response and detects, on the fly, when the fenced
+    code block containing the Solidity code (```solidity ... ```) is closed."""
+
+    PRAGMA = "pragma solidity"
+    FENCE = "```"
+
+    def __init__(self):
+        self.__text = ""
+        self.__pragma_idx = -1
+        self.__search_from = 0
+        self.__closed = False
+
+    @property
+    def text(self):
+        return self.__text
+
+    @property
+    def has_pragma(self):
+        return self.__pragma_idx != -1
+
+    @property
+    def closed(self):
+        return self.__closed
+
+    @property
+    def code(self):
+        """
+        :return: Solidity code found so far, None if missing
+        """
+        match = re.search(CODE_ONLY_PATTERN, self.__text, re.DOTALL)
+        return match.group(0) if match else None
+
+    def feed(self, delta: str):
+        """
+        Add a delta of the response
+        :param delta: new text
+        :return: True once the code block is closed
+        """
+        if not delta:
+            return self.__closed
+        self.__text += delta
+        if self.__closed:
+            return True
+        if self.__pragma_idx == -1:
+            # Search only the new text (plus an overlap for tokens split across deltas)
+            self.__pragma_idx = self.__text.find(self.PRAGMA, self.__search_from)
+            if self.__pragma_idx == -1:
+                self.__search_from = max(0, len(self.__text) - len(self.PRAGMA))
+                return False
+            # Without an opening fence (plain code response) there is no end marker to wait for
+            if self.__text.rfind(self.FENCE, 0, self.__pragma_idx) == -1:
+                self.__search_from = -1
+                return False
+            self.__search_from = self.__pragma_idx
+        if self.__search_from == -1:
+            return False
+        close_idx = self.__text.find("\n" + self.FENCE, self.__search_from)
+        if close_idx != -1:
+            self.__closed = True
+        else:
+            self.__search_from = max(self.__pragma_idx, len(self.__text) - len(self.FENCE) - 1)
+        return self.__closed
@@ -0,0 +1,38 @@
+import os
+from typing import NamedTuple
+
+
+class SweepCell(NamedTuple):
+    """One cell of the experimental grid: a single generation request."""
+    model: str
+    iteration: int
+    prompt_name: str
+    legal_agreement_file_path: str
+    temperature: float
+    output_path: str
+
+
+def iter_cells(legal_agreement_path: str, models: list, prompts: dict, n_iter: int = 1, temperatures: list = [0.5], output_root: str = 'output'):
+    """
+    Enumerate the (model, iteration, prompt, agreement, temperature) grid
+    :param legal_agreement_path: folder containing the legal agreements
+    :param models: list of model names
+    :param prompts: dict prompt name -> lambda prompt (see `pipeline.prompts.PROMPTS`)
+    :param n_iter: number of repeated iterations
+    :param temperatures: temperatures to evaluate
+    :param output_root: output root relative to the shared folder
+    :return: generator of `SweepCell`
+    """
+    assert os.path.exists(legal_agreement_path), f"Given path for legal agreements'{legal_agreement_path}' does not exist"
+    files = sorted(os.listdir(legal_agreement_path))
+    assert files, f"Given path for legal agreements'{legal_agreement_path}' is empty"
+
+    # Same layout as `main.py`: <output_root>/<model>/<n_iter>/<prompt key>/<legal agreement name>
+    for model in models:
+        for i in range(1, n_iter + 1):
+            for pr_name in prompts.keys():
+                for file in files:
+                    file_name, _ = os.path.splitext(file)
+                    abs_file = os.path.join(legal_agreement_path, file)
+                    for temperature in temperatures:
+                        yield SweepCell(model, i, pr_name, abs_file, temperature, os.path.join(output_root, model, str(i), pr_name, file_name))
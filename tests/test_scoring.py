@@ -0,0 +1,41 @@
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('pyarrow')
+
+from pipeline import results, scoring
+
+
+def metrics_row(name: str, vul_high: int):
+    return {
+        'model': 'gpt-4o', 'iteration': '1', 'prompt': 'PR1', 'legal_agreement': 'lease', 'name': name,
+        'compilable': True, 'no_pragma': 8, 'vul_high': vul_high, 'vul_medium': 0, 'vul_low': 0, 'has_comments': 1,
+        'no_param_with_initial_value': 0, 'no_contracts': 1, 'no_functions': 2,
+    }
+
+
+def findings_row(name: str):
+    return {
+        'model': 'gpt-4o', 'iteration': '1', 'prompt': 'PR1', 'legal_agreement': 'lease', 'name': name, 'tool': 'slither',
+        'check': 'reentrancy-eth', 'impact': 'High', 'confidence': 'Medium', 'description': 'Reentrancy', 'first_markdown_element': 'a.sol#L1',
+    }
+
+
+def test_rescore_keeps_findings(tmp_path):
+    metrics = pd.DataFrame([metrics_row('a_t0.5.sol', 1), metrics_row('b_t0.5.sol', 0)])
+    results.write_dataset(str(tmp_path), metrics, pd.DataFrame([findings_row('a_t0.5.sol')]))
+
+    data = scoring.rescore(str(tmp_path), {'compilable': 1, 'vul_count': {'vul_high': -2}})
+
+    assert sorted(data['total_score']) == [-1, 1]
+    assert list(results.load_findings(str(tmp_path))['name']) == ['a_t0.5.sol']
+
+
+def test_write_dataset_replaces_findings_of_rewritten_partitions(tmp_path):
+    metrics = pd.DataFrame([metrics_row('a_t0.5.sol', 1)])
+    results.write_dataset(str(tmp_path), metrics, pd.DataFrame([findings_row('a_t0.5.sol')]))
+
+    # The contract has no finding anymore
+    results.write_dataset(str(tmp_path), metrics.assign(vul_high=0), pd.DataFrame(columns=list(findings_row('a_t0.5.sol'))))
+
+    assert results.load_findings(str(tmp_path)).empty